@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+"""
+Logging Client Microbenchmark
+
+Measures the per-call cost of Logger.__call__ on the client side (no daemon
+needs to be running), next to the inspect.stack() based caller capture the
+client used to do, and the cost of calls dropped by level filtering and rate
+limiting.
+"""
+
+import inspect
+import timeit
+
+from auvlog import client
+from auvlog.client import log
+
+N = 20000
+
+def per_call(stmt, n=N):
+  return min(timeit.repeat(stmt, number=n, repeat=3, globals=globals())) / n * 1e6
+
+def report(name, us):
+  print('{0:<32} {1:8.2f} us/call'.format(name, us))
+
+def old_capture():
+  frame = inspect.stack()[1]
+  return frame[1], frame[2], frame[3], frame[4][0] if frame[4] is not None else ''
+
+if __name__ == '__main__':
+  report('inspect.stack() capture', per_call('old_capture()', N // 10))
+  report('log.bench.info(...)', per_call('log.bench.info("benchmark message")'))
+
+  client.set_level('warn')
+  report('log.bench.info(...) filtered', per_call('log.bench.info("benchmark message")'))
+  client.set_level('verbose')
+
+  client.set_rate_limit(10)
+  report('log.bench.info(...) rate limited', per_call('log.bench.info("benchmark message")'))
+  client.set_rate_limit(None)
@@ -10,8 +10,9 @@ See "example.py" for usage.
 from __future__ import print_function
 
 import time
-import inspect
 import json
+import linecache
+import os
 import sys
 import termcolor
 
@@ -57,6 +58,46 @@ _print_format = lambda tree, timestamp, msg, filename, lineno, block, linetxt: \
         msg
     )
 
+# Severity of the conventional level names used as the last element of a tree
+# (see mission.framework.task.Task.log). Trees ending in anything else are
+# never filtered by level.
+LEVELS = {'verbose': 0, 'debug': 1, 'info': 2, 'warn': 3, 'error': 4}
+
+_min_level = LEVELS.get(os.environ.get('AUVLOG_LEVEL', ''), 0)
+_rate_limit = None
+
+def set_level(level):
+  """
+  Drop messages from trees ending in a level below level (e.g. 'info'),
+  before any formatting work is done.
+  """
+  global _min_level
+  _min_level = LEVELS[level]
+
+def set_rate_limit(per_second):
+  """
+  Allow at most per_second messages per second from each tree at each call
+  site; excess messages are dropped and counted in the next message that gets
+  through. None disables rate limiting.
+  """
+  global _rate_limit
+  _rate_limit = per_second
+
+# (filename, lineno) -> source line, filled in on first use
+_lines = {}
+
+def _line(filename, lineno):
+  key = (filename, lineno)
+  try:
+    return _lines[key]
+  except KeyError:
+    line = linecache.getline(filename, lineno)
+    _lines[key] = line
+    return line
+
+# (tree, call site) -> [time of last message, messages dropped since]
+_sites = {}
+
 class Logger:
 
     """
@@ -65,22 +106,51 @@ class Logger:
     To use, make an instance of this class. Any instance will log with it's current prefix. A prefix is a tuple of
     strings that can either be passed in as *args, or a level can be added by accessing an attribute of any current
     instance. Any instance can be called with a message to be logged.
+
+    Helpers that log on behalf of their caller pass the depth of the caller's
+    frame (1 is whoever called the logger), so that the message is attributed
+    to, and rate limited at, the real call site.
     """
 
     def __init__(self, tree):
         self.tree = tree
+        self._joined = '.'.join(tree)
+        self._level = LEVELS.get(tree[-1]) if tree else None
+        self._children = {}
+
+    def __call__(self, message, copy_to_stdout = False, depth = 1):
+        if self._level is not None and self._level < _min_level:
+            return
+
+        frame = sys._getframe(depth)
+        code = frame.f_code
+        lineno = frame.f_lineno
+        now = time.time()
+
+        suppressed = 0
+        if _rate_limit is not None:
+            key = (self._joined, code, lineno)
+            site = _sites.get(key)
+            if site is None:
+                _sites[key] = [now, 0]
+            elif now - site[0] < 1.0 / _rate_limit:
+                site[1] += 1
+                return
+            else:
+                suppressed = site[1]
+                site[0], site[1] = now, 0
 
-    def __call__(self, message, copy_to_stdout = False):
-        frame = inspect.stack()[1]
         formatted = _fmt(
-            '.'.join(self.tree),
-            time.time(),
+            self._joined,
+            now,
             message,
-            frame[1],
-            frame[2],
-            frame[3],
-            frame[4][0] if frame[4] is not None else ''
+            code.co_filename,
+            lineno,
+            code.co_name,
+            _line(code.co_filename, lineno)
         )
+        if suppressed:
+            formatted['suppressed'] = suppressed
         #not sure why, but this call sometimes freezes without this.
         time.sleep(0)
 
@@ -100,7 +170,12 @@ class Logger:
         return 'Logger<tree:{0}>'.format(self.tree)
 
     def __getattr__(self, key):
-        return Logger(self.tree + [key])
+        if key in ('_children', '_joined', '_level'):
+            raise AttributeError(key)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = Logger(self.tree + [key])
+        return child
 
 
 log = Logger([])
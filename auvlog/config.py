@@ -3,3 +3,13 @@
 CLIENT_PORT = '7654'
 SERVER_PORT = '6543'
 KEY = '!LOGS'
+
+# Daemon
+LOG_DIR = '/var/log/auv/current'
+REDIS_LENGTH = int(1e5)      # entries kept in the redis list
+BATCH_MAX = 1000             # messages drained from the socket per batch
+SEGMENT_MAX_BYTES = 64 * 1024 ** 2
+SEGMENT_MAX_AGE = 3600       # seconds before a log segment is rotated
+FSYNC_INTERVAL = 1.0         # seconds between fsyncs of the current segment
+STATS_KEY = '!LOGS_STATS'    # redis hash of daemon counters
+STATS_INTERVAL = 1.0
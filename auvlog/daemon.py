@@ -4,32 +4,112 @@
 Logging Daemon
 
 (c) Christopher Goes 2015
+
+Messages are drained from the SUB socket in batches. Each batch is pushed to
+redis in one pipelined round trip, appended to the current log segment with a
+single write and forwarded to readers. Counters are published to the redis
+hash config.STATS_KEY every config.STATS_INTERVAL seconds.
 """
 
+import errno
+import time
+
 import nanomsg
 import redis
+from redis import RedisError
 
 from auvlog import config
+from auvlog.segments import SegmentWriter
 
 redis = redis.StrictRedis()
 
 socketS = nanomsg.Socket(nanomsg.SUB)
 socketS.set_string_option(nanomsg.SUB, nanomsg.SUB_SUBSCRIBE, '')
+# wake up regularly when idle so segments still get synced and rotated
+socketS.set_int_option(nanomsg.SOL_SOCKET, nanomsg.RCVTIMEO, int(config.FSYNC_INTERVAL * 1000))
 socketS.bind("tcp://*:{0}".format(config.CLIENT_PORT))
 
 socketP = nanomsg.Socket(nanomsg.PUB)
 socketP.bind("tcp://*:{0}".format(config.SERVER_PORT))
 
-def push_to_file(entry):
+_EMPTY = (errno.EAGAIN, errno.ETIMEDOUT)
+
+def drain():
+  """ Blocks for one message (or the receive timeout), then takes whatever else is queued. """
+  batch = []
+  flags = 0
+  while len(batch) < config.BATCH_MAX:
+    try:
+      batch.append(socketS.recv(flags=flags))
+    except nanomsg.NanoMsgAPIError as e:
+      if e.errno not in _EMPTY:
+        raise
+      break
+    flags = nanomsg.DONTWAIT
+  return batch
+
+def push_to_redis(batch):
+  pipe = redis.pipeline(transaction=False)
+  pipe.lpush(config.KEY, *batch)
+  pipe.ltrim(config.KEY, 0, config.REDIS_LENGTH)
+  pipe.execute()
+
+def push_to_file(batch):
+  global writer
+  try:
+    if writer is None:
+      writer = SegmentWriter(config.LOG_DIR, config.SEGMENT_MAX_BYTES,
+                             config.SEGMENT_MAX_AGE, config.FSYNC_INTERVAL)
+    writer.write(batch)
+  except (IOError, OSError):
+    print('Warning: Unable to write {0} log entries to file.'.format(len(batch)))
+    writer = None
+
+stats = {
+  'received': 0,
+  'batches': 0,
+  'max_batch': 0,
+  'last_batch': 0,
+  'rate': 0.0,
+  'bytes_written': 0,
+  'rotations': 0,
+}
+
+def publish_stats(now):
+  global last_stats, last_received
+  stats['rate'] = (stats['received'] - last_received) / (now - last_stats)
+  if writer is not None:
+    stats['bytes_written'] = writer.bytes_written
+    stats['rotations'] = writer.rotations
+  last_stats, last_received = now, stats['received']
   try:
-    f = open('/var/log/auv/current/auvlog.log', 'ab')
-    f.write(entry + b'\n')
-  except IOError:
-    print('Warning: Unable to write log entry to file.')
+    redis.hmset(config.STATS_KEY, stats)
+  except RedisError:
+    pass
+
+writer = None
+last_stats, last_received = time.time(), 0
 
 while True:
-    res = socketS.recv()
-    redis.lpush(config.KEY, res)
-    redis.ltrim(config.KEY, 0, int(1e5))
-    push_to_file(res)
-    socketP.send(res)
+  batch = drain()
+  if batch:
+    stats['received'] += len(batch)
+    stats['batches'] += 1
+    stats['last_batch'] = len(batch)
+    stats['max_batch'] = max(stats['max_batch'], len(batch))
+
+    push_to_redis(batch)
+    push_to_file(batch)
+    for res in batch:
+      socketP.send(res)
+
+  if writer is not None:
+    try:
+      writer.tick()
+    except (IOError, OSError):
+      print('Warning: Unable to sync log file.')
+      writer = None
+
+  now = time.time()
+  if now - last_stats >= config.STATS_INTERVAL:
+    publish_stats(now)
@@ -2,17 +2,19 @@
 
 """
 Log Reader (duh)
+
+With --query, messages are looked up in the daemon's indexed log segments
+instead of redis, and the reader exits once they are printed.
 """
 
 import time
 import json
 import argparse
 
-import nanomsg
 import termcolor
-import redis
 
 from auvlog import config
+from auvlog import segments
 
 
 parser = argparse.ArgumentParser()
@@ -33,6 +35,29 @@ parser.add_argument(
     help='Maximum displayed width of logging tree (in characters)',
     default=20,
     type=int)
+parser.add_argument(
+    '-q',
+    '--query',
+    action='store_true',
+    help='Query the on-disk log history instead of following live messages.')
+parser.add_argument(
+    '--dir',
+    help='Log directory to query; default {0}.'.format(config.LOG_DIR),
+    default=config.LOG_DIR)
+parser.add_argument(
+    '--from',
+    dest='start',
+    help='With --query, show messages from this time on: seconds ago, or '
+    '\'YYYY/MM/DD HH:MM:SS\'.')
+parser.add_argument(
+    '--to',
+    dest='end',
+    help='With --query, show messages up to this time (same formats as --from).')
+parser.add_argument(
+    '-p',
+    '--prefix',
+    help='With --query, only show messages whose tree starts with PREFIX '
+    '(i.e. \'mission\' matches \'mission.main\').')
 parser.add_argument(
     'tags',
     nargs='*',
@@ -41,9 +66,15 @@ parser.add_argument(
     'be captured.')
 args = parser.parse_args()
 
+def parse_time(text):
+    try:
+        return time.time() - float(text)
+    except ValueError:
+        return time.mktime(time.strptime(text, '%Y/%m/%d %H:%M:%S'))
+
 # This nonsense wouldn't be necessary if Python closures worked correctly...
 def mf(msg):
-    if args.filename is not None and msg['filename'] != args.filename:
+    if args.filename is not None and not segments.file_matches(msg['filename'], args.filename):
         return False
     if not (any(all(x in msg['tree'] for x in t.split(
             '+')) for t in args.tags) or len(args.tags) == 0):
@@ -51,16 +82,10 @@ def mf(msg):
     if (args.key is not None) and (
             not isinstance(msg['message'], dict) or args.key not in msg['message']):
         return False
-    if (time.time() - msg['timestamp']) > args.delta:
+    if not args.query and (time.time() - msg['timestamp']) > args.delta:
         return False
     return True
 
-socket = nanomsg.Socket(nanomsg.SUB)
-socket.set_string_option(nanomsg.SUB, nanomsg.SUB_SUBSCRIBE, '')
-socket.connect("tcp://127.0.0.1:{0}".format(config.SERVER_PORT))
-
-redis = redis.StrictRedis()
-
 def _tree_fmt(tree):
   if len(tree) <= args.w__width:
     return tree.ljust(args.w__width)
@@ -100,6 +125,26 @@ def handle(msg):
                 msg['block'],
                 msg['linetxt']))
 
+if args.query:
+    found = segments.query(
+        args.dir,
+        start=None if args.start is None else parse_time(args.start),
+        end=None if args.end is None else parse_time(args.end),
+        tree=args.prefix,
+        filename=args.filename)
+    for message in found:
+        handle(message)
+    raise SystemExit
+
+import nanomsg
+import redis
+
+socket = nanomsg.Socket(nanomsg.SUB)
+socket.set_string_option(nanomsg.SUB, nanomsg.SUB_SUBSCRIBE, '')
+socket.connect("tcp://127.0.0.1:{0}".format(config.SERVER_PORT))
+
+redis = redis.StrictRedis()
+
 cached = (json.loads(msg.decode()) for msg in redis.lrange(config.KEY, 0, -1))
 for message in cached:
     handle(message)
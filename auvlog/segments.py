@@ -0,0 +1,279 @@
+"""
+Rotating, indexed log segments for the logging daemon.
+
+Entries are appended, one JSON message per line, to <directory>/auvlog.log
+through a single buffered file handle. Once the segment grows past max_bytes
+or is older than max_age seconds it is closed and renamed to
+auvlog.<sequence>.log, and a fresh auvlog.log is started.
+
+Every segment has an index next to it (auvlog.log.idx, auvlog.<sequence>.idx)
+with one JSON line per block of up to BLOCK_ENTRIES consecutive entries,
+giving the block's byte range, time range and the trees and filenames logged
+in it. On rotation the same summary for the whole segment is appended to
+<directory>/segments.idx. query() skips segments and blocks whose summary
+cannot match, reading only the remaining blocks plus any unindexed tail left
+behind if the daemon died mid-block.
+"""
+
+import json
+import os
+import re
+import time
+
+CURRENT = 'auvlog.log'
+MANIFEST = 'segments.idx'
+_ROTATED = re.compile(r'^auvlog\.(\d+)\.log$')
+
+BLOCK_ENTRIES = 256
+
+
+def index_path(segment):
+    return segment[:-len('.log')] + '.idx' if _ROTATED.match(os.path.basename(segment)) else segment + '.idx'
+
+
+def rotated_segments(directory):
+    """ Returns the paths of the rotated segments in directory, oldest first. """
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    found = sorted((int(m.group(1)), name) for (m, name) in
+                   ((_ROTATED.match(name), name) for name in names) if m)
+    return [os.path.join(directory, name) for (n, name) in found]
+
+
+def segments(directory):
+    """ Returns the paths of every segment in directory, oldest first. """
+    current = os.path.join(directory, CURRENT)
+    return rotated_segments(directory) + ([current] if os.path.exists(current) else [])
+
+
+class _Block:
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.length = 0
+        self.count = 0
+        self.start = None
+        self.end = None
+        self.trees = set()
+        self.files = set()
+
+    def add(self, entry):
+        self.length += len(entry) + 1
+        self.count += 1
+        try:
+            msg = json.loads(entry.decode('utf-8'))
+            t = float(msg['timestamp'])
+            tree, filename = msg['tree'], msg['filename']
+        except (ValueError, KeyError, TypeError):
+            return
+        self.start = t if self.start is None else min(self.start, t)
+        self.end = t if self.end is None else max(self.end, t)
+        self.trees.add(tree)
+        self.files.add(filename)
+
+    def merge(self, other):
+        self.count += other.count
+        if other.start is not None:
+            self.start = other.start if self.start is None else min(self.start, other.start)
+            self.end = other.end if self.end is None else max(self.end, other.end)
+        self.trees |= other.trees
+        self.files |= other.files
+
+    def record(self):
+        return {
+            'offset': self.offset,
+            'length': self.length,
+            'count': self.count,
+            'start': self.start,
+            'end': self.end,
+            'trees': sorted(self.trees),
+            'files': sorted(self.files),
+        }
+
+
+class SegmentWriter:
+
+    def __init__(self, directory, max_bytes=64 * 1024 ** 2, max_age=3600,
+                 fsync_interval=1.0, buffer_size=1 << 16):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync_interval = fsync_interval
+        self.buffer_size = buffer_size
+
+        rotated = rotated_segments(directory)
+        self.sequence = int(_ROTATED.match(os.path.basename(rotated[-1])).group(1)) if rotated else 0
+
+        self.file = None
+        self.bytes_written = 0
+        self.rotations = 0
+        self._open()
+
+        # a segment left behind by an earlier daemon keeps whatever index it
+        # has; new entries start a segment of their own. Its summary is
+        # unknown, so it is recorded as matching everything.
+        if self.size > 0:
+            self.rotate()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, CURRENT)
+
+    def _open(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.file = open(self.path, 'ab', self.buffer_size)
+        self.index = open(index_path(self.path), 'a')
+        self.size = self.file.tell()
+        self.block = _Block(self.size)
+        self.summary = _Block(0)
+        self.opened = time.time()
+        self.last_sync = self.opened
+
+    def write(self, entries):
+        """ Appends a batch of raw (bytes) entries and flushes them to the OS. """
+        if not entries:
+            return
+        data = b'\n'.join(entries) + b'\n'
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+        self.bytes_written += len(data)
+
+        for entry in entries:
+            self.block.add(entry)
+            if self.block.count >= BLOCK_ENTRIES:
+                self._end_block()
+        self.index.flush()
+
+        if self.size >= self.max_bytes:
+            self.rotate()
+
+    def _end_block(self):
+        if self.block.count:
+            self.index.write(json.dumps(self.block.record()) + '\n')
+            self.summary.merge(self.block)
+            self.block = _Block(self.block.offset + self.block.length)
+
+    def tick(self):
+        """ Handles time based rotation and periodic fsync; call regularly. """
+        now = time.time()
+        if self.size > 0 and now - self.opened >= self.max_age:
+            self.rotate()
+        elif now - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self._end_block()
+        self.file.flush()
+        self.index.flush()
+        os.fsync(self.file.fileno())
+        os.fsync(self.index.fileno())
+        self.last_sync = time.time()
+
+    def rotate(self):
+        self.sync()
+        self.file.close()
+        self.index.close()
+        self.sequence += 1
+        target = os.path.join(self.directory, 'auvlog.{0:05d}.log'.format(self.sequence))
+        os.rename(index_path(self.path), index_path(target))
+        os.rename(self.path, target)
+        self.summary.length = self.size
+        record = self.summary.record()
+        record['segment'] = os.path.basename(target)
+        with open(os.path.join(self.directory, MANIFEST), 'a') as manifest:
+            manifest.write(json.dumps(record) + '\n')
+        self.rotations += 1
+        self._open()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+        self.index.close()
+
+
+def tree_matches(tree, prefix):
+    return tree == prefix or tree.startswith(prefix + '.')
+
+
+def file_matches(logged, filename):
+    return logged == filename or logged.endswith('/' + filename)
+
+
+def _read_index(path):
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        return []
+    blocks = []
+    for line in lines:
+        try:
+            blocks.append(json.loads(line))
+        except ValueError:
+            break  # partially written last line
+    return blocks
+
+
+def _block_matches(block, start, end, tree, filename):
+    if block['start'] is None:
+        return True  # nothing in it could be indexed; read it to be safe
+    if start is not None and block['end'] < start:
+        return False
+    if end is not None and block['start'] > end:
+        return False
+    if tree is not None and not any(tree_matches(t, tree) for t in block['trees']):
+        return False
+    if filename is not None and not any(file_matches(f, filename) for f in block['files']):
+        return False
+    return True
+
+
+def query(directory, start=None, end=None, tree=None, filename=None):
+    """
+    Returns the logged messages (decoded dictionaries) in directory's segments,
+    ordered by timestamp.
+
+    start, end: posix timestamps bounding the messages (inclusive); None is unbounded
+    tree: only messages whose tree is tree or below it (i.e. 'mission' matches 'mission.main')
+    filename: only messages logged from this file (full path or trailing part of it)
+    """
+    summaries = dict((s.get('segment'), s) for s in _read_index(os.path.join(directory, MANIFEST)))
+
+    found = []
+    for segment in segments(directory):
+        summary = summaries.get(os.path.basename(segment))
+        if summary is not None and not _block_matches(summary, start, end, tree, filename):
+            continue
+
+        blocks = _read_index(index_path(segment))
+        ranges = [(b['offset'], b['length']) for b in blocks
+                  if _block_matches(b, start, end, tree, filename)]
+        indexed = blocks[-1]['offset'] + blocks[-1]['length'] if blocks else 0
+        ranges.append((indexed, None))
+
+        with open(segment, 'rb') as f:
+            for (offset, length) in ranges:
+                f.seek(offset)
+                data = f.read() if length is None else f.read(length)
+                for line in data.splitlines():
+                    try:
+                        msg = json.loads(line.decode('utf-8'))
+                        t = msg['timestamp']
+                        if start is not None and t < start:
+                            continue
+                        if end is not None and t > end:
+                            continue
+                        if tree is not None and not tree_matches(msg['tree'], tree):
+                            continue
+                        if filename is not None and not file_matches(msg['filename'], filename):
+                            continue
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    found.append(msg)
+
+    found.sort(key=lambda msg: msg['timestamp'])
+    return found
@@ -0,0 +1,50 @@
+import unittest
+from unittest import mock
+
+from auvlog import client
+from auvlog.client import Logger
+from mission.framework.task import Task
+
+# Messages are sent from the same line for every logger, so that only the tree
+# tells them apart
+def log_from_one_line(logger, message):
+    logger(message)
+
+class RateLimitTest(unittest.TestCase):
+    def setUp(self):
+        client.set_rate_limit(1)
+        client._sites.clear()
+        patcher = mock.patch.object(client, '_log')
+        self.sent = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(client.set_rate_limit, None)
+
+    def messages(self):
+        return [call[0][0] for call in self.sent.call_args_list]
+
+    def test_trees_limited_separately(self):
+        chatty = Logger(['mission', 'chatty', 'info'])
+        quiet = Logger(['mission', 'quiet', 'error'])
+        for i in range(10):
+            log_from_one_line(chatty, 'chatty {}'.format(i))
+        log_from_one_line(quiet, 'quiet')
+
+        sent = [(m['tree'], m['message']) for m in self.messages()]
+        self.assertEqual(sent, [('mission.chatty.info', 'chatty 0'),
+                                ('mission.quiet.error', 'quiet')])
+
+    def test_task_log_attributed_to_caller(self):
+        task = Task()
+        for i in range(5):
+            task.logi('first {}'.format(i))
+        task.logw('second')
+
+        messages = self.messages()
+        self.assertEqual([m['message'] for m in messages], ['first 0', 'second'])
+        for m in messages:
+            self.assertEqual(m['filename'], __file__)
+            self.assertEqual(m['block'], 'test_task_log_attributed_to_caller')
+        self.assertNotEqual(messages[0]['lineno'], messages[1]['lineno'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import numpy as np
+
+# *************************************
+#
+# allocator.py --
+#   Bounded least squares thrust
+#   allocation for the controller
+#
+# *************************************
+
+class BoundedAllocator(object):
+    """
+        Finds thrusts x that minimize the weighted error |w * (A x - b)|^2
+        subject to lower <= x <= upper, using a primal active set method.
+
+        A thrusts to sub matrix has fewer rows than columns, so many thrusts
+        can give the same error. A tiny multiple of |x|^2 is added to the
+        objective to make the solution unique: among the thrusts giving the
+        least error it picks about those of least norm, as the pseudo inverse
+        does when no thruster saturates.
+
+        Each solve starts from the previous solution and its set of thrusters
+        held at a bound, so consecutive control ticks with similar desires
+        usually finish in one or two iterations.
+    """
+    def __init__(self, lower, upper, regularization=1e-9):
+        self.lower = np.array(lower, dtype=float)
+        self.upper = np.array(upper, dtype=float)
+        self.regularization = regularization
+        self.max_iterations = 3 * len(self.lower) + 10
+        self.warm_start(np.zeros(len(self.lower)))
+
+        # iterations taken by the last solve
+        self.iterations = 0
+
+    def warm_start(self, x):
+        """
+            Starts the next solve from thrusts x with no thruster held at a
+            bound, e.g. after the unbounded solution was used
+        """
+        self.x = np.clip(x, self.lower, self.upper)
+        self.at_lower = np.zeros(len(self.lower), dtype=bool)
+        self.at_upper = np.zeros(len(self.lower), dtype=bool)
+
+    def solve(self, A, b, weights=None):
+        """
+            Returns the bounded thrusts best achieving outputs b, where A maps
+            thrusts to outputs and weights scale the error of each output
+        """
+        if weights is not None:
+            A = A * weights[:, np.newaxis]
+            b = b * weights
+
+        # Quadratic objective 1/2 x'Hx + g'x
+        H = A.T.dot(A)
+        H += self.regularization * max(np.trace(H) / len(H), 1e-12) * np.eye(len(H))
+        g = -A.T.dot(b)
+        tolerance = 1e-9 * (np.abs(g).max() + 1)
+
+        lower, upper = self.lower, self.upper
+        at_lower, at_upper = self.at_lower.copy(), self.at_upper.copy()
+        x = np.clip(self.x, lower, upper)
+        x[at_lower] = lower[at_lower]
+        x[at_upper] = upper[at_upper]
+
+        for iteration in range(1, self.max_iterations + 1):
+            free = ~(at_lower | at_upper)
+            held = ~free
+
+            # Best thrusts for the free thrusters with the others held
+            target = x.copy()
+            if free.any():
+                rhs = -(g[free] + H[np.ix_(free, held)].dot(x[held]))
+                target[free] = np.linalg.solve(H[np.ix_(free, free)], rhs)
+
+            # Move towards them until a free thruster hits a bound
+            d = target - x
+            with np.errstate(divide='ignore', invalid='ignore'):
+                steps = np.where(d > 0, (upper - x) / d,
+                                 np.where(d < 0, (lower - x) / d, np.inf))
+            steps[held] = np.inf
+            i = np.argmin(steps)
+            if steps[i] < 1:
+                x += max(steps[i], 0) * d
+                np.clip(x, lower, upper, out=x)
+                if d[i] > 0:
+                    x[i] = upper[i]
+                    at_upper[i] = True
+                else:
+                    x[i] = lower[i]
+                    at_lower[i] = True
+                continue
+
+            x = target
+
+            # Optimal for this active set; release the held thruster whose
+            # bound costs the most, if any is worth releasing
+            gradient = H.dot(x) + g
+            release = np.where(at_lower, -gradient, 0) + np.where(at_upper, gradient, 0)
+            i = np.argmax(release)
+            if release[i] <= tolerance:
+                break
+            at_lower[i] = at_upper[i] = False
+
+        self.iterations = iteration
+        self.x = x
+        self.at_lower, self.at_upper = at_lower, at_upper
+        return x.copy()
@@ -11,13 +11,14 @@ from auvlog.client import log
 from control import vehicle
 from control.optimizer import Optimizer
 from control.pid import PIDLoop
+from control.profiler import StepProfiler
 from control.thruster_manager import ThrusterManager
 from control.util import zero_motors, set_shm_wrench
 
 from misc.utils import watch_thread_wrapper
 
 from shm import control_passive_forces, kalman, settings_control, switches, \
-                control_internal_wrench
+                control_internal_wrench, kalman_timing
 
 # ****************************************************
 #
@@ -55,6 +56,9 @@ def main(args):
         controller_enabled = True
         tm = ThrusterManager()
 
+        # Step timing, published to shm.control_timing
+        profiler = StepProfiler()
+
         kalman_watcher.watch(kalman)
 
         # The main loop
@@ -98,6 +102,19 @@ def main(args):
 
             total_time = time.time() - start_time
 
+            # A step misses its deadline if it overran the rate, or with kalman
+            # lock, if it took longer than the budget or else the period of
+            # kalman steps (kalman is set more than once per step, so a change
+            # during the step does not mean a step was missed)
+            if args['rate']:
+                missed = total_time > step_time
+            elif args['budget']:
+                missed = total_time > args['budget'] / 1000
+            else:
+                kalman_rate = kalman_timing.rate.get()
+                missed = kalman_rate > 0 and total_time > 1 / kalman_rate
+            profiler.record((dt_qs, dt_pass, dt_pid, dt_opt, total_time), missed)
+
             if args['verbose']:
                 times = [("Qs", dt_qs), ("Passives", dt_pass),
                          ("PID", dt_pid), ("Optimizer", dt_opt), ("Total", total_time)]
@@ -117,6 +134,10 @@ def main(args):
         pid.clean()
         zero_motors()
 
+        if args['profile']:
+            profiler.dump(args['profile'])
+            log("Wrote step timing histogram to %s" % args['profile'], copy_to_stdout=True)
+
     watch_thread_wrapper(loop)
 
 if __name__ == "__main__":
@@ -125,4 +146,6 @@ if __name__ == "__main__":
     ap.add_argument('-r', dest='rate', type=float, help='controller step frequency (in HZ)', required=False)
     ap.add_argument('-v', dest='verbose', action='store_true', default=False, help='enable verbose debug output', required=False)
     ap.add_argument('-s', dest='speed', type=float, default=1.0, help='controller real-time speed factor', required=False)
+    ap.add_argument('--budget', type=float, help='step time (in ms) over which a step with kalman lock counts as missed; defaults to the kalman period', required=False)
+    ap.add_argument('--profile', type=str, help='file to write a histogram of step timing to on exit', required=False)
     main(vars(ap.parse_args()))
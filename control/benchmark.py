@@ -1,20 +1,87 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
+'''
+Benchmark of the thrust allocation in Optimizer.optimize against the SLSQP
+optimization it replaced (Optimizer.optimize_slsqp), over random wrenches
+that saturate thrusters.
+
+The wrenches follow a random walk, like the desires of consecutive control
+ticks, so the allocator's warm start is exercised as in the controller.
+'''
+
+import argparse
+import time
 
-import timeit
 import numpy as np
-import random
+
 from control.optimizer import Optimizer
+from control.thruster_manager import ThrusterManager
+
+def saturation(tm, o, wrench):
+    """ The factor by which wrench can be scaled before the exact solution
+        saturates a thruster """
+    x = tm.sub_to_thrusts.dot(wrench)
+    with np.errstate(divide='ignore'):
+        limits = np.where(x > 0, [b[1] for b in o.bounds] / x,
+                                 [b[0] for b in o.bounds] / x)
+    return limits[x != 0].min()
+
+def saturating_wrenches(tm, o, count, scale, step, seed):
+    """ A random walk of wrenches whose exact solutions exceed the thruster
+        bounds by a factor between 1 and scale """
+    rng = np.random.RandomState(seed)
+    direction = rng.randn(6)
+    magnitude = rng.uniform(1, scale)
+    wrenches = []
+    for _ in range(count):
+        direction += step * rng.randn(6)
+        direction /= np.linalg.norm(direction)
+        magnitude = np.clip(magnitude + step * rng.randn() * scale, 1.01, scale)
+        wrenches.append(direction * saturation(tm, o, direction) * magnitude)
+    return wrenches
 
-N = 100
-o = Optimizer()
-o.mapper = o.tm.thrusts_to_outputs()
-thrusts = np.array([8.45, 1.12, -0.15, -12.2, 6.4, 4.4])
-desires = np.array([123, 45, -13, -31.123, 31, 90])
-def timed():
-    o.objective(thrusts, desires)
+def run(o, wrenches, allocate):
+    times = np.zeros(len(wrenches))
+    errors = np.zeros(len(wrenches))
+    violation = 0.
+    for i, wrench in enumerate(wrenches):
+        o.desired_output_s = wrench
+        start = time.perf_counter()
+        x = allocate(wrench)
+        times[i] = time.perf_counter() - start
+        errors[i] = np.sqrt(o.objective(x))
+        violation = max(violation, max(max(b[0] - v, v - b[1]) for b, v in zip(o.bounds, x)))
+    return times, errors, violation
 
 if __name__ == "__main__":
-    print("Value of objective function: %f" % o.objective(thrusts, desires))
-    t = timeit.timeit("timed()", setup="from __main__ import timed", number=N)
-    print("Time for %d calls: %f" % (N, t))
+    ap = argparse.ArgumentParser(description='Benchmark thrust allocation for saturating wrenches.')
+    ap.add_argument('--count', type=int, default=2000, help='number of wrenches')
+    ap.add_argument('--scale', type=float, default=3.0,
+                    help='largest factor by which the exact solution exceeds the bounds')
+    ap.add_argument('--step', type=float, default=0.05, help='random walk step between wrenches')
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    tm = ThrusterManager()
+    o = Optimizer()
+    o.thrusts_output_mat_s = tm.thrusts_to_sub
+    wrenches = saturating_wrenches(tm, o, args.count, args.scale, args.step, args.seed)
+
+    def slsqp(wrench):
+        o.update_error_scale()
+        return o.optimize_slsqp()
+
+    results = [('slsqp', run(o, wrenches, slsqp)),
+               ('allocator', run(o, wrenches, lambda w: o.optimize(tm.sub_to_thrusts, w)))]
+
+    print('{} saturating wrenches, {} thrusters'.format(len(wrenches), len(o.thrusters)))
+    print('{:>10} {:>9} {:>9} {:>9} {:>9} {:>12} {:>10}'.format(
+        'method', 'p50 us', 'p90 us', 'p99 us', 'max us', 'mean error', 'violation'))
+    for name, (times, errors, violation) in results:
+        print('{:>10} {:>9.0f} {:>9.0f} {:>9.0f} {:>9.0f} {:>12.4g} {:>10.2g}'.format(
+            name, *np.percentile(times * 1e6, [50, 90, 99, 100]),
+            np.mean(errors), violation))
 
+    # error is the norm of the weighted output error (see Optimizer.objective)
+    excess = results[1][1][1] - results[0][1][1]
+    print('allocator error minus slsqp error: median {:.3g}, max {:.3g}, min {:.3g}'.format(
+        np.median(excess), excess.max(), excess.min()))
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+'''
+Closed loop benchmark of the controller, without hardware or the simulator.
+
+Runs the steps of auv_controld3 (ThrusterManager, passive forces, PIDLoop and
+Optimizer) against a rigid body model of the vehicle, in simulated time and as
+fast as possible. kalman is written from the state of the model each step, and
+the model is driven by the thrusts of the pwms the controller writes to
+motor_desires plus the same passive forces the controller uses. Desires follow
+a script of setpoints.
+
+Prints how many steps per second were run and the tracking error of each
+degree of freedom. The controller works through shared memory as usual, but no
+daemons are needed. Every group the run writes, inputs to the controller as
+well as its outputs, is restored on exit. Soft kill must be set, so that no
+thrusters can run.
+
+A script is a JSON list of [seconds, {desire: value}] setpoints, where the
+desires are variables of shm.desires. Desires not given keep their values.
+'''
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+import shm
+from auv_python_helpers.angles import heading_sub_degrees
+from conf.vehicle import I
+from control import quat, vehicle
+from control.optimizer import Optimizer
+from control.pid import PIDLoop
+from control.thruster_manager import ThrusterManager
+from control.util import set_shm_wrench
+
+SCRIPTS = {
+    'steps': [
+        [10, {'depth': 1.0, 'heading': 0, 'speed': 0, 'sway_speed': 0, 'pitch': 0, 'roll': 0}],
+        [10, {'heading': 90}],
+        [10, {'depth': 2.0}],
+        [10, {'speed': 0.4}],
+        [10, {'speed': 0, 'sway_speed': 0.3}],
+        [10, {'sway_speed': 0, 'heading': 300}],
+        [10, {'pitch': 20}],
+        [10, {'pitch': 0, 'roll': 15}],
+        [10, {'roll': 0}],
+    ],
+    'hold': [
+        [60, {'depth': 1.5, 'heading': 45, 'speed': 0, 'sway_speed': 0, 'pitch': 0, 'roll': 0}],
+    ],
+}
+
+# Degrees of freedom whose tracking error is reported, as
+# (name, desire, kalman output, angular)
+DOFS = [('velx', 'speed', 'velx', False),
+        ('vely', 'sway_speed', 'vely', False),
+        ('depth', 'depth', 'depth', False),
+        ('heading', 'heading', 'heading', True),
+        ('pitch', 'pitch', 'pitch', True),
+        ('roll', 'roll', 'roll', True)]
+
+# Groups written by the run, as inputs to the controller or by its steps,
+# restored on exit
+SAVED_GROUPS = [shm.kalman, shm.desires, shm.settings_control, shm.motor_desires,
+                shm.control_passive_forces, shm.control_internal_wrench,
+                shm.control_internal_outs, shm.control_internal_opt_errors,
+                shm.control_locked] + \
+               [getattr(shm, 'control_internal_' + name) for (name, _, _, _) in DOFS]
+
+class RigidBody(object):
+    """
+        The vehicle as a rigid body driven by a wrench in sub space. Position
+        and velocity are in world space (north, east, down), angular velocity
+        is in sub space.
+    """
+    def __init__(self, depth=0.0, heading=0.0):
+        self.position = np.array((0.0, 0.0, depth))
+        self.velocity = np.zeros(3)
+        self.orientation = quat.Quaternion(hpr=(heading, 0, 0))
+        self.angular_velocity = np.zeros(3)
+        self.I = np.array(I)
+        self.I_inv = np.linalg.inv(self.I)
+
+        # Distance travelled forward and to starboard, as kalman integrates
+        self.forward = 0.0
+        self.sway = 0.0
+
+    def step(self, wrench, dt):
+        """ Integrates the motion under wrench for dt seconds """
+        accel = self.orientation.matrix().dot(wrench[:3]) / vehicle.mass
+        self.velocity += accel * dt
+        self.position += self.velocity * dt
+
+        heading_quat = quat.Quaternion(hpr=(self.orientation.heading(), 0, 0))
+        forward, sway, _ = heading_quat.conjugate() * (self.velocity * dt)
+        self.forward += forward
+        self.sway += sway
+
+        w = self.angular_velocity
+        self.angular_velocity = w + dt * self.I_inv.dot(wrench[3:] - np.cross(w, self.I.dot(w)))
+
+        rate = np.linalg.norm(self.angular_velocity)
+        if rate > 0:
+            rotation = quat.quat_from_axis_angle(self.angular_velocity / rate, rate * dt)
+            self.orientation = self.orientation * rotation
+            self.orientation.normalize()
+
+    def update_kalman(self, g):
+        """ Sets the outputs of kalman group g from the state of the body """
+        heading, pitch, roll = self.orientation.hpr()
+        g.heading = heading % 360
+        g.heading_cumulative = g.heading
+        g.pitch = pitch
+        g.roll = roll
+        g.q0, g.q1, g.q2, g.q3 = self.orientation.q
+        g.roll_rate, g.pitch_rate, g.heading_rate = np.degrees(self.angular_velocity)
+
+        # Velocities are in the heading frame, as kalman outputs them
+        heading_quat = quat.Quaternion(hpr=(g.heading, 0, 0))
+        g.velx, g.vely, g.depth_rate = heading_quat.conjugate() * self.velocity
+
+        g.north, g.east, g.depth = self.position
+        g.forward = self.forward
+        g.sway = self.sway
+
+def setpoints(script):
+    """ Yields (seconds, desires) with all desires given for each setpoint """
+    d = dict((name, 0.0) for (name, _) in shm.desires._fields)
+    for seconds, values in script:
+        d.update(values)
+        yield seconds, dict(d)
+
+def run(script, dt, settle, quat_pid):
+    t = [0.0]
+    clock = lambda: t[0]
+
+    g = shm.settings_control.get()
+    g.enabled = True
+    g.quat_pid = quat_pid
+    g.buoyancy_forces = True
+    g.drag_forces = True
+    for (name, _, _, _) in DOFS:
+        setattr(g, name + '_active', 1)
+    shm.settings_control.set(g)
+
+    points = list(setpoints(script))
+    d = shm.desires.group()
+    d.update(**points[0][1])
+    shm.desires.set(d)
+
+    body = RigidBody(depth=d.depth, heading=d.heading)
+    k = shm.kalman.get()
+    body.update_kalman(k)
+    shm.kalman.set(k)
+
+    tm = ThrusterManager()
+    pid = PIDLoop(clock=clock)
+    opt = Optimizer(clock=clock)
+    reversed_polarity = np.array([thruster.reversed_polarity for thruster in tm.thrusters])
+    motors = shm.motor_desires.group()
+
+    errors = []
+    settled = []
+    step_times = []
+    start = time.perf_counter()
+    for seconds, values in points:
+        d.update(**values)
+        shm.desires.set(d)
+
+        for i in range(int(round(seconds / dt))):
+            t[0] += dt
+
+            # A step of auv_controld3
+            step_start = time.perf_counter()
+            tm.update(k)
+            passives = vehicle.passive_forces(k, tm)
+            set_shm_wrench(shm.control_passive_forces, passives)
+            pid.step()
+            opt.set_motors(tm, passives)
+            step_times.append(time.perf_counter() - step_start)
+
+            # Thrusts of the pwms the controller set
+            shm.motor_desires.snapshot_into(motors)
+            pwms = np.array([getattr(motors, thruster.link) for thruster in tm.thrusters])
+            thrusts = tm.tables.to_thrusts(np.where(reversed_polarity, -pwms, pwms))
+            body.step(tm.thrusts_to_sub.dot(thrusts) + passives, dt)
+
+            body.update_kalman(k)
+            shm.kalman.set(k)
+
+            errors.append([heading_sub_degrees(getattr(d, desire), getattr(k, output))
+                           if angular else getattr(d, desire) - getattr(k, output)
+                           for (_, desire, output, angular) in DOFS])
+            settled.append((i + 1) * dt >= settle)
+
+    wall_time = time.perf_counter() - start
+    return np.array(errors), np.array(settled, dtype=bool), np.array(step_times), wall_time
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Benchmark the controller in closed loop with a rigid body model of the vehicle.')
+    ap.add_argument('--script', type=str, default='steps',
+                    help='setpoint script: one of {} or a JSON file'.format(', '.join(sorted(SCRIPTS))))
+    ap.add_argument('--dt', type=float, default=0.01, help='seconds of simulated time per step')
+    ap.add_argument('--settle', type=float, default=5.0,
+                    help='seconds after each setpoint change before errors count as settled')
+    ap.add_argument('--quat-pid', action='store_true', help='use the quaternion PID for attitude')
+    args = ap.parse_args()
+
+    if args.script in SCRIPTS:
+        script = SCRIPTS[args.script]
+    else:
+        with open(args.script) as f:
+            script = json.load(f)
+
+    if not (shm.switches.soft_kill.get() or shm.switches.hard_kill.get()):
+        raise SystemExit('soft kill is off; refusing to drive motor_desires')
+
+    saved = [(group, group.get()) for group in SAVED_GROUPS]
+    try:
+        errors, settled, step_times, wall_time = run(script, args.dt, args.settle, args.quat_pid)
+    finally:
+        for (group, g) in saved:
+            group.set(g)
+
+    steps = len(errors)
+    print('{} steps, {:.1f} s simulated in {:.2f} s ({:.1f}x real time)'.format(
+        steps, steps * args.dt, wall_time, steps * args.dt / wall_time))
+    print('{:.0f} steps/s closed loop, {:.0f} steps/s controller alone'.format(
+        steps / wall_time, steps / step_times.sum()))
+    print('controller step us: p50 {:.0f}, p99 {:.0f}, max {:.0f}'.format(
+        *(np.percentile(step_times, [50, 99, 100]) * 1e6)))
+
+    print('{:>8} {:>10} {:>12} {:>12}'.format('dof', 'rms error', 'settled rms', 'settled max'))
+    for i, (name, _, _, _) in enumerate(DOFS):
+        e = errors[:, i]
+        s = e[settled] if settled.any() else e
+        print('{:>8} {:>10.4g} {:>12.4g} {:>12.4g}'.format(
+            name, np.sqrt(np.mean(e ** 2)), np.sqrt(np.mean(s ** 2)), np.abs(s).max()))
@@ -3,7 +3,7 @@ import sys
 
 try:
     import numpy as np
-    from scipy.optimize import fmin_cobyla, fmin_tnc, fmin_l_bfgs_b, fmin_slsqp
+    from scipy.optimize import fmin_slsqp
 except ImportError:
     print("## ERROR: controld3 requires NumPy and SciPy for optimization ##")
     sys.exit(1)
@@ -21,13 +21,15 @@ from shm.settings_control import velx_active, vely_active, depth_active, \
                                  heading_active, pitch_active, roll_active
 
 from control import vehicle
-from control.thrusters import thrusters
+from control.allocator import BoundedAllocator
+from control.thrusters import thrusters, ThrustTables
 from control.util import set_all_motors_from_seq, set_shm_wrench
 from control.pid import PIDLoop
 
 class Optimizer:
     """ Class to set motors using optimization techniques (see set_motors) """ 
-    def __init__(self):
+    def __init__(self, clock=time.time):
+        """ clock is given to the quaternion PID loop, see PIDLoop """
         self.thrusters = thrusters
 
         # constraint functions always have to be positive for allowed thrusts
@@ -48,10 +50,18 @@ class Optimizer:
         # initial guess for optimizing function, currently static; 0 on all
         self.initial_guess = np.array((0,) * len(self.thrusters))
 
+        # solves for the thrusts when the exact solution saturates thrusters
+        self.allocator = BoundedAllocator([b[0] for b in self.bounds],
+                                          [b[1] for b in self.bounds])
+
+        # converts the thrusts of all thrusters to pwms at once
+        self.tables = ThrustTables(thrusters)
+        self.reversed_polarity = np.array([t.reversed_polarity for t in thrusters])
+
         # this is multiplied by the errors so we prioritize certain DOFs
         self.error_scale = np.ones(6)
 
-        self.quat_pid = PIDLoop()
+        self.quat_pid = PIDLoop(clock=clock)
 
         # other options
         self.DEBUG = False
@@ -98,8 +108,8 @@ class Optimizer:
         """
             Attempts to find the motor values that best achieve the desired
             thruster response. First tries the exact solution, then resorts to
-            a black box optimization routine if the solution will saturate
-            thrusters.
+            bounded least squares (see BoundedAllocator) if the solution will
+            saturate thrusters.
         """
         # After this step, the error should always be zero.
         x = A.dot(b)
@@ -110,18 +120,29 @@ class Optimizer:
                 good = False
                 break
 
-        # If the zero error point is outside the thruster bounds,
-        # initiate black box optimization!
+        # If the zero error point is outside the thruster bounds, find the
+        # point within them of least error, starting from the last one
         if not good:
             # Update priorities - possibly remove after tuning is finalized
             self.update_error_scale()
 
-            x = fmin_slsqp(self.objective, self.initial_guess,
-                           bounds=self.bounds, fprime=self.derivative,
-                           disp=int(self.DEBUG))
+            x = self.allocator.solve(self.thrusts_output_mat_s, b,
+                                     self.error_scale)
+        else:
+            self.allocator.warm_start(x)
 
         return x
 
+    def optimize_slsqp(self):
+        """
+            Black box optimization of the thrusts for the current desires,
+            as optimize did before BoundedAllocator. Kept for comparison
+            (see control/benchmark.py)
+        """
+        return fmin_slsqp(self.objective, self.initial_guess,
+                          bounds=self.bounds, fprime=self.derivative,
+                          disp=int(self.DEBUG))
+
     def set_motors(self, tm, ft_passive_s):
         """
             Sets motors using the PID control loop outputs by a sketchy
@@ -219,18 +240,10 @@ class Optimizer:
         set_shm_wrench(control_internal_opt_errors, error)
 
         # Finally, we convert thrusts to PWM and output values to shared memory
-        out = [0] * len(self.thrusters)
-        for i, t in enumerate(self.thrusters):
-            # this only happens when desires are wild and slsqp fails
-            # at that point we don't really care about accuracy and just
-            # truncate for safety.
-            if x[i] < t.max_neg_thrust:
-                x[i] = t.max_neg_thrust
-            elif x[i] > t.max_thrust:
-                x[i] = t.max_thrust
-
-            out[i] = t.thrust_to_pwm(x[i])
-            if t.reversed_polarity:
-              out[i] = -out[i]
-
-        set_all_motors_from_seq(out)
+        # the allocator keeps thrusts within bounds; clipping is only for
+        # safety.
+        x = np.clip(x, self.allocator.lower, self.allocator.upper)
+        out = self.tables.to_pwms(x)
+        out = np.where(self.reversed_polarity, -out, out)
+
+        set_all_motors_from_seq(out.tolist())
@@ -4,15 +4,11 @@ import time
 
 import numpy as np
 
-from auv_python_helpers.angles import heading_sub_degrees
 from control.quat import Quaternion
 
+import shm
 from shm import kalman, desires, settings_control, \
-                control_internal_depth, control_internal_heading, \
-                control_internal_pitch, control_internal_velx, \
-                control_internal_vely, control_internal_roll, \
-                settings_depth, settings_heading, settings_pitch, \
-                settings_velx, settings_vely, settings_roll, settings_quat, \
+                control_internal_depth, settings_depth, settings_quat, \
                 control_locked
 
 class PID:
@@ -100,60 +96,140 @@ class DynamicPID(PID):
         return super().tick(value, desired)
 
 
-class ShmPID:
-  def __init__(self, gain_group, value, desire, diff_func, out_group, on, locked, speed=1):
-    self.gain_group = gain_group
-    self.value = value
-    self.desire = desire
-    self.out_group = out_group
-    self.on = on
-    self.locked = locked
+class ShmPIDBank:
+    """
+    The PID loops of several degrees of freedom, stepped together as arrays.
 
-    self.pid = PID(0, 0, 0, diff_func, speed)
-    self.update_gains()
+    Each loop behaves as PID.tick with gains from its settings group, but gains
+    are only read again when a settings group changes, and values, desires and
+    outputs are read and written a group at a time.
+    """
 
-  def update_gains(self):
-    self.pid.P = self.gain_group.kP.get()
-    self.pid.I = self.gain_group.kI.get()
-    self.pid.D = self.gain_group.kD.get()
-    self.pid.rD = self.gain_group.rD.get()
-
-  def reset(self):
-    self.pid.reset()
-    self.out_group.integral.set(0)
-    self.out_group.out.set(0)
-
-  def tick(self):
-    self.update_gains()
-
-    if self.on.get():
-      out = self.pid.tick(self.value.get(), self.desire.get())
-    else:
-      out = 0
-
-    self.out_group.out.set(out)
-
-    if self.pid.integral is None:
-      integral = 0
-    else:
-      integral = self.pid.integral
-
-    self.out_group.integral.set(integral)
-
-    # Output helpful debugging data.
-    out_P = 0 if self.pid.out_P is None else self.pid.out_P
-    out_I = 0 if self.pid.out_I is None else self.pid.out_I
-    out_D = 0 if self.pid.out_D is None else self.pid.out_D
-    self.out_group.out_P.set(out_P)
-    self.out_group.out_I.set(out_I)
-    self.out_group.out_D.set(out_D)
-
-    self.locked.set(self.pid.locked)
+    def __init__(self, loops, speed=1, clock=time.time):
+        """
+        Arguments:
+        loops -- a list of (name, desire group, desire variable, angular).
+                 A loop reads its value from kalman.<name> and its gains from
+                 settings_<name>, is enabled by settings_control.<name>_active
+                 and outputs to control_internal_<name> and
+                 control_locked.<name>. Angular loops take errors in degrees
+                 from -180 to 180, as heading_sub_degrees does.
+        speed, clock -- as for PIDLoop
+        """
+        self.names = [name for name, _, _, _ in loops]
+        self.desires = [(group, var) for _, group, var, _ in loops]
+        self.angular = np.array([angular for _, _, _, angular in loops])
+        self.speed = speed
+        self.clock = clock
+
+        self.gain_groups = [getattr(shm, 'settings_' + name) for name in self.names]
+        self.out_groups = [getattr(shm, 'control_internal_' + name) for name in self.names]
+
+        # Groups read each tick, and the structs they are read into. Outputs
+        # are written from the same structs, so that other variables in an
+        # output group (such as the depth desire) are written back unchanged.
+        self.inputs = []
+        for group in [kalman, settings_control] + [g for g, _ in self.desires]:
+            if group not in self.inputs:
+                self.inputs.append(group)
+        self.structs = dict((group, group.group()) for group in self.inputs + self.out_groups)
+        self.locked_struct = control_locked.group()
+
+        self.gain_watcher = shm.watchers.watcher()
+        for group in self.gain_groups:
+            self.gain_watcher.watch(group)
+        self.update_gains()
+
+        self.reset()
+
+    def update_gains(self):
+        gains = [group.get() for group in self.gain_groups]
+        self.P = np.array([g.kP for g in gains])
+        self.I = np.array([g.kI for g in gains])
+        self.D = np.array([g.kD for g in gains])
+        self.rD = np.array([g.rD for g in gains])
+
+    def reset(self):
+        n = len(self.names)
+        # A loop without an integral (None in PID) has an integral of 0
+        self.integral = np.zeros(n)
+        self.last_time = np.zeros(n)
+        self.last_value = np.zeros(n)
+        self.has_last_value = np.zeros(n, dtype=bool)
+        self.locked = np.zeros(n, dtype=bool)
+        self.out_P = np.zeros(n)
+        self.out_I = np.zeros(n)
+        self.out_D = np.zeros(n)
+
+        for out_group in self.out_groups:
+            out_group.integral.set(0)
+            out_group.out.set(0)
+
+    def diff(self, a, b):
+        diff = a - b
+        wrapped = np.mod(diff, 360)
+        np.subtract(wrapped, 360, out=wrapped, where=wrapped > 180)
+        np.copyto(diff, wrapped, where=self.angular)
+        return diff
+
+    def tick(self):
+        if self.gain_watcher.has_changed():
+            self.update_gains()
+
+        for group in self.inputs:
+            group.snapshot_into(self.structs[group])
+
+        k = self.structs[kalman]
+        c = self.structs[settings_control]
+        value = np.array([getattr(k, name) for name in self.names])
+        desired = np.array([getattr(self.structs[g], var) for g, var in self.desires])
+        on = np.array([bool(getattr(c, name + '_active')) for name in self.names])
+
+        # Loops that are off keep their state and outputs, but output 0
+        now = self.clock()
+        dt = (now - self.last_time) * self.speed
+        np.copyto(self.last_time, now, where=on)
+
+        error = self.diff(desired, value)
+
+        # Ignore any pauses in the controller.
+        np.add(self.integral, error * dt, out=self.integral, where=on & (dt < 5))
+
+        locked = np.abs(error) > self.rD
+        np.copyto(self.integral, 0, where=on & locked)
+        np.copyto(self.locked, locked, where=on)
+
+        # Avoid derivative spike on startup.
+        out_D = np.zeros(len(self.names))
+        np.divide(self.D * self.diff(-value, -self.last_value), dt, out=out_D,
+                  where=self.has_last_value)
+        np.copyto(self.out_P, self.P * error, where=on)
+        np.copyto(self.out_I, self.I * self.integral, where=on)
+        np.copyto(self.out_D, out_D, where=on)
+        np.copyto(self.last_value, value, where=on)
+        self.has_last_value |= on
+
+        out = np.where(on, self.out_P + self.out_I + self.out_D, 0)
+
+        outputs = zip(out.tolist(), self.integral.tolist(), self.out_P.tolist(),
+                      self.out_I.tolist(), self.out_D.tolist())
+        for out_group, (out, integral, out_P, out_I, out_D) in zip(self.out_groups, outputs):
+            g = self.structs[out_group]
+            g.out = out
+            g.integral = integral
+            g.out_P = out_P
+            g.out_I = out_I
+            g.out_D = out_D
+            out_group.set(g)
+
+        for name, locked in zip(self.names, self.locked.tolist()):
+            setattr(self.locked_struct, name, locked)
+        control_locked.set(self.locked_struct)
 
 class PIDLoop:
     """ Class for updating PID values """
 
-    def __init__(self, speed=1.0):
+    def __init__(self, speed=1.0, clock=time.time):
         """
         Initializes the vehicle PID controller.
 
@@ -163,32 +239,26 @@ class PIDLoop:
                  2.0 and 0.1 seconds have passed since the last step, dt will
                  be calculated as if 0.2 seconds passed.
                  This does not affect the time returned by step().
+        clock -- a function returning the current time in seconds, e.g. to
+                 step the controller in simulated time.
         """
-        velx_pid = ShmPID(settings_velx, kalman.velx, desires.speed, operator.sub,
-                          control_internal_velx, settings_control.velx_active, control_locked.velx, speed)
-        vely_pid = ShmPID(settings_vely, kalman.vely, desires.sway_speed, operator.sub,
-                          control_internal_vely, settings_control.vely_active, control_locked.vely, speed)
-        depth_pid = ShmPID(settings_depth, kalman.depth, control_internal_depth.desire, operator.sub,
-                           control_internal_depth, settings_control.depth_active, control_locked.depth, speed)
-
-        heading_pid = ShmPID(settings_heading, kalman.heading, desires.heading, heading_sub_degrees,
-                             control_internal_heading, settings_control.heading_active, control_locked.heading, speed)
-        pitch_pid = ShmPID(settings_pitch, kalman.pitch, desires.pitch, heading_sub_degrees,
-                           control_internal_pitch, settings_control.pitch_active, control_locked.pitch, speed)
-        roll_pid = ShmPID(settings_roll, kalman.roll, desires.roll, heading_sub_degrees,
-                          control_internal_roll, settings_control.roll_active, control_locked.roll, speed)
-
-        self.pids = [velx_pid, vely_pid, depth_pid, heading_pid, pitch_pid, roll_pid]
+        self.clock = clock
+        self.pids = ShmPIDBank([('velx', desires, 'speed', False),
+                                ('vely', desires, 'sway_speed', False),
+                                ('depth', control_internal_depth, 'desire', False),
+                                ('heading', desires, 'heading', True),
+                                ('pitch', desires, 'pitch', True),
+                                ('roll', desires, 'roll', True)], speed, clock)
 
         self.clean()
         self.last_q_error = 0
-        self.last_quat_time = time.time()
+        self.last_quat_time = self.clock()
         self.speed = speed
 
     def clean(self):
         """ Clean the controller state; init all variables """
-        self.last_time = time.time()
-        [pid.reset() for pid in self.pids]
+        self.last_time = self.clock()
+        self.pids.reset()
         control_internal_depth.desire.set(desires.depth.get())
 
         # Added by Christopher
@@ -202,7 +272,7 @@ class PIDLoop:
         a = Quaternion(q=[g.q0, g.q1, g.q2, g.q3])
         b = Quaternion(hpr=(d.heading, d.pitch, d.roll))
 
-        current_time = time.time()
+        current_time = self.clock()
         dt = (current_time - self.last_quat_time) * self.speed
         self.last_quat_time = current_time
 
@@ -232,21 +302,22 @@ class PIDLoop:
         return ang_accel
 
     def step(self):
-        for pid in self.pids:
-          pid.tick()
+        self.pids.tick()
 
-        now_time = time.time()
+        now_time = self.clock()
         dt = (now_time - self.last_time) * self.speed
         self.last_time = now_time
 
         ### Depth ramping
         # TODO: Experiment with ramping other controllers
-        if control_internal_depth.desire.get() != desires.depth.get():
-            diff = desires.depth.get() - control_internal_depth.desire.get()
+        depth_desire = control_internal_depth.desire.get()
+        desired_depth = desires.depth.get()
+        if depth_desire != desired_depth:
+            diff = desired_depth - depth_desire
             step = dt * settings_depth.ramp_speed.get()
 
             if step > abs(diff) or abs(diff) > 10: #TODO: Work on this too-large-change feature
-                control_internal_depth.desire.set(desires.depth.get())
+                control_internal_depth.desire.set(desired_depth)
             else:
                 d = step if diff > 0 else -step
-                control_internal_depth.desire.set(control_internal_depth.desire.get() + d)
+                control_internal_depth.desire.set(depth_desire + d)
@@ -0,0 +1,105 @@
+import time
+
+import numpy as np
+
+import shm
+
+# *************************************
+#
+# profiler.py --
+#   Timing of the phases of each
+#   controller step
+#
+# *************************************
+
+# Phases of a controller step, in the order they run; total is the whole step
+PHASES = ['qs', 'passives', 'pid', 'optimizer', 'total']
+
+# Seconds between publishes to shm.control_timing
+PUBLISH_INTERVAL = 1.0
+
+# Edges (seconds) of the histogram bins, log spaced from 10 us to 1 s
+HISTOGRAM_EDGES = np.logspace(-5, 0, 51)
+
+class StepProfiler(object):
+    """
+        Records the duration of each phase of every controller step into a
+        ring buffer and publishes the p50, p99 and max of each phase over the
+        last PUBLISH_INTERVAL into shm.control_timing, along with the number
+        of steps that missed their deadline.
+
+        A histogram of the durations over the whole run is kept as well, so
+        that it can be written to a file when the controller exits.
+    """
+    def __init__(self, size=4096):
+        self.ring = np.zeros((size, len(PHASES)))
+        self.steps = 0
+        self.missed = 0
+        self.histogram = np.zeros((len(HISTOGRAM_EDGES) + 1, len(PHASES)), dtype=np.int64)
+        self.start_time = time.time()
+
+        self._published_steps = 0
+        self._last_publish = self.start_time
+
+    def record(self, durations, missed=False):
+        """
+            durations is a sequence of the duration (seconds) of each phase
+            in PHASES. missed is whether the step missed its deadline
+        """
+        self.ring[self.steps % len(self.ring)] = durations
+        self.steps += 1
+        if missed:
+            self.missed += 1
+
+        # Also publish before the ring wraps, so the histogram counts every step
+        now = time.time()
+        if now - self._last_publish >= PUBLISH_INTERVAL or \
+           self.steps - self._published_steps >= len(self.ring):
+            self.publish(now)
+
+    def _window(self):
+        """ Durations of the steps since the last publish """
+        count = self.steps - self._published_steps
+        indexes = np.arange(self.steps - count, self.steps) % len(self.ring)
+        return self.ring[indexes]
+
+    def publish(self, now=None):
+        now = time.time() if now is None else now
+        window = self._window()
+        if len(window):
+            for phase in range(len(PHASES)):
+                self.histogram[:, phase] += np.bincount(
+                    np.searchsorted(HISTOGRAM_EDGES, window[:, phase]),
+                    minlength=len(HISTOGRAM_EDGES) + 1)
+
+            g = shm.control_timing.group()
+            g.rate = len(window) / (now - self._last_publish)
+            p50, p99, pmax = np.percentile(window, [50, 99, 100], axis=0) * 1000
+            for i, phase in enumerate(PHASES):
+                setattr(g, phase + '_p50', p50[i])
+                setattr(g, phase + '_p99', p99[i])
+                setattr(g, phase + '_max', pmax[i])
+            g.steps = self.steps
+            g.missed = self.missed
+            shm.control_timing.set(g)
+
+        self._published_steps = self.steps
+        self._last_publish = now
+
+    def dump(self, filename):
+        """
+            Writes the histogram of phase durations over the whole run to
+            filename, one row per bin with the count of each phase
+        """
+        self.publish()
+        elapsed = time.time() - self.start_time
+        with open(filename, 'w') as f:
+            f.write('# auv_controld3 step timing: {} steps in {:.1f} s ({:.1f} HZ), '
+                    '{} missed deadlines\n'.format(self.steps, elapsed,
+                                                  self.steps / max(elapsed, 1e-9), self.missed))
+            f.write('# {:>10} {:>10} '.format('from us', 'to us') +
+                    ' '.join('{:>10}'.format(p) for p in PHASES) + '\n')
+            edges = np.hstack(([0], HISTOGRAM_EDGES, [np.inf])) * 1e6
+            for i, counts in enumerate(self.histogram):
+                f.write('  {:>10.0f} {:>10.0f} '.format(edges[i], edges[i + 1]) +
+                        ' '.join('{:>10d}'.format(c) for c in counts) + '\n')
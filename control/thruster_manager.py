@@ -2,7 +2,7 @@ import shm
 import numpy as np
 from control import vehicle
 from control import quat
-from control.thrusters import thrusters
+from control.thrusters import thrusters, desires, ThrustTables
 from control.util import DOFSet
 
 class ThrusterManager(object):
@@ -12,6 +12,7 @@ class ThrusterManager(object):
     """
     def __init__(self):
         self.thrusters = thrusters
+        self.tables = ThrustTables(thrusters)
 
         self.axes = DOFSet(f=np.array((1, 0, 0)), s=np.array((0, 1, 0)),
                            d=np.array((0, 0, 1)), p=np.array((0, 1, 0)),
@@ -95,7 +96,8 @@ class ThrusterManager(object):
 
     def get_thrusts(self):
         """ Returns thrusts produced by the thrusters """
-        return [t.pwm_to_thrust(t.get()) for t in self.thrusters]
+        g = desires.get()
+        return self.tables.to_thrusts([getattr(g, t.link) for t in self.thrusters])
 
     def total_thrust(self, thrusts):
         """
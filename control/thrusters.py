@@ -2,6 +2,7 @@ import numpy as np
 import os
 import shm
 
+from bisect import bisect_right
 from math import sqrt
 
 from auvlog.client import log
@@ -129,8 +130,11 @@ class GenericThruster(object):
         self.force_hat = q * np.array((1, 0, 0))
         self.torque_hat = np.cross(np.array(position), self.force_hat)
 
-        self._thrust_memo = {} # pwm -> thrust mappings
-                               # is this even worth it?, 32Kb of data...
+        # Variable-s used for quadratic equation in solve_pwm
+        self._qvars = [self.get_qvars(self.curve_reverse),
+                       self.get_qvars(self.curve_forward)]
+
+        self.build_thrust_table()
 
         self.max_thrust = self.pwm_to_thrust(self.max_pwm)
         self.max_neg_thrust = self.pwm_to_thrust(-self.max_pwm)
@@ -138,9 +142,7 @@ class GenericThruster(object):
         self.min_thrust = self.pwm_to_thrust(self.min_pwm)
         self.min_neg_thrust = self.pwm_to_thrust(-self.min_pwm)
 
-        # Variable-s used for quadratic equation in thrust_to_pwm
-        self._qvars = [self.get_qvars(self.curve_reverse),
-                       self.get_qvars(self.curve_forward)]
+        self.build_pwm_table()
 
     def get_qvars(self, curve):
         class Qdata:
@@ -159,6 +161,82 @@ class GenericThruster(object):
         """
         g.update(**{ self.link : pwm })
 
+    def curve_thrust(self, pwm):
+        """
+            Returns the thrust of the model curves at pwm, which may be an
+            array. Gives 0 below the turn on pwm.
+        """
+        pwm = np.asarray(pwm, dtype=float)
+        d = self.drag
+
+        forward = pwm > 0
+        a = np.where(forward, self.curve_forward[0], self.curve_reverse[0])
+        b = np.where(forward, self.curve_forward[1], self.curve_reverse[1])
+        c = np.where(forward, self.curve_forward[2], self.curve_reverse[2])
+        # TODO: why only the first two terms are multiplied by d?
+        thrust = d * a * pwm**2 + d * b * pwm + c
+
+        return np.where(np.abs(pwm) < self.min_pwm, 0.0, thrust)
+
+    def build_thrust_table(self):
+        """
+            Builds the table used by pwm_to_thrust: the thrust at every
+            integer pwm from -max_pwm to max_pwm.
+        """
+        self._thrusts = self.curve_thrust(np.arange(-self.max_pwm, self.max_pwm + 1))
+        self._thrust_list = self._thrusts.tolist()
+
+    def build_pwm_table(self):
+        """
+            Builds the table used by thrust_to_pwm: the thrusts at which the
+            pwm steps (_edges) and the pwm from each step on (_pwms), so that
+            the pwm for a thrust is _pwms[bisect_right(_edges, thrust)].
+
+            Along the curves the pwm steps at the thrust of each pwm + 0.5,
+            where the rounded solution of the curve changes. Edges are made
+            monotone. In the dead region the pwm steps where dead_pwm does.
+        """
+        steps = np.arange(self.max_pwm - self.min_pwm) + 0.5
+        reverse_edges = np.maximum.accumulate(self.curve_thrust(steps - self.max_pwm))
+        forward_edges = np.maximum.accumulate(self.curve_thrust(steps + self.min_pwm))
+
+        edges, pwms = [], [-self.max_pwm]
+        def step(edge, pwm):
+            edges.append(float(edge))
+            pwms.append(int(pwm))
+
+        # Reverse curve, for negative thrusts up to min_neg_thrust
+        if self.min_neg_thrust < 0:
+            reverse_end = np.nextafter(self.min_neg_thrust, np.inf)
+        else:
+            reverse_end = 0.0
+        for i, edge in enumerate(reverse_edges):
+            if edge < reverse_end:
+                step(edge, -self.max_pwm + i + 1)
+
+        # Dead region
+        if self.min_neg_thrust < 0:
+            step(reverse_end, -self.min_pwm)
+            step(self.min_neg_thrust / 2, 0)
+        if self.min_thrust > 0:
+            step(0.0, 0)
+            step(np.nextafter(self.min_thrust / 2, np.inf), self.min_pwm)
+            forward_start = self.min_thrust
+        else:
+            forward_start = np.nextafter(0.0, np.inf)
+
+        # Forward curve, for positive thrusts from min_thrust
+        step(forward_start,
+             self.min_pwm + np.searchsorted(forward_edges, forward_start, side='right'))
+        for i, edge in enumerate(forward_edges):
+            if edge > forward_start:
+                step(edge, self.min_pwm + i + 1)
+
+        self._edges = np.array(edges)
+        self._pwms = np.array(pwms)
+        self._edge_list = edges
+        self._pwm_list = pwms
+
     def pwm_to_thrust(self, pwm=None):
         """
             Returns thrust that a given pwm will provide
@@ -170,33 +248,16 @@ class GenericThruster(object):
         if pwm is None:
             pwm = self.get()
 
-        if pwm in self._thrust_memo:
-            return self._thrust_memo[pwm]
-
-        #Handle lower bound
-        if abs(pwm) < self.min_pwm:
-            thrust = 0
-
-        else:
-            #drag
-            d = self.drag
-
-            #Thrust calculation
-            curve = [self.curve_reverse, self.curve_forward][pwm > 0]
-            # TODO: why only the first two terms are multiplied by d?
-            thrust = d * curve[0] * pwm**2 + d * curve[1] * pwm + curve[2]
+        # Integer pwms in range are looked up, anything else is computed
+        if pwm == int(pwm) and -self.max_pwm <= pwm <= self.max_pwm:
+            return self._thrust_list[int(pwm) + self.max_pwm]
 
-        #thrust *= SCALE_FACTOR
-        self._thrust_memo[pwm] = thrust
-        return thrust
+        return float(self.curve_thrust(pwm))
 
-    def thrust_to_pwm(self, thrust):
+    def dead_pwm(self, thrust):
         """
-            Returns the integer pwm required to achieve a given thrust
-            for this thruster.
-
-            Needs to handle lower bound. (min possible thrust, turn-on point)
-            Does not need to handle max value
+            Returns the pwm for a thrust within the dead region of the
+            thruster, or None if thrust is outside of it.
         """
         # If thrust is within dead region of the thruster,
         # pick the one of -min_pwm, 0, min_pwm which is the closest
@@ -212,6 +273,28 @@ class GenericThruster(object):
             else:
                 return 0
 
+        return None
+
+    def thrust_to_pwm(self, thrust):
+        """
+            Returns the integer pwm required to achieve a given thrust
+            for this thruster.
+
+            Needs to handle lower bound. (min possible thrust, turn-on point)
+            Thrusts beyond the max thrust give the max pwm.
+        """
+        return self._pwm_list[bisect_right(self._edge_list, thrust)]
+
+    def solve_pwm(self, thrust):
+        """
+            Returns the integer pwm for a given thrust by solving the model
+            curves, without the lookup tables used by thrust_to_pwm. Does not
+            limit the pwm to max_pwm.
+        """
+        pwm = self.dead_pwm(thrust)
+        if pwm is not None:
+            return pwm
+
         #PWM calculation
         if thrust > 0:
             curve = self.curve_forward
@@ -239,6 +322,30 @@ class GenericThruster(object):
 
         return int(round(pwm))
 
+    def check_tables(self, samples=10000):
+        """
+            Compares the lookup tables with the model curves. Returns a list
+            of (thrust, table pwm, curve pwm) for thrusts between the max
+            negative and max thrust where thrust_to_pwm and solve_pwm differ,
+            and (pwm, table thrust, curve thrust) for integer pwms where
+            pwm_to_thrust differs from the curves.
+        """
+        errors = []
+        for thrust in np.linspace(self.max_neg_thrust, self.max_thrust, samples).tolist():
+            table_pwm, curve_pwm = self.thrust_to_pwm(thrust), self.solve_pwm(thrust)
+            if table_pwm != curve_pwm:
+                errors.append((thrust, table_pwm, curve_pwm))
+
+        for pwm in range(-self.max_pwm, self.max_pwm + 1):
+            d = self.drag
+            curve = [self.curve_reverse, self.curve_forward][pwm > 0]
+            thrust = 0 if abs(pwm) < self.min_pwm else \
+                     d * curve[0] * pwm**2 + d * curve[1] * pwm + curve[2]
+            if abs(self.pwm_to_thrust(pwm) - thrust) > 1e-9 * (abs(thrust) + 1):
+                errors.append((pwm, self.pwm_to_thrust(pwm), thrust))
+
+        return errors
+
     def torque_about(self, axis_hat, thrust=1.0):
         """
             Returns the scalar torque generated by thruster about axis_hat
@@ -274,6 +381,39 @@ class GenericThruster(object):
         else:
             log("No model for %s thruster, defaulting to VideoRay!" % self.name)
 
+class ThrustTables(object):
+    """
+        The lookup tables of several thrusters stacked into arrays, to convert
+        a whole vector of thrusts to pwms (or back) in one call. Gives the
+        same results as thrust_to_pwm and pwm_to_thrust of each thruster.
+    """
+    def __init__(self, thrusters):
+        n = len(thrusters)
+        edges = max(len(t._edges) for t in thrusters)
+        pwms = max(len(t._thrusts) for t in thrusters)
+
+        # Edges are padded with inf, which no thrust reaches
+        self.edges = np.full((n, edges), np.inf)
+        self.pwms = np.zeros((n, edges + 1), dtype=int)
+        self.thrusts = np.zeros((n, pwms))
+        for i, t in enumerate(thrusters):
+            self.edges[i, :len(t._edges)] = t._edges
+            self.pwms[i, :len(t._pwms)] = t._pwms
+            self.thrusts[i, :len(t._thrusts)] = t._thrusts
+
+        self.rows = np.arange(n)
+        self.max_pwm = np.array([t.max_pwm for t in thrusters])
+
+    def to_pwms(self, thrusts):
+        """ Returns the integer pwms for a vector of thrusts, one per thruster """
+        steps = (self.edges <= np.asarray(thrusts, dtype=float)[:, np.newaxis]).sum(axis=1)
+        return self.pwms[self.rows, steps]
+
+    def to_thrusts(self, pwms):
+        """ Returns the thrusts for a vector of integer pwms, one per thruster """
+        pwms = np.clip(np.asarray(pwms, dtype=int), -self.max_pwm, self.max_pwm)
+        return self.thrusts[self.rows, pwms + self.max_pwm]
+
 class VideoRay(GenericThruster):
     max_pwm = 255
     min_pwm = 26
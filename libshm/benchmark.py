@@ -29,3 +29,19 @@ both='var.set(5.0);var.get()'
 test(vget, r, n)
 test(vset, r, n)
 test(both, r, n)
+
+
+def test_bundle(r, n):
+    setup = ('import shm;from shm.bundle import Bundle;'
+             'vars=[getattr(shm.kalman, f) for f, t in shm.kalman._fields];'
+             'bundle=Bundle(vars)')
+
+    print "\n", "kalman: every variable"
+
+    each = Timer('for v in vars: v.get()', setup).repeat(r, n)
+    print "Individual: ", sum(each)/r
+
+    bundled = Timer('bundle.get()', setup).repeat(r, n)
+    print "Bundle: ", sum(bundled)/r
+
+test_bundle(r, n)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+"""
+Measures the cold-start cost of importing the generated shm package, the way a
+short-lived tool such as auv-shm-cli would use it: import shm, touch a single
+group, exit. Each trial runs in a fresh interpreter so nothing is cached.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SNIPPET = "import shm; shm.{0}.get()"
+
+
+def run(group, eager, n):
+    env = dict(os.environ)
+    if eager:
+        env["SHM_EAGER"] = "1"
+    else:
+        env.pop("SHM_EAGER", None)
+
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", SNIPPET.format(group)], env=env)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times
+
+
+def report(name, times):
+    print("{0:>6}: min {1:7.1f} ms  median {2:7.1f} ms  max {3:7.1f} ms".format(
+        name, times[0] * 1e3, times[len(times) // 2] * 1e3, times[-1] * 1e3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark shm import time.")
+    parser.add_argument("-n", type=int, default=20, help="trials per mode")
+    parser.add_argument("--group", default="desires", help="group to touch after import")
+    args = parser.parse_args()
+
+    eager = run(args.group, True, args.n)
+    lazy = run(args.group, False, args.n)
+
+    report("eager", eager)
+    report("lazy", lazy)
+    print("speedup (median): {0:.2f}x".format(eager[len(eager) // 2] / lazy[len(lazy) // 2]))
@@ -18,7 +18,9 @@ ocamlfiles = [
 pyfiles = [
             'group.py',
             'watchers.py',
-            'base.py'
+            'base.py',
+            'init.py',
+            'bundle.py',
           ]
 files = [
             'shm.c',
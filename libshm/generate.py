@@ -23,6 +23,7 @@ scmtypes=dict(double='double', float='float', int='int32', bool='bool', int16='i
 ocamlctypes=dict(double='double', float='float', int='int', bool='bool', int16='int16_t', int32='int32_t', string='string')
 ocamltypes=dict(double='float', float='float', int='int', bool='bool', int16='Int16.t', int32='Int32.t', string='string')
 haskelltypes=dict(double='Double', float='Double', int='Int', bool='Bool', int16='Int', int32='Int', string='CString')
+bundletypes=dict(double='SHM_BUNDLE_DOUBLE', float='SHM_BUNDLE_FLOAT', int='SHM_BUNDLE_INT', bool='SHM_BUNDLE_INT', int16='SHM_BUNDLE_INT16', int32='SHM_BUNDLE_INT')
 
 # forward declaration for try/catch
 groups = {}
@@ -93,6 +94,16 @@ for g in groups:
         g['vars'][k]['ocamltype'] = ocamltypes[g['vars'][k]['type']]
         g['vars'][k]['haskelltype'] = haskelltypes[g['vars'][k]['type']]
 
+# number every non-string variable for the bundle api; the C table in vars.c
+# and the python group modules must agree on this order
+bundle_id = 0
+for g in groups:
+    for k in g['varnames']:
+        if g['vars'][k]['type'] != 'string':
+            g['vars'][k]['bundle_id'] = bundle_id
+            g['vars'][k]['bundletype'] = bundletypes[g['vars'][k]['type']]
+            bundle_id += 1
+
 files = ['shm.c',
          'shm.h',
          'log.cpp',
@@ -118,6 +129,7 @@ for f in files:
 make_file('templates/init.py', 'py/__init__.py', old_files)
 make_file('templates/watchers.py', 'py/watchers.py', old_files)
 make_file('templates/base.py', 'py/base.py', old_files)
+make_file('templates/bundle.py', 'py/bundle.py', old_files)
 
 # make py files
 for g in groups:
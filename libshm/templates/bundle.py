@@ -0,0 +1,95 @@
+import ctypes
+
+import shm
+from shm.base import auv_var_lib
+
+_c_double_p = ctypes.POINTER(ctypes.c_double)
+
+_count = auv_var_lib.shm_bundle_count
+_count.argtypes = []
+_count.restype = ctypes.c_int32
+_get = auv_var_lib.shm_bundle_get
+_get.argtypes = [ctypes.POINTER(ctypes.c_int32), ctypes.c_int32, _c_double_p]
+_get.restype = None
+_set = auv_var_lib.shm_bundle_set
+_set.argtypes = [ctypes.POINTER(ctypes.c_int32), ctypes.c_int32, _c_double_p]
+_set.restype = None
+
+
+def _pointer(buf, n):
+    """ Get a double* to a ctypes double array or a float64 NumPy array. """
+    if isinstance(buf, ctypes.Array):
+        if buf._type_ is not ctypes.c_double or len(buf) < n:
+            raise ValueError("buffer must be a c_double array of length >= {0}".format(n))
+        return ctypes.cast(buf, _c_double_p)
+
+    if (str(getattr(buf, "dtype", "")) != "float64" or buf.size < n or
+            not buf.flags["C_CONTIGUOUS"]):
+        raise ValueError("buffer must be a contiguous float64 array of size >= {0}".format(n))
+    return buf.ctypes.data_as(_c_double_p)
+
+
+class Bundle(object):
+    """
+    A fixed set of shared variables, possibly from many groups, that are read
+    and written together with a single call into libshm.
+
+    Variables are given as variable classes (shm.desires.depth) or names
+    ("desires.depth") and their values are exchanged as doubles, in the order
+    given. Listing variables of the same group next to each other lets libshm
+    take each group's lock only once. String variables cannot be bundled.
+    """
+
+    def __init__(self, variables):
+        self.variables = [shm._eval(v) if isinstance(v, str) else v for v in variables]
+        for v in self.variables:
+            if getattr(v, "_bundle_id", None) is None:
+                raise ValueError("{0} cannot be bundled".format(v))
+
+        self.names = ["{0}.{1}".format(v.__module__.split(".")[-1], v.__name__)
+                      for v in self.variables]
+
+        self._n = len(self.variables)
+        self._ids = (ctypes.c_int32 * self._n)(*[v._bundle_id for v in self.variables])
+        self.buffer = (ctypes.c_double * self._n)()
+        self._buffer_p = ctypes.cast(self.buffer, _c_double_p)
+
+    def __len__(self):
+        return self._n
+
+    def get(self, out=None):
+        """
+        Read every variable into out, a caller-owned c_double array or float64
+        NumPy array, or into this bundle's own buffer if out is not given.
+        Returns the buffer that was filled.
+        """
+        if out is None:
+            _get(self._ids, self._n, self._buffer_p)
+            return self.buffer
+        _get(self._ids, self._n, _pointer(out, self._n))
+        return out
+
+    def set(self, values=None):
+        """
+        Write every variable from values, a c_double array, float64 NumPy
+        array or any sequence of numbers. With no arguments, the bundle's own
+        buffer is written.
+        """
+        if values is None:
+            _set(self._ids, self._n, self._buffer_p)
+        elif isinstance(values, ctypes.Array) or hasattr(values, "dtype"):
+            _set(self._ids, self._n, _pointer(values, self._n))
+        else:
+            if len(values) != self._n:
+                raise ValueError("expected {0} values, got {1}".format(self._n, len(values)))
+            self.buffer[:] = values
+            _set(self._ids, self._n, self._buffer_p)
+
+    def array(self):
+        """ A NumPy view of this bundle's own buffer. """
+        import numpy as np
+        return np.ctypeslib.as_array(self.buffer)
+
+    def as_dict(self):
+        """ Read every variable and return a dict keyed by "group.variable". """
+        return dict(zip(self.names, self.get()))
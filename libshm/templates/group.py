@@ -37,6 +37,48 @@ auv_var_lib.shm_get_$!g['groupname']!$.restype = group
 def get():
     return auv_var_lib.shm_get_$!g['groupname']!$()
 
+_get_into = auv_var_lib.shm_get_into_$!g['groupname']!$
+_get_into.argtypes = [ctypes.c_void_p]
+_get_into.restype = None
+
+_dtype = None
+def dtype():
+    """ The NumPy structured dtype with the same layout as group. """
+    global _dtype
+    if _dtype is None:
+        import numpy
+        _dtype = numpy.dtype(group)
+    return _dtype
+
+def ring(n):
+    """ A zeroed NumPy array of n records, for use with snapshot_into. """
+    import numpy
+    return numpy.zeros(n, dtype=dtype())
+
+def view(g):
+    """ A writable NumPy record array sharing memory with the group g. """
+    import numpy
+    return numpy.frombuffer(g, dtype=dtype())
+
+def snapshot_into(buf, index=0):
+    """
+    Copy the group into buf without allocating. buf is either a group or a
+    NumPy array of dtype() (e.g. from ring), in which case record index is
+    filled. Returns buf.
+    """
+    if isinstance(buf, group):
+        _get_into(ctypes.addressof(buf))
+        return buf
+
+    if buf.dtype != dtype():
+        raise TypeError("buffer dtype does not match $!g['groupname']!$")
+    if not buf.flags['C_CONTIGUOUS'] or not buf.flags['WRITEABLE']:
+        raise ValueError("buffer must be contiguous and writable")
+    if not 0 <= index < buf.size:
+        raise IndexError("record {0} out of range".format(index))
+    _get_into(buf.ctypes.data + index * buf.itemsize)
+    return buf
+
 
 <!--(for k in g['varnames'])-->
     <!--(if g['vars'][k]['type'] == 'string')-->
@@ -61,6 +103,7 @@ class $!k!$(shm.base.ShmVar):
 
     <!--(else)-->
 class $!k!$(shm.base.ShmVar):
+    _bundle_id = $!g['vars'][k]['bundle_id']!$
     _get = auv_var_lib.shm_get_$!g['groupname']!$_$!k!$
     _get.argtypes = []
     _get.restype = ctypes.$!g['vars'][k]['ptype']!$
@@ -1,11 +1,36 @@
+import importlib
+import os
+import sys
+
 __all__ = ['watchers',
     <!--(for g in groups)-->
            '$!g['groupname']!$',
     <!--(end)-->
            ]
 
-for module in __all__:
-    __import__("shm.{0}".format(module))
+# Python 3.7+ supports module-level __getattr__ (PEP 562), which lets us defer
+# importing each group (and binding all of its ctypes functions) until it is
+# first used. Set SHM_EAGER=1 to import every group up front instead.
+_lazy = sys.version_info >= (3, 7) and not os.environ.get("SHM_EAGER")
+
+
+def _load(name):
+    return importlib.import_module("shm.{0}".format(name))
+
+
+if _lazy:
+    def __getattr__(name):
+        if name in __all__:
+            # Importing a submodule binds it as an attribute of this package,
+            # so __getattr__ is only ever hit once per group.
+            return _load(name)
+        raise AttributeError("module 'shm' has no attribute '{0}'".format(name))
+
+    def __dir__():
+        return sorted(set(globals()) | set(__all__))
+else:
+    for module in __all__:
+        __import__("shm.{0}".format(module))
 
 from shm.base import auv_var_lib
 
@@ -37,12 +62,12 @@ def _eval(x):
     if grp not in __all__:
         raise ShmEvalError(str(x) + " - group not found")
 
-    mod = eval(grp)
+    mod = _load(grp)
     if len(sval) == 2:
         vr = sval[1]
         if vr not in mod.__dict__:
             raise ShmEvalError(str(x) + " - variable not found")
-        return eval(grp + "." + vr)
+        return getattr(mod, vr)
 
     else:
         return mod
@@ -1,6 +1,8 @@
 #include "shm.h"
 #include "vars.h"
 
+#include <stddef.h>
+
 <!--(for g in groups)-->
 
 void shm_watch_$!g['groupname']!$(watcher_t watcher) {
@@ -49,6 +51,10 @@ struct $!g['groupname']!$ shm_get_$!g['groupname']!$() {
     return ret;
 }
 
+void shm_get_into_$!g['groupname']!$(struct $!g['groupname']!$* dst) {
+    shm_getg($!g['groupname']!$, *dst);
+}
+
 void shm_set_$!g['groupname']!$(struct $!g['groupname']!$ val) {
     shm_setg($!g['groupname']!$, val);
 }
@@ -69,3 +75,142 @@ void shm_zero_$!g['groupname']!$() {
     shm_zerog($!g['groupname']!$);
 }
 <!--(end)-->
+
+enum shm_bundle_type {
+    SHM_BUNDLE_DOUBLE,
+    SHM_BUNDLE_FLOAT,
+    SHM_BUNDLE_INT,
+    SHM_BUNDLE_INT16,
+};
+
+struct shm_bundle_var {
+    size_t meta;  // offset of the group's struct shm_meta within struct shm
+    size_t value; // offset of the variable within struct shm
+    enum shm_bundle_type type;
+};
+
+static const struct shm_bundle_var shm_bundle_vars[] = {
+<!--(for g in groups)-->
+    <!--(for k in g['varnames'])-->
+        <!--(if g['vars'][k]['type'] != 'string')-->
+    /* $!g['vars'][k]['bundle_id']!$ */ {offsetof(struct shm, $!g['groupname']!$.m),
+        offsetof(struct shm, $!g['groupname']!$.g.$!k!$), $!g['vars'][k]['bundletype']!$},
+        <!--(end)-->
+    <!--(end)-->
+<!--(end)-->
+};
+
+#define SHM_BUNDLE_COUNT ((int32_t)(sizeof(shm_bundle_vars) / sizeof(shm_bundle_vars[0])))
+
+int32_t shm_bundle_count() {
+    return SHM_BUNDLE_COUNT;
+}
+
+static struct shm_meta* shm_bundle_meta(const struct shm_bundle_var* v) {
+    return (struct shm_meta*)((char*)shm + v->meta);
+}
+
+static void* shm_bundle_value(const struct shm_bundle_var* v) {
+    return (char*)shm + v->value;
+}
+
+void shm_bundle_get(const int32_t* ids, int32_t n, double* out) {
+    struct shm_meta* locked = NULL;
+    for (int32_t i = 0; i < n; i++) {
+        if (ids[i] < 0 || ids[i] >= SHM_BUNDLE_COUNT) {
+            continue;
+        }
+
+        const struct shm_bundle_var* v = &shm_bundle_vars[ids[i]];
+        struct shm_meta* m = shm_bundle_meta(v);
+        if (m != locked) {
+            if (locked) {
+                pthread_mutex_unlock(&locked->m);
+            }
+            pthread_mutex_lock(&m->m);
+            locked = m;
+        }
+
+        void* p = shm_bundle_value(v);
+        switch (v->type) {
+            case SHM_BUNDLE_DOUBLE:
+                out[i] = *(double*)p;
+                break;
+            case SHM_BUNDLE_FLOAT:
+                out[i] = *(float*)p;
+                break;
+            case SHM_BUNDLE_INT:
+                out[i] = *(int32_t*)p;
+                break;
+            case SHM_BUNDLE_INT16:
+                out[i] = *(int16_t*)p;
+                break;
+        }
+    }
+    if (locked) {
+        pthread_mutex_unlock(&locked->m);
+    }
+}
+
+// Mark a group as modified (if it was) and notify its watchers, then unlock.
+static void shm_bundle_release(struct shm_meta* m, bool changed) {
+    if (changed) {
+        m->f = 1;
+        m->stream = 1;
+        m->last_client = 0;
+    }
+    shm_notify(m->w);
+    pthread_mutex_unlock(&m->m);
+}
+
+void shm_bundle_set(const int32_t* ids, int32_t n, const double* in) {
+    struct shm_meta* locked = NULL;
+    bool changed = false;
+    for (int32_t i = 0; i < n; i++) {
+        if (ids[i] < 0 || ids[i] >= SHM_BUNDLE_COUNT) {
+            continue;
+        }
+
+        const struct shm_bundle_var* v = &shm_bundle_vars[ids[i]];
+        struct shm_meta* m = shm_bundle_meta(v);
+        if (m != locked) {
+            if (locked) {
+                shm_bundle_release(locked, changed);
+            }
+            pthread_mutex_lock(&m->m);
+            locked = m;
+            changed = false;
+        }
+
+        void* p = shm_bundle_value(v);
+        switch (v->type) {
+            case SHM_BUNDLE_DOUBLE:
+                if (*(double*)p != in[i]) {
+                    *(double*)p = in[i];
+                    changed = true;
+                }
+                break;
+            case SHM_BUNDLE_FLOAT:
+                if (*(float*)p != (float)in[i]) {
+                    *(float*)p = (float)in[i];
+                    changed = true;
+                }
+                break;
+            case SHM_BUNDLE_INT:
+                if (*(int32_t*)p != (int32_t)in[i]) {
+                    *(int32_t*)p = (int32_t)in[i];
+                    changed = true;
+                }
+                break;
+            case SHM_BUNDLE_INT16:
+                if (*(int16_t*)p != (int16_t)in[i]) {
+                    *(int16_t*)p = (int16_t)in[i];
+                    changed = true;
+                }
+                break;
+        }
+    }
+    if (locked) {
+        shm_bundle_release(locked, changed);
+    }
+}
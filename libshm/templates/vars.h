@@ -29,6 +29,7 @@ void shm_set_nl_$!g['groupname']!$_$!k!$($!g['vars'][k]['ctype']!$ val);
     <!--(end)-->
 
 struct $!g['groupname']!$ shm_get_$!g['groupname']!$();
+void shm_get_into_$!g['groupname']!$(struct $!g['groupname']!$* dst);
 void shm_set_$!g['groupname']!$(struct $!g['groupname']!$ val);
 void shm_lock_$!g['groupname']!$();
 void shm_unlock_$!g['groupname']!$();
@@ -36,6 +37,18 @@ void shm_finish_$!g['groupname']!$();
 void shm_zero_$!g['groupname']!$();
 <!--(end)-->
 
+/*
+ * Bundles read or write many non-string variables, from any number of groups,
+ * in a single call. Variables are identified by their bundle id (exposed as
+ * _bundle_id on the generated python variable classes) and their values are
+ * converted to and from double. Runs of consecutive ids from the same group
+ * are accessed under a single lock, and watchers of a group are notified once
+ * per run on set. Out of range ids are skipped.
+ */
+int32_t shm_bundle_count();
+void shm_bundle_get(const int32_t* ids, int32_t n, double* out);
+void shm_bundle_set(const int32_t* ids, int32_t n, const double* in);
+
 #ifdef __cplusplus
 }
 #endif
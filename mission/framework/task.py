@@ -170,7 +170,7 @@ class Task:
         :param level: The level to be logged. Use the other helper log methods for standard levels.
         :param copy_to_stdout: If True, the message will be copied to standard out. This is useful for quick debugging.
         """
-        Logger(Task.task_call_stack + [level])(*args, copy_to_stdout=copy_to_stdout, **kwargs)
+        Logger(Task.task_call_stack + [level])(*args, copy_to_stdout=copy_to_stdout, depth=2, **kwargs)
 
     logv = functools.partialmethod(log, level="verbose", copy_to_stdout=False)
     logd = functools.partialmethod(log, level="debug", copy_to_stdout=False)
@@ -7,3 +7,4 @@ build.install('auv-actuator-test', f='self_test/actuator_test.py')
 build.install('auv-thruster-test', f='self_test/thruster_test.py')
 build.install('auv-thruster-test-random', f='self_test/thruster-test-random.py')
 build.install('auv-stress-thruster', f='self_test/thruster_stress.py')
+build.install('auv-thruster-tables', f='self_test/thruster_tables.py')
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+
+import sys
+
+from control.thrusters import all_thrusters
+
+if __name__ == "__main__":
+    print("== Thruster lookup table check ==")
+    print("Compares the thrust and pwm lookup tables of each thruster")
+    print("with its model curves.")
+
+    failed = False
+    for t in all_thrusters:
+        errors = t.check_tables()
+        print(" %s (%s): %d mismatches" % (t.name, type(t).__name__, len(errors)))
+        for error in errors[:5]:
+            print("   %s: table %s, curve %s" % error)
+        failed = failed or len(errors) > 0
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,189 @@
+''' The heading and velocity filters run by auv-kalmand. They are stepped on one
+set of inputs at a time, so that they can be run from live shared memory or
+replayed from a log (see kalman_replay.py). '''
+
+from numpy import array, sin, radians
+import numpy as np
+import quat
+
+from settings import dt
+
+from auv_python_helpers.angles import abs_heading_sub_degrees
+from conf.vehicle import sensors, VEHICLE
+from kalman_unscented import UnscentedKalmanFilter
+from kalman_position import PositionFilter
+
+# thruster_array allows access to thruster values
+thrusters = ['port', 'starboard', 'sway_fore', 'sway_aft']
+
+# DVL beam variables
+beam_names = ['low_amp_1', 'low_amp_2', 'low_amp_3', 'low_amp_4',
+              'low_correlation_1', 'low_correlation_2', 'low_correlation_3', 'low_correlation_4']
+
+# XXX Fragile.
+dvl_velocity = "dvl" in sensors["vely"]
+
+# Groups holding the sensors of the vehicle, and every group read by a step
+SENSOR_GROUPS = sorted(set(sensors[name].split('.')[0] for name in sensors))
+INPUT_GROUPS = sorted(set(SENSOR_GROUPS) | {'gx4', 'him', 'dvl', 'switches', 'motor_desires',
+                                            'control_internal_wrench'})
+
+# fx and hx take all sigma points at once, one per row
+def fx(sp, dt):
+    q_initial = sp[:, :4].T
+    disp_quat = quat.ypr_to_quat((sp[:, 4:] * dt).T)
+    q_final = quat.add_quat(q_initial, disp_quat)
+    sp[:, 0] = q_final[0]
+    sp[:, 1] = q_final[1]
+    sp[:, 2] = q_final[2]
+    sp[:, 3] = q_final[3]
+    return sp
+
+def hx(sp):
+    return sp
+
+def sensor(inputs, name):
+    ''' The value of a sensor of the vehicle config in inputs '''
+    group_name, var_name = sensors[name].split('.')
+    return getattr(inputs[group_name], var_name)
+
+class KalmanFilters(object):
+    ''' Inputs are given as a dictionary from each of INPUT_GROUPS to a struct
+    of that group (as returned by shm.<group>.get()), outputs as a struct of
+    shm.kalman. The initial state is taken from the inputs given here. '''
+
+    def __init__(self, inputs):
+        q = inputs[sensors["quaternion"]]
+        self.orientation_filter = UnscentedKalmanFilter(7, fx, 7, hx, dt, .1, vectorized=True)
+        self.orientation_filter.x_hat = np.array([q.q0, q.q1, q.q2, q.q3, 0, 0, 0])
+        self.orientation_filter.P *= .5
+        self.orientation_filter.R = np.array([[10, 0, 0, 0, 0, 0, 0],
+                                              [0, 90, 0, 0, 0, 0, 0],
+                                              [0, 0, 10, 0, 0, 0, 0],
+                                              [0, 0, 0, 40, 0, 0, 0],
+                                              [0, 0, 0, 0, .5, 0, 0],
+                                              [0, 0, 0, 0, 0, .7, 0],
+                                              [0, 0, 0, 0, 0, 0, .05]])
+        # Process noise of the orientation filter per step of the nominal dt
+        self.orientation_Q = self.orientation_filter.Q.copy()
+
+        kalman_xHat = array([[ -1*sensor(inputs, 'velx'),
+            # sensor(inputs, 'accelx'),
+            sensor(inputs, 'vely'),
+            0,
+            # sensor(inputs, 'accely'),
+            0,
+            0,
+            0,
+            sensor(inputs, 'depth') - sensor(inputs, 'depth_offset'),
+            #sensor(inputs, 'depth') - 8.64,
+            0]]).reshape(8,1)
+        self.position_filter = PositionFilter(kalman_xHat)
+
+    def step_orientation(self, step_dt, inputs, outputs):
+        ''' Steps the orientation filter, setting the orientation of outputs '''
+        orientation_filter = self.orientation_filter
+
+        yaw_rate_kal = sensor(inputs, 'heading_rate')*np.pi/180
+        pitch_rate_kal = sensor(inputs, 'pitch_rate')*np.pi/180
+        roll_rate_kal = sensor(inputs, 'roll_rate')*np.pi/180
+
+        # Bugs arise due to quaternion aliasing, so we choose the quaternion
+        # closest to the actual state
+        q = inputs[sensors["quaternion"]]
+        actual_quat = [q.q0, q.q1, q.q2, q.q3]
+        negated_quat = [-i for i in actual_quat]
+        kalman_quat = orientation_filter.x_hat[:4]
+
+        actual_delta = [kalman_quat[i] - actual_quat[i] for i in range(4)]
+        negated_delta = [kalman_quat[i] - negated_quat[i] for i in range(4)]
+
+        quat_in = actual_quat
+        if np.linalg.norm(actual_delta) > np.linalg.norm(negated_delta):
+            quat_in = negated_quat
+
+        orientation_filter.dt = step_dt
+        orientation_filter.Q = self.orientation_Q * (step_dt / dt)
+        orientation_filter.predict()
+        orientation_filter.update(quat_in + [yaw_rate_kal, pitch_rate_kal, roll_rate_kal])
+
+        # [q0, q1, q2, q3, yawrate, pitchrate, rollrate]
+        data = orientation_filter.x_hat
+        ypr = quat.quat_to_ypr(data[:4])
+
+        keys = ['q0', 'q1', 'q2', 'q3', 'heading_rate', 'pitch_rate', 'roll_rate']
+        output = dict(zip(keys, data))
+        outputs.update(**output)
+        outputs.heading_rate *= 180/np.pi
+        outputs.pitch_rate *= 180/np.pi
+        outputs.roll_rate *= 180/np.pi
+        outputs.update(**{'heading': ypr[0]*180/np.pi%360, 'pitch': ypr[1]*180/np.pi, 'roll': ypr[2]*180/np.pi})
+
+        outputs.heading_cumulative = outputs.heading
+
+    def step_position(self, step_dt, inputs, outputs):
+        ''' Steps the position filter, setting the velocity, depth and
+        position of outputs. Uses the orientation set by step_orientation '''
+
+        ## Read Inputs
+        #Data relative to the sub
+        x_vel = -1*sensor(inputs, 'velx')
+        x_acc = 0 # sensor(inputs, 'accelx')
+        y_vel = -1*sensor(inputs, 'vely')
+        y_acc = 0 # sensor(inputs, 'accely')
+
+        # When the DVL is tracking the surface the y velocity is reversed.
+        # This is not ideal... what happens when it is not exactly inverted?
+        if dvl_velocity and \
+           bool(abs_heading_sub_degrees(outputs.roll, 180) < 90) ^ \
+           bool(abs_heading_sub_degrees(outputs.pitch, 180) < 90):
+            y_vel = -y_vel
+
+        #depth = sensor(inputs, 'depth') - sensor(inputs, 'depth_offset')
+        depth = sensor(inputs, 'depth') - 8.64
+        #depth = 2.5 - shm.dvl.savg_altitude.get()
+        # Compensate for gravitational acceleration
+        grav_x = sin( radians(outputs.pitch) )*9.8 # XXX: CHRIS DOES NOT LIKE (small angle approx??)
+        grav_y = -sin( radians(outputs.roll) )*9.8
+        gx4, him = inputs['gx4'], inputs['him']
+        gx4_grav_y = np.tan(radians(outputs.pitch))*np.sqrt(gx4.accelx**2 + gx4.accelz**2)
+        gx4_grav_x = -1*np.tan(radians(outputs.roll))*gx4.accelz
+        him_grav_y = np.tan(radians(outputs.pitch))*np.sqrt(him.x_accel**2 + him.z_accel**2)
+        him_grav_x = -1*np.tan(radians(outputs.roll))*him.z_accel
+        x_acc = x_acc - grav_x
+        y_acc = y_acc - grav_y
+        x_acc, y_acc = [0, 0] # temporary
+
+
+        #Check whether the DVL beams are good
+        beams_good = sum( [not getattr(inputs['dvl'], name) for name in beam_names] ) >= 2
+
+        #beams_good = all( [not getattr(inputs['dvl'], name) for name in beam_names] )
+        #And if not, disable them
+        if not beams_good:
+            active_measurements = array([0,1,0,1,1]).reshape((5,1))
+        else:
+            active_measurements = None
+
+        # XXX Experimental.
+        #active_measurements = array([1,0,1,0,1]).reshape((5,1))
+
+        soft_kill = inputs['switches'].soft_kill
+
+        curr_thrusters = dict((t,(1-soft_kill)*getattr(inputs['motor_desires'], t)) for t in thrusters)
+        wrench = inputs['control_internal_wrench']
+        u = array((wrench.f_x, wrench.f_y, \
+                   wrench.f_z, wrench.t_x, \
+                   wrench.t_y, wrench.t_z))
+
+
+
+        ## Update
+
+        self.position_filter.set_dt(step_dt)
+        outputs.update(**self.position_filter.update(outputs.heading, x_vel, x_acc, y_vel, y_acc, depth, u, active_measurements, curr_thrusters, outputs.pitch, outputs.roll))
+
+        # This really shouldn't be necessary when kalman has a u term (which it does)
+        if not beams_good and VEHICLE is "thor":
+            outputs.velx = 0
+            outputs.vely = 0
@@ -9,6 +9,14 @@ from quat import hamilton, normalize_quat, conj
 from numpy import array, radians, sin, cos, zeros, eye
 from shm.kalman import q0, q1, q2, q3
 
+def process_noise(dt, aSigma, bSigma):
+    return aSigma*aSigma*array([[dt**4/4, dt**3/2, 0, 0, 0, 0, 0, 0], [dt**3/2, dt**2, 0, 0, 0, 0, 0, 0], [0, 0, dt**4/4, dt**3/2, 0, 0, 0, 0],
+                                [0, 0, dt**3/2, dt**2, 0, 0, 0, 0],
+                                [0, 0, 0, 0, bSigma**2, 0, 0, 0],
+                                [0, 0, 0, 0, 0, bSigma**2, 0, 0],
+                                [0, 0, 0, 0, 0, 0, dt**4/4, dt**3/2],
+                                [0, 0, 0, 0, 0, 0, dt**3/2, dt**2] ] ).reshape(8,8)
+
 class PositionFilter(generic_kalman.KalmanFilter):
     def __init__(self, xHatStart):
         #State size
@@ -61,12 +69,7 @@ class PositionFilter(generic_kalman.KalmanFilter):
                     [0, 0, 0, 0, 0, 0, 1, 0] ]).reshape(m,n)
 
         #Q n-by-n process noise covariance
-        Q = aSigma*aSigma*array([[dt**4/4, dt**3/2, 0, 0, 0, 0, 0, 0], [dt**3/2, dt**2, 0, 0, 0, 0, 0, 0], [0, 0, dt**4/4, dt**3/2, 0, 0, 0, 0],
-                                 [0, 0, dt**3/2, dt**2, 0, 0, 0, 0],
-                                 [0, 0, 0, 0, bSigma**2, 0, 0, 0],
-                                 [0, 0, 0, 0, 0, bSigma**2, 0, 0],
-                                 [0, 0, 0, 0, 0, 0, dt**4/4, dt**3/2],
-                                 [0, 0, 0, 0, 0, 0, dt**3/2, dt**2] ] ).reshape(n,n)
+        Q = process_noise(dt, aSigma, bSigma)
 
         #R m-by-m measurement noise covariance
         R = array([ [velSigma**2, 0, 0, 0, 0],
@@ -93,6 +96,17 @@ class PositionFilter(generic_kalman.KalmanFilter):
         self.east = 0.0
 
         self.dt = dt
+        self.drag = drag
+        self.aSigma = aSigma
+        self.bSigma = bSigma
+
+    def set_dt(self, step_dt):
+        ''' Sets the time step of the following updates, rebuilding the parts
+        of A and Q that depend on it. drag is given per step of the nominal dt '''
+        self.dt = step_dt
+        self.A[0][0] = self.A[2][2] = self.drag ** (step_dt / dt)
+        self.A[6][7] = step_dt
+        self.Q = process_noise(step_dt, self.aSigma, self.bSigma)
 
     def update(self, heading, x_vel, x_acc, y_vel, y_acc, depth, wench,
                     active_measurements=None,
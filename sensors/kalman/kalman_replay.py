@@ -1,61 +1,131 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 '''
-Reads a data log file and runs the kalman heading filter on it.
+Runs the filters of auv-kalmand over a shared memory log as fast as possible.
 
-Pass in the data log filename as an argument.
-Data log files can be recorded with util/data_logger.py
-This must be a tuple, first element a dictionary of variable names to
-arrays of data. Second element, an ordered list of 
+The log is decoded in bulk (see shm_tools/shmlog/bulk.py). A step is run at
+every time slice where one of the vehicle's sensor groups was logged, as
+auv-kalmand does with --schedule event (no closer together than 1/--max-rate
+seconds), or every dt seconds of log time with --fixed. Each step is given the
+log time since the previous one.
+
+Prints how long the steps took and how far the replayed outputs are from the
+kalman outputs in the log. With -o, also writes a pickle of a dictionary of
+arrays, like log2arrays.py, with the time of each step, the time spent in it
+(step_time), the replayed outputs (replay.<variable>) and the logged outputs
+held at each step (kalman.<variable>).
 '''
-from math import degrees
 
-#settings
-heading_var = "hdg_dvl_linear"
+import argparse
+import pickle
+import time
 
-#Get input filename
-import sys
-if len(sys.argv) > 1:
-    filename = sys.argv[1]
-else:
-    print "Give data log file as a parameter."
-    print "Data log files can be recorded with util/data_logger.py"
-    exit()
+import numpy as np
 
-#load File
-import pickle
-data = pickle.load(file(filename, "r"))
-
-#Convert data
-data["rate_3dmg"] = [degrees(x) for x in data["rate_3dmg"]]
-
-#Make filter
-import kalman_orientation
-import numpy
-
-#Construct xHat from first data record and zeros for pitch/roll
-xHat = numpy.array([data[heading_var][0], (data["rate_3dmg"][0]), 0,0,0,0]).reshape(6,1)
-kalman_orientation.initialize(xHat)
-
-#Result storage
-heading_list = []
-rate_list = []
-
-
-#Actually run the filter
-for i in range(1,len(data[heading_var])):
-    input = [data[heading_var][i], data["rate_3dmg"][i], data["rate_3dmg"][i],0,0,0,0]
-    output = kalman_orientation.update(*tuple(input))
-    heading_list.append( output[0][0] )
-    rate_list.append( output[1][0] )
-
-import pylab
-#pylab.plot([(x-(data["hdg_dvl_linear"][0]-data["hdg_3dmg"][0]))%360.for x in data["hdg_dvl_linear"]], label="hm")
-pylab.plot(data["hdg_dvl_linear"], label="hl")
-pylab.plot(data["hdg_3dmg"], label="h3")
-pylab.plot(heading_list, label="hk")
-#pylab.show()
-pylab.plot(data["rate_3dmg"], label="rm")
-pylab.plot([degrees(x) for x in data["rate_imu"]], label="ri")
-pylab.plot(rate_list, label="rk")
-pylab.legend()
-pylab.show()
+import shm
+from shm_tools.shmlog.bulk import decode, sample, hold
+
+from settings import dt
+from kalman_filters import KalmanFilters, INPUT_GROUPS, SENSOR_GROUPS
+
+# Outputs compared modulo 360 degrees
+ANGLES = ['heading', 'heading_cumulative', 'pitch', 'roll']
+
+def group_vars(group_name):
+    return ['{}.{}'.format(group_name, var) for (var, _) in getattr(shm, group_name)._fields]
+
+def records(group_name, held, n):
+    ''' A record array of the group holding its logged values at each of n steps '''
+    module = getattr(shm, group_name)
+    recs = module.ring(n)
+    for (var, _) in module._fields:
+        column = held.get('{}.{}'.format(group_name, var))
+        if column is not None and column.dtype != object:
+            recs[var] = column
+    return recs
+
+def coalesce(times, rows, min_period):
+    ''' Drops rows less than min_period seconds after the previous row kept '''
+    kept = []
+    last = -np.inf
+    for (row, t) in zip(rows, times[rows]):
+        if t - last >= min_period:
+            kept.append(row)
+            last = t
+    return np.array(kept, dtype=rows.dtype)
+
+def replay(times, rows, held, fixed):
+    n = len(rows)
+    inputs = {g: records(g, held, n) for g in INPUT_GROUPS}
+    outputs = shm.kalman.ring(n)
+    step_times = np.zeros(n)
+
+    structs = lambda i: {g: getattr(shm, g).group.from_buffer(recs, i * recs.itemsize)
+                         for (g, recs) in inputs.items()}
+    filters = KalmanFilters(structs(0))
+    for i in range(n):
+        step_dt = dt if fixed or i == 0 else times[rows[i]] - times[rows[i - 1]]
+        step_inputs = structs(i)
+        if i > 0:
+            outputs[i] = outputs[i - 1]
+        step_outputs = shm.kalman.group.from_buffer(outputs, i * outputs.itemsize)
+
+        start = time.perf_counter()
+        filters.step_orientation(step_dt, step_inputs, step_outputs)
+        filters.step_position(step_dt, step_inputs, step_outputs)
+        step_times[i] = time.perf_counter() - start
+
+    return outputs, step_times
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Replay the Kalman filters over a shm log.')
+    ap.add_argument('log', type=str, help='shm log to replay')
+    ap.add_argument('-o', dest='output', type=str, help='pickle to write the replayed and logged outputs to')
+    ap.add_argument('--fixed', action='store_true', help='step every dt seconds of log time')
+    ap.add_argument('--max-rate', type=float, default=2. / dt,
+                    help='most steps per second of log time without --fixed')
+    ap.add_argument('--jobs', '-j', type=int, default=1, help='number of processes to decode the log with')
+    args = ap.parse_args()
+
+    kalman_vars = group_vars('kalman')
+    variables = sum((group_vars(g) for g in INPUT_GROUPS), []) + kalman_vars
+
+    start = time.perf_counter()
+    times, columns = decode(args.log, variables, args.jobs)
+    decode_time = time.perf_counter() - start
+
+    sensor_columns = dict((k, c) for (k, c) in columns.items()
+                          if k.split('.')[0] in SENSOR_GROUPS and len(c[0]))
+    if not sensor_columns:
+        raise SystemExit('no sensors of the vehicle are in the log')
+    rows, _ = sample(times, sensor_columns, 1. / dt if args.fixed else 0)
+    if not args.fixed:
+        rows = coalesce(times, rows, 1. / args.max_rate)
+    held = hold(columns, rows)
+
+    outputs, step_times = replay(times, rows, held, args.fixed)
+
+    log_time = times[rows[-1]] - times[rows[0]] if len(rows) else 0
+    print('decoded {:.1f} s of log in {:.2f} s'.format(times[-1] - times[0], decode_time))
+    print('{} steps over {:.1f} s of log in {:.2f} s ({:.0f}x real time)'.format(
+        len(rows), log_time, step_times.sum(), log_time / max(step_times.sum(), 1e-9)))
+    print('step time us: median {:.0f}, p99 {:.0f}, max {:.0f}'.format(
+        *(np.percentile(step_times, [50, 99, 100]) * 1e6)))
+
+    print('{:>20} {:>12} {:>12}'.format('output', 'rms diff', 'max diff'))
+    for k in kalman_vars:
+        if k not in columns or not len(columns[k][0]):
+            continue
+        var = k.split('.')[1]
+        diff = outputs[var] - held[k]
+        if var in ANGLES:
+            diff = (diff + 180) % 360 - 180
+        print('{:>20} {:>12.4g} {:>12.4g}'.format(var, np.sqrt(np.mean(diff ** 2)), np.abs(diff).max()))
+
+    if args.output:
+        start_time = np.floor(times[0]) if len(times) else 0
+        out = dict(('replay.' + var, outputs[var]) for (var, _) in shm.kalman._fields)
+        out.update((k, held[k]) for k in kalman_vars if k in held)
+        out['time'] = times[rows] - start_time
+        out['step_time'] = step_times
+        with open(args.output, 'wb') as f:
+            pickle.dump(out, f)
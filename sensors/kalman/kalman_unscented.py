@@ -1,4 +1,4 @@
-from numpy.linalg import inv
+from numpy.linalg import cholesky, solve
 import numpy as np
 from unscented_tools import calculate_sigmas, unscented_transform
 '''
@@ -36,6 +36,12 @@ sp, sp_f, sp_h - sigma points calculated normally, in the state space, and
                  measurement space, respectively
 
 K - kalman gain, calculated in the update step
+
+vectorized - whether F and H take the whole (2*Nx+1)-by-N matrix of sigma
+             points, one per row, rather than a single sigma point. F may
+             overwrite the matrix it is given. Filters that run at high rates
+             should use vectorized transfer functions, as calling F and H once
+             per sigma point dominates the cost of a step
 '''
 
 
@@ -43,7 +49,7 @@ class UnscentedKalmanFilter(object):
 
     def __init__(self, state_size, state_transfer, measurement_size,
                  measurement_transfer, time_step, sigma_spread,
-                 difference = lambda x, y: x - y):
+                 difference = lambda x, y: x - y, vectorized = False):
 
         self.x_hat = np.zeros(state_size)
         self.Nx = state_size
@@ -57,40 +63,56 @@ class UnscentedKalmanFilter(object):
         self.weights = np.full(2*state_size+1, .5 / (state_size+sigma_spread))
         self.weights[0] = sigma_spread / (state_size+sigma_spread)
         self.difference = difference
+        self.vectorized = vectorized
         self.num_sp = 2*state_size + 1
         self.sp = np.zeros((self.num_sp, self.Nx))
         self.sp_f = np.zeros((self.num_sp, self.Nx))
         self.sp_h = np.zeros((self.num_sp, self.Nz))
         self.dt = time_step
 
+        # Work buffers, reused every step
+        self._dev_f = np.zeros((self.num_sp, self.Nx))
+        self._weighted_f = np.zeros((self.num_sp, self.Nx))
+        self._dev_h = np.zeros((self.num_sp, self.Nz))
+        self._weighted_h = np.zeros((self.num_sp, self.Nz))
+
     def predict(self):
 
-        self.sp = calculate_sigmas(self.x_hat, self.Nx, self.P, self.kappa)
+        calculate_sigmas(self.x_hat, self.Nx, self.P, self.kappa, out=self.sp)
 
         # Transform sigmas into predicted state space
-        for i in range(self.num_sp):
-            self.sp_f[i] = self.F(self.sp[i], self.dt)
+        if self.vectorized:
+            self.sp_f[...] = self.F(self.sp, self.dt)
+        else:
+            for i in range(self.num_sp):
+                self.sp_f[i] = self.F(self.sp[i], self.dt)
 
         # Normalize through unscented transform
-        self.x_hat, self.P = unscented_transform(self.sp_f, self.weights, self.Q)
+        self.x_hat, self.P = unscented_transform(self.sp_f, self.weights, self.Q,
+                                                 self._dev_f, self._weighted_f)
 
     def update(self, z):
 
         # Transform sigmas into measurement space
-        for i in range(self.num_sp):
-            self.sp_h[i] = self.H(self.sp_f[i])
+        if self.vectorized:
+            self.sp_h[...] = self.H(self.sp_f)
+        else:
+            for i in range(self.num_sp):
+                self.sp_h[i] = self.H(self.sp_f[i])
 
         # Mean and covariance of the state in the measurement space
-        Hx_bar, PHx = unscented_transform(self.sp_h, self.weights, self.R)
+        Hx_bar, PHx = unscented_transform(self.sp_h, self.weights, self.R,
+                                          self._dev_h, self._weighted_h)
         # Cross variance of Fx and Hx -- used to calculate K
-        cross_var = np.zeros((self.Nx, self.Nz))
+        np.subtract(self.sp_f, self.x_hat, out=self._dev_f)
+        cross_var = np.dot(self._dev_f.T, self._weighted_h)
 
-        for i in range(self.num_sp):
-            cross_var += self.weights[i] * np.outer(self.sp_f[i] - self.x_hat,
-                                                    self.sp_h[i] - Hx_bar)
-        # Calculate K and measurement residual
-        K = np.dot(cross_var, inv(PHx))
+        # K = cross_var * PHx^-1, solved through the Cholesky factor of PHx
+        # (PHx = L * L^T) rather than by inverting it
+        L = cholesky(PHx)
+        K = solve(L.T, solve(L, cross_var.T)).T
         residual = self.difference(z, Hx_bar)
         # Update predicted to new values for state and variance
+        # (K * PHx * K^T = K * cross_var^T)
         self.x_hat += np.dot(K, residual)
-        self.P -= np.dot(K, np.dot(PHx, K.T))
+        self.P -= np.dot(K, cross_var.T)
@@ -150,7 +150,7 @@ class DummyShm(object):
 
     def __init__(self, group_name):
         self.group_name = group_name
-        self.var = shm.__dict__[group_name]
+        self.var = getattr(shm, group_name)
 
     def __getattr__(self, name):
         ''' uses the value from the shared_vars global.
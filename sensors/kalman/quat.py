@@ -1,12 +1,18 @@
 import math
+import numpy as np
 
 
+# ypr_to_quat and add_quat also work elementwise on arrays of angles and
+# quaternion components
 def ypr_to_quat(ypr):
     [y, p, r] = ypr
-    q0 = math.cos(r/2)*math.cos(p/2)*math.cos(y/2) + math.sin(r/2)*math.sin(p/2)*math.sin(y/2)
-    q1 = math.sin(r/2)*math.cos(p/2)*math.cos(y/2) - math.cos(r/2)*math.sin(p/2)*math.sin(y/2)
-    q2 = math.cos(r/2)*math.sin(p/2)*math.cos(y/2) + math.sin(r/2)*math.cos(p/2)*math.sin(y/2)
-    q3 = math.cos(r/2)*math.cos(p/2)*math.sin(y/2) - math.sin(r/2)*math.sin(p/2)*math.cos(y/2)
+    cy, sy = np.cos(y/2), np.sin(y/2)
+    cp, sp = np.cos(p/2), np.sin(p/2)
+    cr, sr = np.cos(r/2), np.sin(r/2)
+    q0 = cr*cp*cy + sr*sp*sy
+    q1 = sr*cp*cy - cr*sp*sy
+    q2 = cr*sp*cy + sr*cp*sy
+    q3 = cr*cp*sy - sr*sp*cy
     return [q0, q1, q2, q3]
 
 
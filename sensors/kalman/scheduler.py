@@ -0,0 +1,121 @@
+''' Schedulers for the filter steps of auv-kalmand, and accounting of how the
+steps were timed, published into shm.kalman_timing. '''
+
+import time
+from threading import Thread
+
+import numpy as np
+
+import shm
+from shm.watchers import watcher
+
+PUBLISH_INTERVAL = 1.0
+
+class StepTiming(object):
+    ''' Collects the start and end times of steps and publishes a summary of
+    them into shm.kalman_timing every PUBLISH_INTERVAL seconds. A step that
+    takes longer than dt is an overrun. '''
+
+    def __init__(self, dt):
+        self.dt = dt
+        self.overruns = 0
+        self.timeouts = 0
+        self._last_start = None
+        self._window_start = time.monotonic()
+        self._window_steps = 0
+        self._step_times = []
+        self._intervals = []
+
+    def record(self, start, end, timeout=False):
+        self._window_steps += 1
+        self._step_times.append(end - start)
+        if self._last_start is not None:
+            self._intervals.append(start - self._last_start)
+        self._last_start = start
+        if end - start > self.dt:
+            self.overruns += 1
+        if timeout:
+            self.timeouts += 1
+        if end - self._window_start >= PUBLISH_INTERVAL:
+            self.publish(end)
+
+    def publish(self, now):
+        timing = shm.kalman_timing.get()
+        timing.rate = self._window_steps / (now - self._window_start)
+        timing.step_time = np.mean(self._step_times) * 1e3 if self._step_times else 0.
+        timing.step_time_max = max(self._step_times, default=0.) * 1e3
+        timing.interval_max = max(self._intervals, default=0.) * 1e3
+        timing.jitter = np.std(self._intervals) * 1e3 if self._intervals else 0.
+        timing.overruns = self.overruns
+        timing.timeouts = self.timeouts
+        shm.kalman_timing.set(timing)
+
+        self._window_start = now
+        self._window_steps = 0
+        self._step_times = []
+        self._intervals = []
+
+class FixedScheduler(object):
+    ''' Steps every dt seconds, catching up on steps missed while busy. Every
+    step is given the nominal dt. '''
+
+    def __init__(self, dt):
+        self.dt = dt
+        self.timing = StepTiming(dt)
+
+    def run(self, step):
+        start = time.monotonic()
+        iteration = 0
+        while True:
+            while iteration*self.dt < time.monotonic() - start:
+                step_start = time.monotonic()
+                step(self.dt)
+                self.timing.record(step_start, time.monotonic())
+                iteration += 1
+
+            time.sleep(self.dt/5.)
+
+class EventScheduler(object):
+    ''' Steps whenever one of groups is updated, but at most once every
+    min_period seconds, and after dt seconds without an update. Every step is
+    given the measured time since the previous one.
+
+    Updates that arrive during a step are coalesced into the next. A thread
+    wakes the watcher at the deadline, so only a single blocking wait is
+    needed. '''
+
+    def __init__(self, groups, dt, min_period):
+        self.dt = dt
+        self.min_period = min_period
+        self.timing = StepTiming(dt)
+        self.watcher = watcher()
+        for group in groups:
+            self.watcher.watch(group)
+        self.deadline = time.monotonic() + dt
+        self.timed_out = False
+
+    def _wake_at_deadlines(self):
+        while True:
+            remaining = self.deadline - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+                continue
+            self.timed_out = True
+            self.watcher.broadcast()
+            self.deadline += self.dt
+
+    def run(self, step):
+        Thread(target=self._wake_at_deadlines, daemon=True).start()
+        last = time.monotonic()
+        while True:
+            self.watcher.wait(new_update=False)
+            start = time.monotonic()
+            if start - last < self.min_period:
+                time.sleep(self.min_period - (start - last))
+                start = time.monotonic()
+            timeout, self.timed_out = self.timed_out, False
+            self.deadline = start + self.dt
+
+            step(start - last)
+            self.timing.record(start, time.monotonic(), timeout)
+            last = start
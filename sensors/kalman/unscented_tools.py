@@ -1,25 +1,33 @@
-from numpy import zeros, dot, outer
+from numpy import zeros, empty_like, dot, add, subtract, multiply
 from numpy.linalg import cholesky
 
 
-def calculate_sigmas(x, dim_x, P, kappa):
+def calculate_sigmas(x, dim_x, P, kappa, out=None):
 
-    sp = zeros((2*dim_x+1, dim_x))
+    sp = zeros((2*dim_x+1, dim_x)) if out is None else out
     sp[0] = x
     root = cholesky((dim_x+kappa)*P).T
-    sp[1:dim_x+1] = x + root
-    sp[dim_x+1:2*dim_x+2] = x - root
+    add(x, root, out=sp[1:dim_x+1])
+    subtract(x, root, out=sp[dim_x+1:2*dim_x+2])
     return sp
 
 
-def unscented_transform(sp, weights, noise):
+def unscented_transform(sp, weights, noise, deviation=None, weighted=None):
+    '''
+    Weighted mean and covariance of the sigma points sp. deviation and
+    weighted are optional work buffers shaped like sp; on return they hold
+    the deviation of each sigma point from the mean, unweighted and weighted.
+    '''
 
     x_bar = dot(weights, sp)
-    num_sp, Nx = sp.shape
-    P = zeros((Nx, Nx))
-
-    for k in range(num_sp):
-        P += weights[k] * outer(sp[k] - x_bar, sp[k] - x_bar)
+    if deviation is None:
+        deviation = empty_like(sp)
+    if weighted is None:
+        weighted = empty_like(sp)
+
+    subtract(sp, x_bar, out=deviation)
+    multiply(weights[:, None], deviation, out=weighted)
+    P = dot(weighted.T, deviation)
 
     if noise is not None:
         P += noise
@@ -0,0 +1,133 @@
+import multiprocessing
+import os
+from bisect import bisect_left
+
+import numpy
+
+from shm_tools.shmlog.parser import LogParser
+
+'''
+Whole-log extraction built on LogParser.parse_all_arrays.
+
+Logs can be split at the snapshot table's file positions, since every snapshot
+starts a new time slice, and the pieces decoded by separate processes.
+'''
+
+#Chunks handed to each process; more than one evens out uneven chunk sizes
+CHUNKS_PER_JOB = 4
+
+#Internal function: decode one byte range of a log in a worker process
+def _decode_range(task):
+    filename, variables, start, stop = task
+    return LogParser(filename).parse_all_arrays(variables, start, stop)
+
+'''
+Splits the data of a log into about count byte ranges at snapshot positions.
+
+parse: LogParser of the log (its snapshot table must have been parsed)
+
+Returns a list of (start, stop) file positions; the last stop is None.
+'''
+def snapshot_ranges(parse, count):
+    positions = sorted(set(p for (t, p) in parse.snapshot_table if p > parse.data_pos))
+    if count <= 1 or not positions:
+        return [(parse.data_pos, None)]
+
+    size = os.path.getsize(parse.filename)
+    bounds = [parse.data_pos]
+    for k in range(1, count):
+        target = parse.data_pos + (size - parse.data_pos) * k // count
+        i = min(bisect_left(positions, target), len(positions) - 1)
+        if positions[i] > bounds[-1]:
+            bounds.append(positions[i])
+
+    return list(zip(bounds, bounds[1:] + [None]))
+
+'''
+Joins results of parse_all_arrays over consecutive ranges of a log.
+'''
+def merge(results):
+    times = numpy.concatenate([t for (t, c) in results])
+
+    columns = {}
+    offset = 0
+    for (t, c) in results:
+        for varstr, (slices, values) in c.items():
+            columns.setdefault(varstr, ([], []))
+            columns[varstr][0].append(slices + offset)
+            columns[varstr][1].append(values)
+        offset += len(t)
+
+    return times, dict((k, (numpy.concatenate(s), numpy.concatenate(v)))
+                       for k, (s, v) in columns.items())
+
+'''
+Decodes a whole log like LogParser.parse_all_arrays, using jobs processes.
+'''
+def decode(filename, variables=None, jobs=1):
+    parse = LogParser(filename)
+    if jobs <= 1:
+        return parse.parse_all_arrays(variables)
+
+    ranges = snapshot_ranges(parse, jobs * CHUNKS_PER_JOB)
+    variables = None if variables is None else list(variables)
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = pool.map(_decode_range, [(filename, variables, a, b) for (a, b) in ranges])
+    finally:
+        pool.close()
+        pool.join()
+
+    return merge(results)
+
+'''
+Chooses which time slices become output rows and holds every variable's most
+recent value at each of them.
+
+freq: if zero, a row is made for every slice where any variable is logged, once
+      all of them have been logged; otherwise for the first slice more than
+      1/freq seconds after the previous row
+
+Returns (rows, held): rows indexes times; held maps each variable to an array of
+its value at every row (zero before it is first logged).
+'''
+def sample(times, columns, freq=0):
+    if freq > 0:
+        rows = []
+        period = 1. / freq
+        next_time = times[0] + period if len(times) else 0
+        while True:
+            i = numpy.searchsorted(times, next_time, side='right')
+            if i >= len(times):
+                break
+            rows.append(i)
+            next_time = times[i] + period
+        rows = numpy.array(rows, dtype=numpy.int64)
+    else:
+        logged = numpy.zeros(len(times), dtype=bool)
+        first = 0
+        for slices, values in columns.values():
+            logged[slices] = True
+            first = len(times) if len(slices) == 0 else max(first, slices[0])
+        logged[:first] = False
+        rows = numpy.nonzero(logged)[0]
+
+    return rows, hold(columns, rows)
+
+'''
+Holds every variable's most recent value at each of the given rows (indexes of
+times, in order).
+
+Returns a dictionary mapping each variable to an array of its value at every
+row (zero before it is first logged).
+'''
+def hold(columns, rows):
+    held = {}
+    for k, (slices, values) in columns.items():
+        latest = numpy.searchsorted(slices, rows, side='right') - 1
+        column = numpy.zeros(len(rows), dtype=values.dtype)
+        column[latest >= 0] = values[latest[latest >= 0]]
+        held[k] = column
+
+    return held
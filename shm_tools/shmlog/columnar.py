@@ -0,0 +1,197 @@
+import json
+import os
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import numpy
+
+from shm_tools.shmlog.parser import LogParser, old_str
+
+'''
+Columnar storage for shared memory logs.
+
+A columnar log is a directory holding, for every logged variable, an array of
+timestamps and an array of values stored as .npy files, plus a JSON index
+describing them. Arrays are memory mapped when read, so extracting a handful
+of variables over a time range only touches the pages that are needed instead
+of decoding the whole AUVl log sequentially.
+
+Layout of <name>.shmcol/:
+    index.json       format version, log info, start/end time, variable table
+    <var>.t.npy      float64 posix timestamps, non-decreasing
+    <var>.v.npy      values: float64, int32, or unicode for strings
+    <var>.i.npy      time index: every INDEX_STRIDE-th timestamp of <var>.t.npy
+'''
+
+FORMAT_VERSION = 1
+INDEX_NAME = "index.json"
+INDEX_STRIDE = 4096
+
+'''
+Exception to be thrown when a columnar log is missing or malformed
+'''
+class ColumnarLogException(Exception): pass
+
+def _posix(t):
+    if isinstance(t, datetime):
+        return time.mktime(t.timetuple()) + t.microsecond / 1e6
+    return float(t)
+
+def _dtype(typ):
+    if typ == float:
+        return numpy.float64
+    if typ == int:
+        return numpy.int32
+    return numpy.str_
+
+def _typename(typ):
+    return "str" if typ is old_str else typ.__name__
+
+'''
+Writes a columnar log to out_dir given per-variable timestamp and value sequences.
+
+columns: dictionary of variable string -> (type [as in LogParser.svars], timestamps, values)
+'''
+def write_columnar(out_dir, columns, info="", start_time=None, end_time=None):
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    table = {}
+    for name, (typ, times, values) in columns.items():
+        t = numpy.asarray(times, dtype=numpy.float64)
+        v = numpy.asarray(values, dtype=_dtype(typ))
+        if len(t) != len(v):
+            raise ColumnarLogException("%s has %d timestamps but %d values" % (name, len(t), len(v)))
+
+        numpy.save(os.path.join(out_dir, name + ".t.npy"), t)
+        numpy.save(os.path.join(out_dir, name + ".v.npy"), v)
+        numpy.save(os.path.join(out_dir, name + ".i.npy"), t[::INDEX_STRIDE])
+        table[name] = {"type": _typename(typ), "count": len(t)}
+
+    index = {
+        "version": FORMAT_VERSION,
+        "info": info,
+        "start_time": None if start_time is None else _posix(start_time),
+        "end_time": None if end_time is None else _posix(end_time),
+        "index_stride": INDEX_STRIDE,
+        "variables": table,
+    }
+    with open(os.path.join(out_dir, INDEX_NAME), "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+
+'''
+Converts an AUVl shm log into a columnar log.
+
+variables: optional list of variable strings (i.e. depth.depth) to convert; defaults to all
+'''
+def convert(log_filename, out_dir, variables=None):
+    parse = LogParser(log_filename)
+    times, decoded = parse.parse_all_arrays(variables)
+
+    types = dict((varstr, typ) for (var, varstr, typ) in parse.svars.values())
+    columns = {}
+    for varstr, (slices, values) in decoded.items():
+        columns[varstr] = (types[varstr], times[slices], values)
+
+    write_columnar(out_dir, columns, parse.info.decode("latin-1").strip(),
+                   parse.get_starttime(), parse.get_endtime())
+    return parse.get_warnings()
+
+'''
+Random-access reader for columnar logs.
+
+All arrays returned are read-only memory maps (or slices of them); copy them if
+they need to outlive the reader or be modified.
+'''
+class ColumnarLog:
+
+    '''
+    path: Path to the columnar log directory
+
+    throws ColumnarLogException if path is not a columnar log
+    '''
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(os.path.join(path, INDEX_NAME)) as f:
+                self.index = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            raise ColumnarLogException("%s is not a columnar shm log: %s" % (path, e))
+
+        if self.index.get("version") != FORMAT_VERSION:
+            raise ColumnarLogException("Unsupported columnar log version %s" % self.index.get("version"))
+
+        self.info = self.index["info"]
+        self.variables = sorted(self.index["variables"].keys())
+        self._cache = {}
+
+    def _load(self, var, kind):
+        key = (var, kind)
+        if key not in self._cache:
+            if var not in self.index["variables"]:
+                raise KeyError("%s is not in this log" % var)
+            self._cache[key] = numpy.load(os.path.join(self.path, "%s.%s.npy" % (var, kind)),
+                                          mmap_mode="r")
+        return self._cache[key]
+
+    '''
+    Gets the time that this log started.
+    '''
+    def get_starttime(self):
+        return datetime.fromtimestamp(self.index["start_time"])
+
+    '''
+    Gets the time that this log ended
+    '''
+    def get_endtime(self):
+        return datetime.fromtimestamp(self.index["end_time"])
+
+    '''
+    Returns the logged type name of a variable: 'float', 'int' or 'str'
+    '''
+    def get_type(self, var):
+        return self.index["variables"][var]["type"]
+
+    def times(self, var):
+        return self._load(var, "t")
+
+    def values(self, var):
+        return self._load(var, "v")
+
+    '''
+    Returns the positions [lo, hi) in the arrays of var covering timestamps in [start, end].
+    start and end are datetimes or posix timestamps; None leaves that side unbounded.
+    '''
+    def span(self, var, start=None, end=None):
+        t = self.times(var)
+        lo = 0 if start is None else self._search(var, _posix(start), bisect_left, "left")
+        hi = len(t) if end is None else self._search(var, _posix(end), bisect_right, "right")
+        return lo, max(lo, hi)
+
+    #Internal method: locate t in the timestamps of var, consulting the
+    #time index first so only a single stride of the memory map is searched
+    def _search(self, var, t, bisect, side):
+        index = self._load(var, "i")
+        stride = self.index["index_stride"]
+        block = max(bisect(index, t) - 1, 0)
+        lo = block * stride
+        chunk = self.times(var)[lo:lo + 2 * stride]
+        return lo + int(numpy.searchsorted(chunk, t, side=side))
+
+    '''
+    Returns (timestamps, values) of var between start and end (inclusive).
+    '''
+    def range(self, var, start=None, end=None):
+        lo, hi = self.span(var, start, end)
+        return self.times(var)[lo:hi], self.values(var)[lo:hi]
+
+    '''
+    Returns the most recent logged value of var at time t, or None if var had
+    not been logged yet at t.
+    '''
+    def value_at(self, var, t):
+        i = self._search(var, _posix(t), bisect_right, "right") - 1
+        if i < 0:
+            return None
+        return self.values(var)[i]
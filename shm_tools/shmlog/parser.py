@@ -1,3 +1,4 @@
+import mmap
 import struct
 import shm
 from shm import ShmEvalError
@@ -42,6 +43,42 @@ Exception to be thrown when log parsing goes horribly wrong
 '''
 class LogParseException(Exception): pass
 
+#special steps for bulk decoding
+_STOP = -1
+_STRINGS = -2
+
+#Converts the decoded values of one variable in a group holding strings
+def _string_block_array(typ, values):
+    import numpy
+    if typ == float:
+        return numpy.array(values, dtype=numpy.float64)
+    if typ == int:
+        return numpy.array(values, dtype=numpy.int32)
+    return numpy.array(values, dtype=numpy.str_)
+
+'''
+Layout of one group as written by the log daemon: every variable of a modified
+group is logged at once, in variable table order. Used for bulk decoding.
+'''
+class GroupBlock:
+    def __init__(self):
+        self.vars = [] #(variable id, variable string, variable type, value offset in block)
+        self.size = 0 #size of the whole block in bytes, None if it holds strings
+
+    def add(self, x, varstr, typ):
+        if typ == float:
+            width = 8
+        elif typ == int:
+            width = 4
+        else:
+            width = None
+
+        if self.size is not None:
+            self.vars.append((x, varstr, typ, self.size + 2))
+            self.size = None if width is None else self.size + 2 + width
+        else:
+            self.vars.append((x, varstr, typ, None))
+
 '''
 Class for parsing raw log files into a useful format
 '''
@@ -57,6 +94,7 @@ class LogParser:
     '''
     def __init__(self, filename, verbose=False, parse_file_end=True):
         self.verbose = verbose
+        self.filename = filename
 
         self.f = open(filename, 'rb', buffering=4096)
 
@@ -111,6 +149,9 @@ class LogParser:
         self.f.read(2) #Read past time flag which must exist
 
         curpos = self.f.tell() 
+
+        #position of the first time flag; where bulk decoding starts
+        self.data_pos = curpos - 2
         
         #read the start time
         self.start_time = self.__read_time()
@@ -318,6 +359,196 @@ class LogParser:
          
         return (vartime, varchange)
 
+    '''
+    Decodes the whole log in one pass over a memory map of the file.
+
+    Instead of building tuples for every variable of every slice, this walks the
+    log one group at a time, recording where each group was written, and then
+    extracts every numeric variable with a single vectorized gather. Groups that
+    contain strings are decoded record by record.
+
+    variables: optional list of variable strings (i.e. depth.depth) to decode; defaults to all
+    start, stop: optional file positions of time flags (i.e. snapshot positions) to
+                 decode between; default to the whole log
+
+    Returns a tuple (times, columns):
+        times: float64 NumPy array of the posix timestamp of every time slice
+        columns: dictionary of variable string -> (slices, values)
+            slices: int64 NumPy array of indices into times where the variable was logged
+            values: NumPy array of the variable's values (float64, int32 or str)
+
+    Slice indices count from the first slice at or after start.
+    Does not affect the position used by parse_one_slice.
+    '''
+    def parse_all_arrays(self, variables=None, start=None, stop=None):
+        import numpy
+
+        wanted = None if variables is None else set(variables)
+        blocks = self.__group_blocks()
+        by_first_id = dict((b.vars[0][0], b) for b in blocks)
+
+        #step to take from a position holding each u16 flag / variable id;
+        #0 for anything that cannot start a block (corruption)
+        steps = [0] * 0x10000
+        steps[TIME] = 10
+        steps[GROUP] = _STOP
+        for b in blocks:
+            steps[b.vars[0][0]] = _STRINGS if b.size is None else b.size
+
+        #decoded values of every variable in groups holding strings, in order
+        strings = {}
+        for b in blocks:
+            if b.size is None:
+                for (x, varstr, typ, off) in b.vars:
+                    strings[varstr] = []
+
+        mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = None
+        try:
+            #Walk the log one time flag or group at a time, recording where each starts.
+            #Everything else is recovered from these positions with vectorized gathers.
+            end = len(mm) if stop is None else min(stop, len(mm))
+            pos = self.data_pos if start is None else start
+            starts = []
+            append = starts.append
+            unpack_flag = struct.Struct("=H").unpack_from
+            while pos + 2 <= end:
+                x, = unpack_flag(mm, pos)
+                step = steps[x]
+                if step > 0:
+                    append(pos)
+                    pos += step
+                elif step == _STOP:
+                    break
+                elif step == _STRINGS:
+                    nxt = self.__decode_string_block(mm, pos, by_first_id, strings)
+                    if nxt is None:
+                        break
+                    append(pos)
+                    pos = nxt
+                else:
+                    raise LogParseException("Log file corruption near " + str(hex(pos)))
+
+            #drop a final time slice or group cut off by the end of the file
+            if starts and pos > end:
+                starts.pop()
+
+            buf = numpy.frombuffer(mm, dtype=numpy.uint8)
+
+            starts = numpy.array(starts, dtype=numpy.int64)
+            ids = buf[starts[:, None] + numpy.arange(2)].view(numpy.uint16).ravel()
+            is_time = ids == TIME
+            slice_index = numpy.cumsum(is_time) - 1
+
+            raw = buf[(starts[is_time] + 2)[:, None] + numpy.arange(8)].view(numpy.int32)
+            times = raw[:, 0] + raw[:, 1] / 1e6
+
+            order = numpy.argsort(ids, kind='mergesort')
+            sorted_ids = ids[order]
+
+            columns = {}
+            id_width = numpy.arange(2)
+            for b in blocks:
+                first = b.vars[0][0]
+                lo = numpy.searchsorted(sorted_ids, first, side='left')
+                hi = numpy.searchsorted(sorted_ids, first, side='right')
+                occurrences = numpy.sort(order[lo:hi])
+                offsets = starts[occurrences]
+                slices = slice_index[occurrences]
+
+                if b.size is None:
+                    for (x, varstr, typ, off) in b.vars:
+                        if wanted is None or varstr in wanted:
+                            columns[varstr] = (slices, _string_block_array(typ, strings[varstr]))
+                    continue
+
+                for (x, varstr, typ, off) in b.vars:
+                    if wanted is not None and varstr not in wanted:
+                        continue
+
+                    var_ids = buf[(offsets + off - 2)[:, None] + id_width].view(numpy.uint16).ravel()
+                    if (var_ids != x).any():
+                        bad = offsets[var_ids != x][0]
+                        raise LogParseException("Log file corruption near " + str(hex(int(bad))))
+
+                    if typ == float:
+                        dtype, width = numpy.float64, 8
+                    else:
+                        dtype, width = numpy.int32, 4
+                    values = buf[(offsets + off)[:, None] + numpy.arange(width)].view(dtype)
+                    columns[varstr] = (slices, values.ravel())
+        finally:
+            #the map cannot be closed while buf still exports it, which would
+            #hide any LogParseException raised above. Everything else gathered
+            #from buf is a copy
+            buf = None
+            mm.close()
+
+        return times, columns
+
+    #Internal method: split the variable table into blocks of consecutive
+    #variables belonging to the same group
+    def __group_blocks(self):
+        blocks = []
+        prev_group = None
+        prev_x = None
+        for x in sorted(self.svars.keys()):
+            var, varstr, typ = self.svars[x]
+            group = varstr.split('.')[0]
+            if group != prev_group or x != prev_x + 1:
+                blocks.append(GroupBlock())
+            blocks[-1].add(x, varstr, typ)
+            prev_group, prev_x = group, x
+        return blocks
+
+    #Internal method: decode a group containing strings record by record,
+    #appending each value to strings[variable string]
+    #returns the position after the group, or None if the file ends inside it
+    def __decode_string_block(self, mm, pos, by_first_id, strings):
+        x, = struct.unpack_from("=H", mm, pos)
+        block = by_first_id[x]
+
+        end = len(mm)
+        decoded = []
+        for (x, varstr, typ, off) in block.vars:
+            if pos + 2 > end:
+                return None
+            y, = struct.unpack_from("=H", mm, pos)
+            if y != x:
+                raise LogParseException("Log file corruption near " + str(hex(pos)))
+            pos += 2
+
+            if typ == float:
+                if pos + 8 > end:
+                    return None
+                val, = struct.unpack_from("=d", mm, pos)
+                pos += 8
+            elif typ == old_str:
+                stop = mm.find(RS.encode('latin-1'), pos)
+                if stop < 0:
+                    return None
+                val = mm[pos:stop].decode('latin-1')
+                pos = stop + 1
+            elif typ == str:
+                if pos + 4 > end:
+                    return None
+                strlen, = struct.unpack_from("=L", mm, pos)
+                if pos + 4 + strlen > end:
+                    return None
+                val = mm[pos + 4:pos + 4 + strlen].decode('latin-1')
+                pos += 4 + strlen
+            else:
+                if pos + 4 > end:
+                    return None
+                val, = struct.unpack_from("=i", mm, pos)
+                pos += 4
+            decoded.append((varstr, val))
+
+        #only keep values of complete groups
+        for (varstr, val) in decoded:
+            strings[varstr].append(val)
+        return pos
+
     '''
     Returns True if there are no remaining time slices to be parsed.
     '''
@@ -339,7 +570,8 @@ class LogParser:
     def __read_string(self):
         strlen, = struct.unpack("=L", self.f.read(4))
         ret_str = self.f.read(strlen)
-        return str(ret_str)
+        #decode bytes to str in python3
+        return ret_str if type(ret_str) == str else ret_str.decode('latin-1')
 
     #Internal method: read string from the current location in the file
     #Uses the old (slow) method of reading until the terminating character 
@@ -0,0 +1,319 @@
+import time
+from threading import Event, Lock
+
+import numpy
+
+import shm
+
+'''
+Playback engine for shared memory logs.
+
+The log is indexed by the file offsets of its snapshots (time slices holding
+every variable) and decoded one window of snapshots at a time
+(LogParser.parse_all_arrays) into one NumPy record array per group, laid out
+like the group's C struct, plus an index of which groups were written in each
+time slice. Playing a slice is then one group-level set() per written group.
+Seeking decodes the window holding the target time and restores every group's
+most recent state from it; since windows start at snapshots, that state is
+complete. Only the window being played is kept (two while the next one is
+decoded), so memory use does not grow with the length of the log.
+
+Slices are scheduled against absolute deadlines computed from the log time of
+each slice, so high speed multipliers do not accumulate drift.
+'''
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+#minimum seconds of log decoded at once; windows are whole stretches between
+#snapshots, which the log daemon writes every 5 seconds
+WINDOW_SECONDS = 60.0
+
+def _posix(dt):
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
+
+#Internal class: one shm group played back from the log
+class _PlaybackGroup:
+    def __init__(self, name, slices, fields):
+        self.name = name
+        self.module = shm._eval(name)
+        self.slices = slices #slice index of every time the group was logged
+        self.fields = [f for (f, values) in fields]
+
+        self.records = numpy.zeros(len(slices), dtype=self.module.dtype())
+        for (f, values) in fields:
+            if values.dtype.kind in 'US':
+                #string fields are char arrays in the group's dtype; decoded
+                #strings are str under Python 3 but bytes under Python 2
+                length = self.records.dtype[f].shape[0]
+                if values.dtype.kind == 'U':
+                    values = numpy.char.encode(values, 'latin-1')
+                values = values.astype('S%d' % length)
+                values = values.view('S1').reshape(len(slices), length)
+            self.records[f] = values
+
+        #if the log covers the whole group, records can be set directly;
+        #otherwise current shm values of the other fields must be kept
+        all_fields = [f for (f, t) in self.module.group._fields_]
+        self.full = set(self.fields) == set(all_fields)
+        self.scratch = self.module.group()
+        self.scratch_view = self.module.view(self.scratch)
+
+    def write(self, k):
+        if self.full:
+            self.module.set(self.module.group.from_buffer(self.records, k * self.records.itemsize))
+        else:
+            self.module.snapshot_into(self.scratch)
+            for f in self.fields:
+                self.scratch_view[f][0] = self.records[f][k]
+            self.module.set(self.scratch)
+
+#Internal class: a decoded stretch of the log, from one file offset to another
+class _Window:
+    def __init__(self, parse, playable, start, stop):
+        self.times, columns = parse.parse_all_arrays(playable, start, stop)
+
+        #variables logged in the same block share one slices array
+        by_block = {}
+        for varstr, (slices, values) in columns.items():
+            group, name = varstr.split('.')
+            key = (group, id(slices))
+            by_block.setdefault(key, (slices, []))[1].append((name, values))
+        self.groups = [_PlaybackGroup(group, slices, fields)
+                       for ((group, i), (slices, fields)) in sorted(by_block.items())]
+
+        #every (group, occurrence) write, ordered by time slice
+        ev_slice = numpy.concatenate([g.slices for g in self.groups] + [numpy.zeros(0, dtype=numpy.int64)])
+        ev_group = numpy.concatenate([numpy.full(len(g.slices), i, dtype=numpy.int64)
+                                      for (i, g) in enumerate(self.groups)] + [numpy.zeros(0, dtype=numpy.int64)])
+        ev_occurrence = numpy.concatenate([numpy.arange(len(g.slices)) for g in self.groups] +
+                                          [numpy.zeros(0, dtype=numpy.int64)])
+        order = numpy.argsort(ev_slice, kind='mergesort')
+        self.ev_group = ev_group[order].tolist()
+        self.ev_occurrence = ev_occurrence[order].tolist()
+        self.ev_bounds = numpy.searchsorted(ev_slice[order], numpy.arange(len(self.times) + 1)).tolist()
+
+    #set every group to its most recent logged state before slice i
+    def restore(self, i):
+        for g in self.groups:
+            k = numpy.searchsorted(g.slices, i, side='right') - 1
+            if k >= 0:
+                g.write(k)
+
+    def play_slice(self, i):
+        groups = self.groups
+        ev_group = self.ev_group
+        ev_occurrence = self.ev_occurrence
+        for e in range(self.ev_bounds[i], self.ev_bounds[i + 1]):
+            groups[ev_group[e]].write(ev_occurrence[e])
+
+'''
+Plays a shared memory log back into shared memory.
+
+parse: LogParser of the log to play
+variables: optional list of variable strings (i.e. depth.depth) to play; defaults to all
+speed: playback speed factor (i.e. 2 is 2x as fast); 0 plays as fast as possible
+
+Variables that do not match local shared memory (see LogParser.get_warnings) are skipped.
+The log is decoded WINDOW_SECONDS at a time, so a log without a snapshot table
+(parsed with parse_file_end=False) is decoded whole.
+'''
+class LogPlayback:
+
+    def __init__(self, parse, variables=None, speed=1.0):
+        wanted = None if variables is None else set(variables)
+        self.parse = parse
+        self.playable = [s for (v, s, t) in parse.svars.values()
+                         if v is not None and (wanted is None or s in wanted)]
+
+        #windows start at the beginning of the log and then at snapshots
+        #WINDOW_SECONDS or more apart
+        self.window_starts = [parse.data_pos]
+        self.window_times = [_posix(parse.get_starttime())]
+        for (snap_time, snap_pos) in sorted(parse.snapshot_table, key=lambda s: s[1]):
+            t = _posix(snap_time)
+            if snap_pos > self.window_starts[-1] and t - self.window_times[-1] >= WINDOW_SECONDS:
+                self.window_starts.append(snap_pos)
+                self.window_times.append(t)
+
+        self.window_index = -1
+        self.window = None
+        self._load(0)
+
+        self.start_time = self.window_times[0]
+        self.end_time = max(_posix(parse.get_endtime()), self.start_time)
+
+        self.index = 0 #next slice to play in the current window
+        self.speed = speed
+
+        self.running = Event()
+        self.running.set()
+        self.lock = Lock()
+        self.pending_seek = None
+        self.pending_speed = None
+        self.stopped = False
+
+        #statistics
+        self.slices_played = 0
+        self.late_slices = 0
+        self.max_lag = 0.0
+        self.played_log_time = 0.0
+        self.played_wall_time = 0.0
+
+    #Internal method: decode window w, replacing the current one
+    def _load(self, w):
+        stop = self.window_starts[w + 1] if w + 1 < len(self.window_starts) else None
+        window = _Window(self.parse, self.playable, self.window_starts[w], stop)
+        #readers of current_time() may see the new index with the old window, never
+        #an old index past the end of the new window
+        self.index = 0
+        self.window = window
+        self.window_index = w
+
+    #Internal method: move on to the next window holding any slices;
+    #returns False at the end of the log
+    def _next_window(self):
+        while self.window_index + 1 < len(self.window_starts):
+            self._load(self.window_index + 1)
+            if len(self.window.times):
+                return True
+        return False
+
+    '''
+    Returns the log time (posix timestamp) of the last played slice.
+    '''
+    def current_time(self):
+        times = self.window.times
+        if not len(times):
+            return self.start_time
+        return times[min(max(self.index - 1, 0), len(times) - 1)]
+
+    def finished(self):
+        return self.stopped or (self.index >= len(self.window.times) and
+                                self.window_index + 1 >= len(self.window_starts))
+
+    '''
+    Requests a jump to log time t (posix timestamp); takes effect before the next slice.
+    '''
+    def seek(self, t):
+        with self.lock:
+            self.pending_seek = t
+
+    def seek_fraction(self, frac):
+        self.seek(self.start_time + frac * (self.end_time - self.start_time))
+
+    def seek_relative(self, dt):
+        self.seek(self.current_time() + dt)
+
+    '''
+    Changes the speed factor; takes effect before the next slice.
+    '''
+    def set_speed(self, speed):
+        with self.lock:
+            self.pending_speed = speed
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def stop(self):
+        self.stopped = True
+        self.running.set()
+
+    '''
+    Returns a dictionary describing playback so far: requested and achieved
+    speed, slices played, slices played after their deadline and the largest
+    lag behind a deadline in seconds.
+    '''
+    def stats(self):
+        achieved = self.played_log_time / self.played_wall_time if self.played_wall_time > 0 else 0.0
+        return {
+            "requested_speed": self.speed,
+            "achieved_speed": float(achieved),
+            "slices": self.slices_played,
+            "late_slices": self.late_slices,
+            "max_lag": float(self.max_lag),
+        }
+
+    #Internal method: decode the window holding log time t and restore every
+    #group's state at the first slice at or after t
+    def _seek(self, t):
+        w = max(int(numpy.searchsorted(self.window_times, t, side='right')) - 1, 0)
+        if w != self.window_index:
+            self._load(w)
+        times = self.window.times
+        self.index = min(int(numpy.searchsorted(times, t)), max(len(times) - 1, 0))
+        self.window.restore(self.index)
+
+    '''
+    Plays the log from the current position until it ends or stop() is called.
+    Blocks while paused.
+    '''
+    def run(self):
+        #the schedule is anchored at (wall0, log0) and re-anchored whenever
+        #playback is paused, seeks or changes speed. Log times are absolute, so
+        #the anchor carries over from one window to the next
+        wall0, log0 = monotonic(), None
+        self.segment_slices = 0
+
+        while not self.stopped:
+            if self.index >= len(self.window.times):
+                if not self._next_window():
+                    break
+
+            times = self.window.times
+            if log0 is None:
+                log0 = times[self.index]
+
+            if not self.running.is_set():
+                self._account(wall0, log0)
+                self.running.wait()
+                wall0, log0 = monotonic(), times[self.index]
+
+            with self.lock:
+                rebase = self.pending_speed is not None or self.pending_seek is not None
+                if rebase:
+                    self._account(wall0, log0)
+                if self.pending_speed is not None:
+                    self.speed = self.pending_speed
+                    self.pending_speed = None
+                if self.pending_seek is not None:
+                    self._seek(self.pending_seek)
+                    self.pending_seek = None
+
+            times = self.window.times
+            if rebase:
+                wall0, log0 = monotonic(), None
+            if not len(times):
+                continue
+            if log0 is None:
+                log0 = times[self.index]
+
+            if self.speed > 0:
+                deadline = wall0 + (times[self.index] - log0) / self.speed
+                now = monotonic()
+                if deadline > now:
+                    time.sleep(deadline - now)
+                else:
+                    lag = now - deadline
+                    if lag > 0.001:
+                        self.late_slices += 1
+                    self.max_lag = max(self.max_lag, lag)
+
+            self.window.play_slice(self.index)
+            self.last_played = times[self.index]
+            self.index += 1
+            self.slices_played += 1
+            self.segment_slices += 1
+
+        if log0 is not None:
+            self._account(wall0, log0)
+
+    #Internal method: add a finished stretch of playback, anchored at
+    #(wall0, log0), to the statistics
+    def _account(self, wall0, log0):
+        if self.segment_slices > 1:
+            self.played_log_time += self.last_played - log0
+            self.played_wall_time += monotonic() - wall0
+        self.segment_slices = 0
@@ -0,0 +1,71 @@
+import ctypes
+import unittest
+from unittest import mock
+
+import numpy
+
+from shm_tools.shmlog import playback
+
+# Stands in for a generated shm group module holding a string, like
+# battery_name or lcd_line_1
+class _group(ctypes.Structure):
+    _fields_ = [('name', ctypes.c_char * 8),
+                ('count', ctypes.c_int)]
+
+class _FakeGroupModule:
+    group = _group
+
+    def __init__(self):
+        self.current = _group()
+        self.written = []
+
+    def dtype(self):
+        return numpy.dtype(_group)
+
+    def view(self, g):
+        return numpy.frombuffer(g, dtype=self.dtype())
+
+    def snapshot_into(self, buf):
+        ctypes.memmove(ctypes.addressof(buf), ctypes.addressof(self.current), ctypes.sizeof(_group))
+        return buf
+
+    def set(self, g):
+        ctypes.memmove(ctypes.addressof(self.current), ctypes.addressof(g), ctypes.sizeof(_group))
+        self.written.append((self.current.name, self.current.count))
+
+class PlaybackStringGroupTest(unittest.TestCase):
+    def setUp(self):
+        self.module = _FakeGroupModule()
+        patcher = mock.patch.object(playback.shm, '_eval', return_value=self.module)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def play(self, fields):
+        g = playback._PlaybackGroup('battery', numpy.arange(3), fields)
+        for k in range(3):
+            g.write(k)
+        return self.module.written
+
+    # decoded strings are str under Python 3
+    def test_unicode_strings(self):
+        names = numpy.array(['a', 'volt', 'abcdefgh'], dtype=numpy.str_)
+        counts = numpy.array([1, 2, 3], dtype=numpy.int32)
+        self.assertEqual(self.play([('name', names), ('count', counts)]),
+                         [(b'a', 1), (b'volt', 2), (b'abcdefgh', 3)])
+
+    # and bytes under Python 2
+    def test_byte_strings(self):
+        names = numpy.array([b'a', b'volt', b'abcdefgh'], dtype=numpy.bytes_)
+        counts = numpy.array([1, 2, 3], dtype=numpy.int32)
+        self.assertEqual(self.play([('name', names), ('count', counts)]),
+                         [(b'a', 1), (b'volt', 2), (b'abcdefgh', 3)])
+
+    # only the string is logged, so the other fields keep their shm values
+    def test_partial_group(self):
+        self.module.current.count = 7
+        names = numpy.array([b'x', b'yy', b'zzz'], dtype=numpy.bytes_)
+        self.assertEqual(self.play([('name', names)]),
+                         [(b'x', 7), (b'yy', 7), (b'zzz', 7)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+from shm_tools.shmlog.columnar import convert
+import argparse
+import os
+import sys
+import libshm.parse
+
+'''
+Program to convert a shared memory log into a columnar log, which can be read
+with random access by shm_tools.shmlog.columnar.ColumnarLog.
+See log2columnar.py --help for details
+'''
+
+ap = argparse.ArgumentParser(description='Convert a shm log into a memory-mappable columnar log.')
+ap.add_argument('variables', type=str, nargs='*', help='list of variables to include (must match logfile strings, i.e. depth.depth) *OR* the filename of a filter config file containing the variables you wish to output; omit to include every variable')
+ap.add_argument('-o', dest='OUTPUT_DIRECTORY', type=str, help='output directory, conventionally ending in .shmcol (required)', required=True)
+ap.add_argument('-i', dest='INPUT_FILENAME', type=str, help='input shm log filename (required)', required=True)
+args = vars(ap.parse_args())
+
+if len(args['variables']) == 1 and os.path.isfile(args['variables'][0]):
+    #input was filename of a filter file; use this
+    des = []
+    gps = libshm.parse.parse(args['variables'][0])
+    for g in gps:
+        des += [g['groupname'] + "." + x for x in g['vars'].keys()]
+elif args['variables']:
+    des = args['variables']
+else:
+    des = None
+
+print("Converting %s to %s..." % (args['INPUT_FILENAME'], args['OUTPUT_DIRECTORY']))
+
+warnings = convert(args['INPUT_FILENAME'], args['OUTPUT_DIRECTORY'], des)
+if warnings:
+    print('\n'.join(warnings))
+
+print("Conversion complete.")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+from shm_tools.shmlog.parser import LogParser
+import argparse
+import os
+import random
+import struct
+import sys
+from time import time
+import libshm.parse
+
+'''
+Benchmark comparing the bulk log decoder (LogParser.parse_all_arrays) with
+slice by slice parsing (LogParser.parse_one_slice).
+
+Optionally generates a synthetic log first, using the variable table of the
+current vars.conf so that the log matches local shared memory.
+'''
+
+GROUP = 0xFFFF
+TIME = 0xFFFE
+END_STBL = 0xFFFFFFFFFFFFFFFF
+
+TYPE_INT = 2
+TYPE_DOUBLE = 3
+TYPE_STRING = 4
+
+ap = argparse.ArgumentParser(description='Benchmark bulk decoding of a log file.')
+ap.add_argument('filename', type=str, help='log file to benchmark (created if --generate is given)')
+ap.add_argument('--generate', dest='size_mb', type=float, default=0, help='first write a synthetic log of about this many MB')
+ap.add_argument('--vars', dest='vars_conf', type=str, default=os.path.join(os.path.dirname(__file__), '..', '..', '..', 'libshm', 'vars.conf'), help='vars.conf to take the variable table from')
+ap.add_argument('--groups-per-slice', dest='groups_per_slice', type=int, default=8, help='groups written per time slice in the synthetic log')
+ap.add_argument('--slices', dest='slices', type=int, default=0, help='only time parse_one_slice over this many slices and extrapolate (0 parses all)')
+args = vars(ap.parse_args())
+
+def pack_time(t):
+    return struct.pack("=II", int(t), int(round((t % 1) * 1e6)) % 1000000)
+
+def generate(filename, size, vars_conf, groups_per_slice):
+    groups = libshm.parse.parse(vars_conf)
+
+    #(first id, [(id, type, length)]) for every group, ids as assigned by the log daemon
+    table = []
+    header = []
+    x = 0
+    for g in groups:
+        block = []
+        for k in sorted(g['vars'].keys()):
+            typ = g['vars'][k]['type']
+            if typ == 'string':
+                code = TYPE_STRING
+            elif typ in ('double', 'float'):
+                code = TYPE_DOUBLE
+            else:
+                code = TYPE_INT
+            header.append(struct.pack("=Hb", x, code) + ("%s.%s" % (g['groupname'], k)).encode() + b"\x1e")
+            block.append((x, code))
+            x += 1
+        table.append(block)
+
+    rnd = random.Random(0)
+    def write_block(out, block):
+        for (x, code) in block:
+            if code == TYPE_DOUBLE:
+                out.write(struct.pack("=Hd", x, rnd.random()))
+            elif code == TYPE_INT:
+                out.write(struct.pack("=Hi", x, rnd.randint(0, 100)))
+            else:
+                s = b"synthetic"
+                out.write(struct.pack("=HL", x, len(s)) + s)
+
+    t = 1.5e9
+    snapshots = []
+    with open(filename, 'wb') as out:
+        out.write(b"AUVl" + b"Synthetic shm log for benchmarking\n")
+        out.write(b"".join(header))
+        out.write(struct.pack("=H", GROUP))
+
+        while out.tell() < size:
+            #snapshot every 5 seconds of log time, at 200 Hz
+            for i in range(1000):
+                if i == 0:
+                    snapshots.append((out.tell(), t))
+                    written = table
+                else:
+                    written = rnd.sample(table, min(groups_per_slice, len(table)))
+                out.write(struct.pack("=H", TIME) + pack_time(t))
+                for block in written:
+                    write_block(out, block)
+                t += 0.005
+
+        out.write(struct.pack("=H", GROUP))
+        out.write(struct.pack("=H", TIME) + pack_time(t))
+        out.write(struct.pack("=Q", END_STBL) + pack_time(0))
+        for (pos, st) in reversed(snapshots):
+            out.write(struct.pack("=Q", pos) + pack_time(st))
+
+if args['size_mb'] > 0:
+    print("Generating %.0f MB synthetic log %s..." % (args['size_mb'], args['filename']))
+    st = time()
+    generate(args['filename'], args['size_mb'] * 1024**2, args['vars_conf'], args['groups_per_slice'])
+    print("Generation took %.2f sec" % (time() - st))
+
+size = os.path.getsize(args['filename'])
+print("Log size: %.1f MB" % (size / 1024.0**2))
+
+parse = LogParser(args['filename'])
+st = time()
+times, columns = parse.parse_all_arrays()
+bulk = time() - st
+print("Bulk decode: %.2f sec for %d slices (%.1f MB/s)" % (bulk, len(times), size / 1024.0**2 / bulk))
+
+parse = LogParser(args['filename'])
+limit = args['slices'] or len(times)
+st = time()
+slices = 0
+while slices < limit and not parse.finished_parsing():
+    parse.parse_one_slice()
+    slices += 1
+sliced = time() - st
+if slices < len(times):
+    sliced *= float(len(times)) / slices
+    print("Slice parse: %.2f sec (extrapolated from %d slices)" % (sliced, slices))
+else:
+    print("Slice parse: %.2f sec" % sliced)
+
+print("Speedup: %.1fx" % (sliced / bulk))
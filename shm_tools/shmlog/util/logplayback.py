@@ -1,11 +1,12 @@
 #!/usr/bin/env python2
 from shm_tools.shmlog.parser import LogParser
-from datetime import datetime, timedelta
-from time import time, sleep
+from shm_tools.shmlog.playback import LogPlayback
+from datetime import datetime
+from time import sleep
 import sys
 import termios
 import argparse
-from threading import Thread, Event, Lock
+from threading import Thread
 import libshm.parse
 import shm
 
@@ -22,7 +23,7 @@ ap.add_argument('--filter', type=str, default="", help='filename of the config f
         containing variables to play back (filter config files take the same format   \
         as shared memory config files; simply copy vars.conf and remove all unwanted  \
         variables)')
-ap.add_argument('--speed', type=float, default=1.0, help='playback speed factor (i.e. 2 is 2x as fast)')
+ap.add_argument('--speed', type=float, default=1.0, help='playback speed factor (i.e. 2 is 2x as fast); 0 plays as fast as possible')
 ap.add_argument('--seek', type=float, default=0.0, help='percentage at which to start playback')
 ap.add_argument('-y', action="store_true", help='automatically accept any warnings')
 args = vars(ap.parse_args())
@@ -56,31 +57,23 @@ KEY_SPEED_DOWN = "-"
 KEY_SEEK_FORWARD = "."
 KEY_SEEK_REVERSE = ","
 
+#seconds of log time to jump per seek key press
+SEEK_STEP = 5.0
+
 log_start_time = parse.get_starttime()
 log_end_time = parse.get_endtime()
-local_start_time = datetime.now()
 
 speed = args['speed']
-cur_time = log_start_time
-interrupted = False
-running = Event()
-running.set()
-speed_lock = Lock()
-seek_reverse = False
-seek_forward = False
-
-def timediff(t1, t2):
-    z = (t2 - t1)
-    return z.seconds + z.microseconds/1e6
 
-seeking = (args['seek'] != 0)
-
-print "-- Starting playback of log at %sX speed --" % str(speed)
+if speed > 0:
+    print "-- Starting playback of log at %sX speed --" % str(speed)
+else:
+    print "-- Starting playback of log as fast as possible --"
 
-filtervars = []
-filtering = (args['filter'] != "")
+filtervars = None
 
-if filtering:
+if args['filter'] != "":
+    filtervars = []
     gps = libshm.parse.parse(args['filter'])
     for g in gps:
         filtervars += map(lambda x : g['groupname'] + "." + x, g['vars'].keys())
@@ -89,63 +82,15 @@ if filtering:
 
 print "Start:   %s\nEnd:     %s" % (str(log_start_time), str(log_end_time))
 
-if seeking:
-    tdta = timediff(log_start_time, log_end_time)
-    frac = tdta * args['seek'] / 100
-    seek_time = log_start_time + timedelta(0,frac)
-    parse.seek_nearest_snapshot(seek_time) #seek log to nearest snapshot
-    print "Seek to:", str(seek_time)
-
-def parse_all():
-    last_change_time = log_start_time
-    while not parse.finished_parsing() and not interrupted:
-        global cur_time, seeking, local_start_time, seek_reverse, seek_forward
-        if seek_reverse:
-            parse.seek_nearest_snapshot(changetime, prev=True)
-            seek_reverse = False
-            last_change_time = None
-
-        elif seek_forward:
-            parse.seek_nearest_snapshot(changetime, ahead=True)
-            seek_forward = False
-            last_change_time = None
-
-        parse_start_time = datetime.now()
-        changetime, changelist = parse.parse_one_slice()
-
-        with speed_lock:
-            current_speed = speed
-
-        if seeking:
-            if changetime > seek_time: #seek from snapshot point to desired time
-                #Stop seeking
-                seeking = False
-                dt = timediff(log_start_time, seek_time)
-                local_start_time = datetime.now() - \
-                                   timedelta(0, dt / current_speed)
-        else:
-            if last_change_time is not None:
-                available_time = timediff(last_change_time, changetime) /\
-                                 current_speed
-                used_time = timediff(parse_start_time, datetime.now())
-
-                if used_time < available_time:
-                    sleep(available_time - used_time)
-
-        cur_time = changetime
-        last_change_time = changetime
-
-        #Set all variables in this slice
-        for (svar, varstr, vtype, val) in changelist:
-            if svar is not None:
-                if filtering and varstr not in filtervars:
-                    continue
-                svar.set(val)
-
-        running.wait()
+print "Indexing log..."
+playback = LogPlayback(parse, filtervars, speed)
+
+if args['seek'] != 0:
+    playback.seek_fraction(args['seek'] / 100.0)
+    print "Seek to:", str(datetime.fromtimestamp(playback.pending_seek))
 
 #Start log playback thread
-t = Thread(target=parse_all)
+t = Thread(target=playback.run)
 t.start()
 
 PROGRESS_WIDTH = 31
@@ -159,42 +104,37 @@ def write_progress(percent, tme):
         sys.stdout.write("\nNote: %s\n" % note)
         write_progress.last_note = note
 
-    if seeking:
-        sys.stdout.write("\rSeeking... %d%%" %  percent)
-    else:
-        sys.stdout.write("\r%s   %s %d%%" % \
-                         ("Current: " + str(tme), pstr, percent))
+    sys.stdout.write("\r%s   %s %d%%" % \
+                     ("Current: " + str(tme), pstr, percent))
 
     sys.stdout.flush()
 
 def process_input():
+    global speed
     while 1:
         key = sys.stdin.read(1)
         if key == KEY_PAUSE:
-            if running.is_set():
-                running.clear()
+            if playback.running.is_set():
+                playback.pause()
 
             else:
-                running.set()
+                playback.resume()
 
-        elif key in [KEY_SPEED_UP, KEY_SPEED_DOWN]:
-            with speed_lock:
-                global speed
-                if key == KEY_SPEED_UP and speed < 8.0:
-                    speed *= 2.0
+        elif key in [KEY_SPEED_UP, KEY_SPEED_DOWN] and speed > 0:
+            if key == KEY_SPEED_UP and speed < 8.0:
+                speed *= 2.0
 
-                elif key == KEY_SPEED_DOWN and speed > 0.01:
-                    speed /= 2.0
+            elif key == KEY_SPEED_DOWN and speed > 0.01:
+                speed /= 2.0
 
+            playback.set_speed(speed)
             print "\nSpeed is now %f." % speed
 
         elif key == KEY_SEEK_REVERSE:
-            global seek_reverse
-            seek_reverse = True
+            playback.seek_relative(-SEEK_STEP)
 
         elif key == KEY_SEEK_FORWARD:
-            global seek_forward
-            seek_forward = True
+            playback.seek_relative(SEEK_STEP)
 
 write_progress.last_note = shm.notes.note.get()
 
@@ -204,25 +144,27 @@ new_options = old_options[:]
 new_options[3] &= ~(termios.ECHO | termios.ICANON)
 termios.tcsetattr(sys.stdin, termios.TCSANOW, new_options)
 
+interrupted = False
+
 try:
     #Status indication
-    total_time_diff = timediff(log_start_time, log_end_time)
+    total_time_diff = playback.end_time - playback.start_time
 
     input_thread = Thread(target=process_input)
     input_thread.daemon = True
     input_thread.start()
 
-    while not parse.finished_parsing():
-        current_diff = timediff(log_start_time, cur_time)
-        percent = int(round(100.0 * current_diff / total_time_diff))
-        write_progress(percent, cur_time)
+    while not playback.finished():
+        cur_time = playback.current_time()
+        percent = int(round(100.0 * (cur_time - playback.start_time) / total_time_diff))
+        write_progress(percent, datetime.fromtimestamp(cur_time))
 
         sleep(0.1)
 
 except KeyboardInterrupt:
     interrupted = True
-    # Unblock parsing thread
-    running.set()
+    # Unblock playback thread
+    playback.stop()
 
 finally:
     # Reset terminal input options to originals no matter what
@@ -235,3 +177,9 @@ else:
     print "\nLog playback complete."
 
 t.join()
+
+stats = playback.stats()
+requested = "%sX" % stats["requested_speed"] if stats["requested_speed"] > 0 else "max"
+print "Played %d slices at %.2fX (requested %s); %d late, max lag %.1f ms" % (
+    stats["slices"], stats["achieved_speed"], requested,
+    stats["late_slices"], stats["max_lag"] * 1e3)
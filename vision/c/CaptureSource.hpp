@@ -13,6 +13,7 @@
 class CaptureSource {
 private:
   int m_max_fps;
+  uint32_t m_slots;
   message_framework_p m_framework;
   volatile bool running;
 
@@ -28,8 +29,9 @@ protected:
     return std::chrono::duration_cast<std::chrono::milliseconds>(std::chrono::system_clock::now().time_since_epoch()).count();
   }
 
-  CaptureSource(int max_fps, std::string direction)
+  CaptureSource(int max_fps, std::string direction, uint32_t slots = DEFAULT_SLOT_COUNT)
     : m_max_fps(max_fps),
+      m_slots(slots),
       m_framework(NULL),
       running(true),
       m_direction(direction)
@@ -49,7 +51,7 @@ public:
 
     cv::Size output_size = get_output_size();
     size_t full_image_dimensions = output_size.width * output_size.height * 3;
-    m_framework = create_message_framework(m_direction, full_image_dimensions);
+    m_framework = create_message_framework(m_direction, full_image_dimensions, m_slots);
 
     if (m_framework == NULL) {
       std::cout << "Could not initialize message framework" << std::endl;
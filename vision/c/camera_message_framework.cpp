@@ -11,33 +11,37 @@
 #include <sys/types.h>
 #include <string.h>
 #include <signal.h>
+#include <limits.h>
+#include <linux/futex.h>
+#include <sys/syscall.h>
 #include <stdlib.h>
 #include <iostream>
 #include <stdint.h>
 #include <semaphore.h>
-#include <sys/time.h>
 
 #include "misc/utils.h"
 
 #define FILE_ADDRESS_BASE "/dev/shm/auv_visiond-"
-#define BUFFER_COUNT 3
 
+// The framework is a ring of slot_count image slots. Frame n (numbered from 1)
+// goes into slot n % slot_count. Every slot is guarded by a sequence counter
+// that is odd while the slot is being written; readers copy a slot and then
+// check that the counter did not change, so the writer never waits for them.
 struct image_metadata {
   size_t width;
   size_t height;
   size_t depth;
   uint64_t acquisition_time;
-  pthread_rwlock_t rwlock;
+  uint32_t frame;    // number of the frame held in this slot
+  uint32_t sequence;
 };
 
 struct message_framework_internal {
-  uint32_t frame;
-  pthread_cond_t cond;
-  pthread_mutex_t cond_mutex;
-  struct image_metadata metadata[BUFFER_COUNT];
+  uint32_t frame;    // number of the most recently written frame
+  uint32_t slot_count;
   size_t image_buffer_size;
   pid_t owner;
-  unsigned char images[]; // this _must_ be last
+  struct image_metadata metadata[]; // slot_count entries, followed by the images
 } typedef message_framework_internal;
 
 struct message_framework {
@@ -46,8 +50,40 @@ struct message_framework {
   message_framework_internal *framework;
 };
 
-size_t calculate_map_size(size_t max_image_size) {
-  return sizeof(message_framework_internal) + max_image_size*BUFFER_COUNT;
+static size_t images_offset(uint32_t slot_count) {
+  size_t offset = sizeof(message_framework_internal) + slot_count*sizeof(struct image_metadata);
+  return (offset + 63) & ~(size_t) 63;
+}
+
+size_t calculate_map_size(size_t max_image_size, uint32_t slot_count) {
+  return images_offset(slot_count) + max_image_size*slot_count;
+}
+
+static unsigned char* slot_image(message_framework_internal *framework, uint32_t slot) {
+  return (unsigned char*) framework + images_offset(framework->slot_count)
+    + framework->image_buffer_size*slot;
+}
+
+static uint32_t latest_frame(message_framework_internal *framework) {
+  return __atomic_load_n(&framework->frame, __ATOMIC_ACQUIRE);
+}
+
+// Readers sleep on the frame counter itself with a futex. Unlike a process
+// shared condition variable, a futex is left in a usable state when a process
+// exits while waiting on it (as module processes do when they are stopped), so
+// a reused framework never blocks its next writer.
+static void wait_on_frame(message_framework_internal *framework, uint32_t frame,
+                          const struct timespec *timeout) {
+  syscall(SYS_futex, &framework->frame, FUTEX_WAIT, frame, timeout, NULL, 0);
+}
+
+static void wake_frame_waiters(message_framework_internal *framework) {
+  syscall(SYS_futex, &framework->frame, FUTEX_WAKE, INT_MAX, NULL, NULL, 0);
+}
+
+// frame numbers wrap around, so compare them through their difference
+static bool frame_before(uint32_t a, uint32_t b) {
+  return (int32_t) (a - b) < 0;
 }
 
 bool write_frame(message_framework_p framework_w, unsigned char* data,
@@ -59,83 +95,172 @@ bool write_frame(message_framework_p framework_w, unsigned char* data,
 
   message_framework_internal *framework = framework_w->framework;
 
-  uint32_t buffer_to_write_to = (framework->frame + 1) % BUFFER_COUNT;
-  struct image_metadata *metadata = &framework->metadata[buffer_to_write_to];
+  uint32_t next_frame = framework->frame + 1;
+  uint32_t slot = next_frame % framework->slot_count;
+  struct image_metadata *metadata = &framework->metadata[slot];
+
+  // mark the slot as being written. The counter is forced odd, so that a
+  // writer that died halfway through cannot flip its meaning
+  uint32_t sequence = metadata->sequence | 1;
+  __atomic_store_n(&metadata->sequence, sequence, __ATOMIC_RELAXED);
+  __atomic_thread_fence(__ATOMIC_RELEASE);
 
-  // grab the write lock
-  pthread_rwlock_wrlock(&metadata->rwlock);
   // write the image and corresponding metadata
-  memcpy(&framework->images[framework->image_buffer_size*buffer_to_write_to], data,
-         width * height * depth);
+  memcpy(slot_image(framework, slot), data, width * height * depth);
   metadata->width = width;
   metadata->height = height;
   metadata->depth = depth;
   metadata->acquisition_time = acquisition_time;
-  // release the write lock
-  pthread_rwlock_unlock(&metadata->rwlock);
+  metadata->frame = next_frame;
+
+  __atomic_store_n(&metadata->sequence, sequence + 1, __ATOMIC_RELEASE);
 
-  framework->frame++;
-  // notify all watchers that a new image has been posted
-  pthread_cond_broadcast(&framework->cond);
+  // publish the frame and notify all watchers that a new image has been posted
+  __atomic_store_n(&framework->frame, next_frame, __ATOMIC_RELEASE);
+  wake_frame_waiters(framework);
 
   return true;
 }
 
-bool read_frame(struct frame* frame, message_framework_p framework_w) {
+// Copies frame number wanted out of its slot, or if lease is not NULL only
+// its metadata, lending out the slot itself. Returns false if the slot does
+// not hold that frame (anymore) or was overwritten while being read.
+static bool read_slot(struct frame* frame, message_framework_internal *framework,
+                      uint32_t wanted, struct frame_lease* lease) {
+  uint32_t slot = wanted % framework->slot_count;
+  struct image_metadata *metadata = &framework->metadata[slot];
+
+  uint32_t sequence = __atomic_load_n(&metadata->sequence, __ATOMIC_ACQUIRE);
+  if (sequence & 1 || metadata->frame != wanted) {
+    return false;
+  }
+
+  size_t width = metadata->width;
+  size_t height = metadata->height;
+  size_t depth = metadata->depth;
+  uint64_t acq_time = metadata->acquisition_time;
+  if (width * height * depth > framework->image_buffer_size) {
+    return false;
+  }
+  if (lease == NULL) {
+    memcpy(frame->data, slot_image(framework, slot), width * height * depth);
+  }
+
+  __atomic_thread_fence(__ATOMIC_ACQUIRE);
+  if (__atomic_load_n(&metadata->sequence, __ATOMIC_RELAXED) != sequence) {
+    return false;
+  }
+
+  frame->width = width;
+  frame->height = height;
+  frame->depth = depth;
+  frame->acq_time = acq_time;
+  if (lease != NULL) {
+    lease->data = slot_image(framework, slot);
+    lease->frame = wanted;
+    lease->slot = slot;
+    lease->sequence = sequence;
+  }
+  return true;
+}
+
+// Blocks until a frame newer than frame->last_frame has been written.
+static bool wait_for_frame(struct frame* frame, message_framework_p framework_w) {
   if (!framework_w->live) {
     return false;
   }
 
   message_framework_internal *framework = framework_w->framework;
-  frame->data = (unsigned char*) realloc(frame->data, framework->image_buffer_size);
-  pthread_mutex_t *mutex = &framework->cond_mutex;
-  pthread_cond_t *cond = &framework->cond;
-
-  pthread_mutex_lock(mutex);
-  struct timespec timeToWait;
-  struct timeval now;
-  while (framework->frame == frame->last_frame) {
-    // wait 100ms at most for each wait. this lets us avoid any esoteric
-    // timing/thread related bugs at a small cost. if we prove all of our
-    // synchronization code here to be correct, this won't be necessary.
-    // until then, it's best to keep this in
-    gettimeofday(&now,NULL);
-    timeToWait.tv_sec = now.tv_sec;
-    timeToWait.tv_nsec = (now.tv_usec+1000UL*100)*1000UL;
-    if (timeToWait.tv_nsec >= 1000000000L) {
-      timeToWait.tv_sec += 1;
-      timeToWait.tv_nsec -= 1000000000L;
-    }
 
-    pthread_cond_timedwait(cond, mutex, &timeToWait);
+  // wait 100ms at most for each wait. this lets us avoid any esoteric
+  // timing/thread related bugs at a small cost. if we prove all of our
+  // synchronization code here to be correct, this won't be necessary.
+  // until then, it's best to keep this in
+  const struct timespec timeToWait = {0, 100 * 1000 * 1000};
+  while (latest_frame(framework) == frame->last_frame) {
+    wait_on_frame(framework, frame->last_frame, &timeToWait);
 
     // if we should no longer be running, cleanly exit
     if (!framework_w->live) {
-      pthread_mutex_unlock(mutex);
       return false;
     }
   }
+  return true;
+}
+
+// Moves the reader's cursor to frame read, counting any frames skipped over.
+// A cursor of 0 means nothing has been read yet, so nothing was skipped.
+static void advance_cursor(struct frame* frame, uint32_t read) {
+  if (frame->last_frame != 0 && frame_before(frame->last_frame, read)) {
+    frame->dropped += read - frame->last_frame - 1;
+  }
+  frame->last_frame = read;
+}
 
-  pthread_mutex_unlock(&framework->cond_mutex);
+// Chooses the frame to read next: the newest one, or with every_frame the one
+// after the reader's cursor, or the oldest one still in the ring if the reader
+// fell too far behind.
+static uint32_t frame_to_read(struct frame* frame, message_framework_internal *framework,
+                              bool every_frame) {
+  uint32_t latest = latest_frame(framework);
+  if (!every_frame || frame->last_frame == 0) {
+    return latest;
+  }
 
-  // read from the newly written frame
-  uint32_t buffer_to_read_from = framework->frame % BUFFER_COUNT;
-  struct image_metadata *metadata = &framework->metadata[buffer_to_read_from];
-  pthread_rwlock_rdlock(&metadata->rwlock);
-  frame->last_frame = framework->frame;
-  frame->acq_time = metadata->acquisition_time;
-  size_t width = metadata->width;
-  size_t height = metadata->height;
-  size_t depth = metadata->depth;
-  frame->width = width;
-  frame->height = height;
-  frame->depth = depth;
+  uint32_t wanted = frame->last_frame + 1;
+  // the slot after the newest frame may already be in the middle of being
+  // overwritten, so the oldest frame still safely in the ring is one later
+  uint32_t oldest = latest - framework->slot_count + 2;
+  if (frame_before(wanted, oldest)) {
+    wanted = oldest;
+  } else if (frame_before(latest, wanted)) {
+    // the writer started over with a new ring; follow it from its newest frame
+    wanted = latest;
+    frame->last_frame = 0;
+  }
+  return wanted;
+}
 
-  memcpy(frame->data, &framework->images[framework->image_buffer_size*buffer_to_read_from], width * height * depth);
-  pthread_rwlock_unlock(&metadata->rwlock);
+static bool read_from_ring(struct frame* frame, message_framework_p framework_w,
+                           bool every_frame, struct frame_lease* lease) {
+  if (!wait_for_frame(frame, framework_w)) {
+    return false;
+  }
+
+  message_framework_internal *framework = framework_w->framework;
+  if (lease == NULL) {
+    frame->data = (unsigned char*) realloc(frame->data, framework->image_buffer_size);
+  }
+
+  // if the frame is overwritten before we get to it, look again
+  uint32_t wanted;
+  do {
+    wanted = frame_to_read(frame, framework, every_frame);
+  } while (!read_slot(frame, framework, wanted, lease));
+
+  advance_cursor(frame, wanted);
   return true;
 }
 
+bool read_frame(struct frame* frame, message_framework_p framework_w) {
+  return read_from_ring(frame, framework_w, false, NULL);
+}
+
+bool read_next_frame(struct frame* frame, message_framework_p framework_w) {
+  return read_from_ring(frame, framework_w, true, NULL);
+}
+
+bool borrow_frame(struct frame* frame, struct frame_lease* lease,
+                  message_framework_p framework_w, bool every_frame) {
+  return read_from_ring(frame, framework_w, every_frame, lease);
+}
+
+bool lease_valid(struct frame_lease* lease, message_framework_p framework_w) {
+  struct image_metadata *metadata = &framework_w->framework->metadata[lease->slot];
+  __atomic_thread_fence(__ATOMIC_ACQUIRE);
+  return __atomic_load_n(&metadata->sequence, __ATOMIC_RELAXED) == lease->sequence;
+}
+
 message_framework_p initialize_message_framework(message_framework_internal *framework) {
   message_framework_p framework_w = new message_framework;
   framework_w->framework = framework;
@@ -149,8 +274,19 @@ message_framework_p create_message_framework_from_cstring(const char *direction,
   return create_message_framework(std::string(direction), max_image_size);
 }
 
+message_framework_p create_message_framework_with_slots_from_cstring(const char *direction,
+                                                                    size_t max_image_size,
+                                                                    uint32_t slot_count) {
+  return create_message_framework(std::string(direction), max_image_size, slot_count);
+}
+
 message_framework_p create_message_framework(std::string direction,
-                                            size_t max_image_size) {
+                                            size_t max_image_size,
+                                            uint32_t slot_count) {
+  if (slot_count < 2) {
+    slot_count = 2;
+  }
+
   std::string file_address_s;
   file_address_s = FILE_ADDRESS_BASE + direction;
   char* file_address = (char*) file_address_s.c_str();
@@ -168,11 +304,26 @@ message_framework_p create_message_framework(std::string direction,
       // it will not actually kill the previous owner, since the signal is 0
       bool owned = !kill(prev_owner, 0);
 
-      bool legal_size = extant_framework->framework->image_buffer_size == max_image_size;
+      bool legal_size = extant_framework->framework->image_buffer_size == max_image_size &&
+                        extant_framework->framework->slot_count == slot_count;
       if (!owned && legal_size) {
         // reuse the old framework, so that nothing has to be recreated or relinked
         // TODO: this is a race condition (what if two message frameworks are created simultaneously)
-        extant_framework->framework->owner = getpid();
+        message_framework_internal *framework = extant_framework->framework;
+        framework->owner = getpid();
+
+        // the previous owner may have died in the middle of writing a slot.
+        // Make every sequence counter even again; a slot left mid-write holds
+        // a torn image, so it no longer holds any frame. The other slots and
+        // the latest frame number are kept, so readers carry on.
+        for (uint32_t i = 0; i < framework->slot_count; i++) {
+          struct image_metadata *metadata = &framework->metadata[i];
+          uint32_t sequence = __atomic_load_n(&metadata->sequence, __ATOMIC_RELAXED);
+          if (sequence & 1) {
+            metadata->frame = 0;
+            __atomic_store_n(&metadata->sequence, sequence + 1, __ATOMIC_RELEASE);
+          }
+        }
         return extant_framework;
       } else if (in_use_by_any) {
         std::cout << "Could not create buffer " << direction << " for writing: ";
@@ -203,7 +354,7 @@ message_framework_p create_message_framework(std::string direction,
     std::cout << "Failed to open " << file_address << ": " << errno << std::endl;
     return NULL;
   }
-  size_t desired_size = calculate_map_size(max_image_size);
+  size_t desired_size = calculate_map_size(max_image_size, slot_count);
 
   if (ftruncate(framework_file, desired_size) == -1) {
     std::cout << "Failed to truncate the file to the desired length: "
@@ -218,24 +369,12 @@ message_framework_p create_message_framework(std::string direction,
 
   framework->image_buffer_size = max_image_size;
   framework->frame = 0;
+  framework->slot_count = slot_count;
   framework->owner = getpid();
-
-  pthread_condattr_t attrcond;
-  pthread_condattr_init(&attrcond);
-  pthread_condattr_setpshared(&attrcond, PTHREAD_PROCESS_SHARED);
-  pthread_cond_init(&framework->cond, &attrcond);
-
-  pthread_mutexattr_t attrmutex;
-  pthread_mutexattr_init(&attrmutex);
-  pthread_mutexattr_setpshared(&attrmutex, PTHREAD_PROCESS_SHARED);
-  pthread_mutex_init(&framework->cond_mutex, &attrmutex);
-
-  pthread_rwlockattr_t attrrwlock;
-  pthread_rwlockattr_init(&attrrwlock);
-  pthread_rwlockattr_setpshared(&attrrwlock, PTHREAD_PROCESS_SHARED);
-
-  for (int i = 0; i < BUFFER_COUNT; i++)
-    pthread_rwlock_init(&framework->metadata[i].rwlock, &attrrwlock);
+  for (uint32_t i = 0; i < slot_count; i++) {
+    framework->metadata[i].frame = 0;
+    framework->metadata[i].sequence = 0;
+  }
 
   return initialize_message_framework(framework);
 }
@@ -270,9 +409,21 @@ size_t get_buffer_size(message_framework_p framework_w) {
   return framework_w->framework->image_buffer_size;
 }
 
+uint32_t get_slot_count(message_framework_p framework_w) {
+  return framework_w->framework->slot_count;
+}
+
+uint32_t get_frame_count(message_framework_p framework_w) {
+  return latest_frame(framework_w->framework);
+}
+
+pid_t get_owner(message_framework_p framework_w) {
+  return framework_w->framework->owner;
+}
+
 void kill_message_framework(message_framework_p framework_w) {
   framework_w->live = false;
-  pthread_cond_broadcast(&framework_w->framework->cond);
+  wake_frame_waiters(framework_w->framework);
 }
 
 void cleanup_message_framework(message_framework_p framework_w) {
@@ -280,7 +431,7 @@ void cleanup_message_framework(message_framework_p framework_w) {
   framework_w->num_accessors--;
 
   if (framework_w->num_accessors == 0) {
-    munmap(framework, calculate_map_size(framework->image_buffer_size));
+    munmap(framework, calculate_map_size(framework->image_buffer_size, framework->slot_count));
     delete framework_w;
   }
 }
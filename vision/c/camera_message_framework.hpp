@@ -1,17 +1,24 @@
 #pragma once
 
 #define FRAMEWORK_NAME_MAX 255
+#define DEFAULT_SLOT_COUNT 3
 
 #include <cstddef>
 #include <string>
 #include <memory>
 #include <stdint.h>
+#include <sys/types.h>
 
 
 extern "C" {
   typedef struct message_framework message_framework;
   typedef message_framework* message_framework_p;
 
+  /**
+   * A reader's view of a message framework. Zero-initialize before the first
+   * read; last_frame is the reader's cursor into the ring of frames and
+   * dropped counts the frames it skipped over or lost to the writer.
+   */
   struct frame {
     unsigned char* data;
     uint32_t last_frame;
@@ -19,6 +26,18 @@ extern "C" {
     size_t height;
     size_t depth;
     uint64_t acq_time;
+    uint32_t dropped;
+  };
+
+  /**
+   * A frame lent out by borrow_frame: data points straight into the shared
+   * memory slot holding frame number frame.
+   */
+  struct frame_lease {
+    unsigned char* data;
+    uint32_t frame;
+    uint32_t slot;
+    uint32_t sequence;
   };
 
   /**
@@ -26,18 +45,51 @@ extern "C" {
    * Returns: NULL if the message framework could not be created (i.e. if the
    *  name was already in use, or if there was some other failure), or a pointer
    *  to the message framework.
+   * The framework keeps the last slot_count - 1 frames (at least 2 slots are
+   *  used), so readers that fall behind can still get every frame.
    */
   message_framework_p create_message_framework(std::string direction,
-                                               size_t max_size);
+                                               size_t max_size,
+                                               uint32_t slot_count = DEFAULT_SLOT_COUNT);
   message_framework_p create_message_framework_from_cstring(const char* direction,
                                                             size_t max_size);
+  message_framework_p create_message_framework_with_slots_from_cstring(const char* direction,
+                                                                      size_t max_size,
+                                                                      uint32_t slot_count);
   message_framework_p access_message_framework(std::string direction);
   message_framework_p access_message_framework_from_cstring(const char* direction);
   bool write_frame(message_framework_p framework, unsigned char* data,
                    unsigned long acquisition_time_in_ms, size_t width,
                    size_t height, size_t depth);
+  /**
+   * Reads the newest frame, blocking until one newer than frame->last_frame
+   *  has been written.
+   */
   bool read_frame(struct frame* frame, message_framework_p framework);
+  /**
+   * Reads the frame after frame->last_frame, or the oldest one still in the
+   *  ring if the reader fell too far behind.
+   */
+  bool read_next_frame(struct frame* frame, message_framework_p framework);
+  /**
+   * Like read_frame (or read_next_frame if every_frame), but instead of copying
+   *  the image into frame->data, points lease->data at it in shared memory.
+   *  The writer does not wait for borrowers: once the reader is done with the
+   *  image it must check lease_valid, which is false if the slot has since
+   *  been overwritten and the image may have been torn.
+   */
+  bool borrow_frame(struct frame* frame, struct frame_lease* lease,
+                    message_framework_p framework, bool every_frame);
+  bool lease_valid(struct frame_lease* lease, message_framework_p framework);
   void kill_message_framework(message_framework_p framework);
   void cleanup_message_framework(message_framework_p framework);
   size_t get_buffer_size(message_framework_p framework);
+  uint32_t get_slot_count(message_framework_p framework);
+  uint32_t get_frame_count(message_framework_p framework);
+  /**
+   * The process that created the framework, or took it over last. Framework
+   *  files are not removed when their writer exits, so this process may be
+   *  gone.
+   */
+  pid_t get_owner(message_framework_p framework);
 }
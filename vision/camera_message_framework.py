@@ -1,4 +1,5 @@
-from ctypes import POINTER, c_ubyte, c_uint32, c_uint64, c_char_p, c_voidp, c_ssize_t, c_bool, addressof, Structure, create_string_buffer
+from ctypes import POINTER, c_int, c_ubyte, c_uint32, c_uint64, c_char_p, c_voidp, c_ssize_t, c_bool, addressof, Structure, create_string_buffer
+import os
 import signal
 import time
 import sys
@@ -18,13 +19,23 @@ class _Frame(Structure):
                 ('width', c_ssize_t),
                 ('height', c_ssize_t),
                 ('depth', c_ssize_t),
-                ('acq_time', c_uint64)]
+                ('acq_time', c_uint64),
+                ('dropped', c_uint32)]
+
+class _Lease(Structure):
+    _fields_ = [('data', POINTER(c_ubyte)),
+                ('frame', c_uint32),
+                ('slot', c_uint32),
+                ('sequence', c_uint32)]
 
 _lib_nothread = load_library('libauv-camera-message-framework.so')
 
 _lib_nothread.create_message_framework_from_cstring.argtypes = (c_char_p, c_ssize_t)
 _lib_nothread.create_message_framework_from_cstring.restype = c_voidp
 
+_lib_nothread.create_message_framework_with_slots_from_cstring.argtypes = (c_char_p, c_ssize_t, c_uint32)
+_lib_nothread.create_message_framework_with_slots_from_cstring.restype = c_voidp
+
 _lib_nothread.access_message_framework_from_cstring.argtypes = (c_char_p,)
 _lib_nothread.access_message_framework_from_cstring.restype = c_voidp
 
@@ -37,6 +48,15 @@ _lib_nothread.kill_message_framework.restype = None
 _lib_nothread.read_frame.argtypes = (c_voidp, c_voidp)
 _lib_nothread.read_frame.restype = c_bool
 
+_lib_nothread.read_next_frame.argtypes = (c_voidp, c_voidp)
+_lib_nothread.read_next_frame.restype = c_bool
+
+_lib_nothread.borrow_frame.argtypes = (c_voidp, c_voidp, c_voidp, c_bool)
+_lib_nothread.borrow_frame.restype = c_bool
+
+_lib_nothread.lease_valid.argtypes = (c_voidp, c_voidp)
+_lib_nothread.lease_valid.restype = c_bool
+
 _lib_nothread.write_frame.argtypes = (c_voidp, c_voidp, c_uint64,
                                       c_ssize_t, c_ssize_t, c_ssize_t)
 _lib_nothread.write_frame.restype = c_bool
@@ -44,6 +64,24 @@ _lib_nothread.write_frame.restype = c_bool
 _lib_nothread.get_buffer_size.argtypes = (c_voidp,)
 _lib_nothread.get_buffer_size.restype = c_ssize_t
 
+_lib_nothread.get_slot_count.argtypes = (c_voidp,)
+_lib_nothread.get_slot_count.restype = c_uint32
+
+_lib_nothread.get_frame_count.argtypes = (c_voidp,)
+_lib_nothread.get_frame_count.restype = c_uint32
+
+_lib_nothread.get_owner.argtypes = (c_voidp,)
+_lib_nothread.get_owner.restype = c_int
+
+# number of frames kept by a framework unless its creator asks for more; a
+# framework with n slots holds the last n - 1 frames
+DEFAULT_SLOTS = 3
+
+# read policies: get_next_frame returns the newest frame, or every frame in
+# order for as long as the reader keeps up with the ring
+LATEST = 'latest'
+EVERY_FRAME = 'every_frame'
+
 running = True
 
 # if we're currently running in an eventlet context (i.e. from the GUI)
@@ -62,20 +100,55 @@ class ExistentialError(Exception):
 class StateError(Exception):
     pass
 
+# raised when a borrowed frame was overwritten by the writer while in use
+class LeaseExpired(Exception):
+    pass
+
+# A frame read without copying it out of shared memory. {image} is a read-only
+# view of the slot holding the frame; the writer does not wait for borrowers,
+# so once done with the image (or anything computed from it) check valid().
+# If the writer lapped the reader in the meantime, the image may be torn and
+# should be discarded. The view is only usable until the accessor is cleaned up.
+class BorrowedFrame:
+    def __init__(self, accessor, lease, image, acq_time):
+        self._accessor = accessor
+        self._lease = lease
+        self.image = image
+        self.acq_time = acq_time
+        self.frame = lease.frame
+
+    def valid(self):
+        return _lib_nothread.lease_valid(addressof(self._lease), self._accessor._framework)
+
+    # copy the image out of shared memory; raises LeaseExpired if it was
+    # overwritten while being copied
+    def copy(self):
+        image = self.image.copy()
+        if not self.valid():
+            raise LeaseExpired()
+        return image
+
 # Structure that represents an accessor to a shared memory block. Creating an
 # accessor will block until the shared memory block with the specified name is
-# created
+# created, or raise an ExistentialError if it was not created within {timeout}
+# seconds when a timeout is given
 # An accessor has all of the same priviledges as a creator in terms of reading
 # and writing frame
+# {policy} is LATEST or EVERY_FRAME; every accessor has its own position in the
+# ring of frames, and counts the frames it missed in {dropped}
 class Accessor:
-    def __init__(self, name):
+    def __init__(self, name, policy=LATEST, timeout=None):
         self.name = name
+        self.policy = policy
         self._framework = None
+        deadline = None if timeout is None else time.time() + timeout
         # loop until the framework actually exists
         while running:
             self._framework = _lib.access_message_framework_from_cstring(name.encode('utf8'))
             if self._framework:
                 break
+            if deadline is not None and time.time() >= deadline:
+                raise ExistentialError('{} was not created within {} s'.format(name, timeout))
             time.sleep(0.1)
         self._setup_accessor()
 
@@ -85,14 +158,38 @@ class Accessor:
         self._frame = _Frame()
         self._last_frame = None
         self.buffer_size = _lib.get_buffer_size(self._framework)
+        self.slots = _lib.get_slot_count(self._framework)
+        self._read = _lib.read_next_frame if self.policy == EVERY_FRAME else _lib.read_frame
         self.alive = True
 
+    # number of frames this accessor skipped (LATEST) or lost because it fell
+    # more than a full ring behind the writer (EVERY_FRAME)
+    @property
+    def dropped(self):
+        return self._frame.dropped
+
+    # number of frames written to the framework so far
+    def frame_count(self):
+        return _lib.get_frame_count(self._framework)
+
+    # whether the process writing to the framework is still running. Framework
+    # files are left behind when their writer exits, so an accessor can open
+    # one that nothing will write to again
+    def writer_alive(self):
+        try:
+            os.kill(_lib.get_owner(self._framework), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
     def get_next_frame(self):
         if not self.alive:
             raise StateError('Accessor has already been cleaned up!')
 
         frame = self._frame
-        is_live = _lib.read_frame(addressof(frame), self._framework)
+        is_live = self._read(addressof(frame), self._framework)
         if not is_live:
             self.cleanup()
             raise StateError('Accessor has already been cleaned up!')
@@ -101,6 +198,24 @@ class Accessor:
         self._last_frame = res
         return res
 
+    # like get_next_frame, but returns a BorrowedFrame viewing the image in
+    # shared memory instead of copying it
+    def borrow_next_frame(self):
+        if not self.alive:
+            raise StateError('Accessor has already been cleaned up!')
+
+        frame = self._frame
+        lease = _Lease()
+        is_live = _lib.borrow_frame(addressof(frame), addressof(lease), self._framework,
+                                    self.policy == EVERY_FRAME)
+        if not is_live:
+            self.cleanup()
+            raise StateError('Accessor has already been cleaned up!')
+        shape = frame.height, frame.width, frame.depth
+        image = np.ctypeslib.as_array(lease.data, shape)
+        image.flags.writeable = False
+        return BorrowedFrame(self, lease, image, frame.acq_time)
+
     def get_last_frame(self):
         if self._last_frame is None:
             raise StateError()
@@ -142,13 +257,15 @@ class Accessor:
 
 # A Creator is an accessor that first creates the framework before accessing it.
 # It will raise an ExistentialError if the specified name already exists
+# {slots} sets how many frames the framework can hold for slow readers
 class Creator(Accessor):
-    def __init__(self, name, max_size):
+    def __init__(self, name, max_size, slots=DEFAULT_SLOTS):
         self.name = name
-        self._framework = _lib.create_message_framework_from_cstring(name.encode('utf8'), max_size)
-        self._setup_accessor()
+        self.policy = LATEST
+        self._framework = _lib.create_message_framework_with_slots_from_cstring(name.encode('utf8'), max_size, slots)
         if not self._framework:
             raise ExistentialError()
+        self._setup_accessor()
 
 MAX_NAME_LENGTH = 100
 MAX_OPTION_FORMAT_STR_LENGTH = 64
@@ -16,9 +16,13 @@ class CaptureSource(object):
     #   of {fps} frames per second
     # if {persistent} is False, the subclass must take care of sending images
     #   itself
+    # {slots} is the number of frame slots in the message framework (see
+    #   camera_message_framework.Creator); visiond sets it from the 'slots' key
+    #   of the capture source's config
     def __init__(self, direction, fps=10.0, persistent=True):
         self._shm = None
         self.fps = fps
+        self.slots = camera_message_framework.DEFAULT_SLOTS
         self.direction = direction
         self._persistent = persistent
         logger = auvlog.vision.capture_source
@@ -59,6 +63,7 @@ class CaptureSource(object):
         if self._framework is None:
             height, width, depth = image.shape
             self._framework = camera_message_framework.Creator(self.direction,
-                                                               width*height*depth)
+                                                               width*height*depth,
+                                                               self.slots)
             atexit.register(self._framework.cleanup)
         self._framework.write_frame(image, int(acq_time*1000))
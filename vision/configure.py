@@ -10,6 +10,9 @@ build.install('auv-vision-gui', f='vision/gui/server.py')
 
 build.build_shared('auv-camera-message-framework', ['c/camera_message_framework.cpp'], deps=['pthread'], auv_deps=['utils'])
 
+build.test_gtest('camera-message-framework', ['test/camera_message_framework.cpp'],
+                auv_deps=['auv-camera-message-framework'])
+
 build.build_shared('auv-camera-filters', ['c/camera_filters.cpp'], pkg_confs=['opencv'], auv_deps=['utils'])
 
 build.build_cmd('auv-firewire-daemon', ['c/firewire_camera.cpp'], deps=['dc1394'], auv_deps=['auv-camera-message-framework'], pkg_confs=['opencv'])
@@ -32,8 +32,7 @@ int main(int argc, char** argv) {
     std::cout << "No camera found in direction \"" << direction << "\"" << std::endl;
     return 1;
   }
-  struct frame frame;
-  frame.data = NULL;
+  struct frame frame = {};
 
   namedWindow(direction, 1);
   void* handle = cvGetWindowHandle(direction);
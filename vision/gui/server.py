@@ -3,10 +3,11 @@
 import eventlet
 eventlet.monkey_patch()
 
-from flask import Flask, render_template, abort
+from flask import Flask, render_template, abort, jsonify, request
 from flask_socketio import SocketIO, emit, join_room, leave_room, \
     close_room, rooms, disconnect, send
-from vision import camera_message_framework, vision_common, options
+from vision import camera_message_framework, vision_common, options, telemetry
+from vision import resizable_eventlet_tpool as tpool
 import atexit
 import cv2
 import sys
@@ -33,6 +34,96 @@ all_vision_modules = vision_common.all_vision_modules()
 MAX_IMAGE_DIMENSION = 510
 module_listeners = collections.defaultdict(int)
 
+# Images are streamed by a single encoder loop. Observers only keep the latest
+# frame of every posted image; each pass of the loop encodes a frame at most
+# once per requested quality and sends it to every client that is due for it.
+# A client is due when it subscribed to the image, its max fps allows another
+# frame and it has acknowledged the previous frame of that image, so slow
+# clients get fewer frames instead of queueing them.
+DEFAULT_MAX_FPS = 10
+DEFAULT_QUALITY = 60
+ENCODE_INTERVAL = 0.01
+# frames older than this are not sent, unless the client has none of that image yet
+STALE_AGE = 0.5
+# resend to a client whose acknowledgement has not arrived after this long
+ACK_TIMEOUT = 2.0
+
+# (module name, image name) -> (image, acq_time, sequence number)
+latest_images = {}
+# socket.io session id -> Client
+clients = {}
+
+class Client:
+    def __init__(self, sid, module):
+        self.sid = sid
+        self.module = module
+        self.images = None # None subscribes to every image of the module
+        self.max_fps = DEFAULT_MAX_FPS
+        self.quality = DEFAULT_QUALITY
+        self.last_sequence = {}
+        self.last_sent = {}
+        self.in_flight = {}
+
+    def subscribe(self, images=None, max_fps=None, quality=None):
+        self.images = None if images is None else set(images)
+        if max_fps is not None:
+            self.max_fps = max(float(max_fps), 0.1)
+        if quality is not None:
+            self.quality = min(max(int(quality), 1), 100)
+
+    def due(self, module, name, sequence, acq_time, now):
+        if module != self.module or (self.images is not None and name not in self.images):
+            return False
+        if self.last_sequence.get(name, -1) >= sequence:
+            return False
+        if name in self.last_sequence and now - acq_time / 1000 > STALE_AGE:
+            return False
+        if now - self.in_flight.get(name, 0) < ACK_TIMEOUT:
+            return False
+        return now - self.last_sent.get(name, 0) >= 1. / self.max_fps
+
+    def send(self, name, sequence, message, now):
+        self.last_sequence[name] = sequence
+        self.last_sent[name] = now
+        self.in_flight[name] = now
+        def acknowledged(*args):
+            self.in_flight.pop(name, None)
+        socketio.emit('image', message, room=self.sid, callback=acknowledged)
+
+def encode(image, quality):
+    _, jpeg = cv2.imencode('.jpg', image, (cv2.IMWRITE_JPEG_QUALITY, quality))
+    return jpeg.tobytes()
+
+def encoder_loop():
+    while True:
+        socketio.sleep(ENCODE_INTERVAL)
+        now = time.time()
+        for (module_name, image_name), (image, acq_time, sequence) in list(latest_images.items()):
+            due = [c for c in list(clients.values())
+                   if c.due(module_name, image_name, sequence, acq_time, now)]
+            if not due or module_name not in module_frameworks:
+                continue
+            try:
+                idx = module_frameworks[module_name].ordered_image_names.index(image_name)
+            except ValueError:
+                continue
+
+            encoded = {}
+            for client in due:
+                try:
+                    if client.quality not in encoded:
+                        # encode off the hub, so sockets keep being serviced
+                        encoded[client.quality] = tpool.execute(encode, image, client.quality)
+                        if app.debug:
+                            print("Encoded image {}(data-index={}) at quality {}".format(image_name, idx, client.quality))
+                    client.send(image_name, sequence,
+                                {'image_name': image_name,
+                                 'image': encoded[client.quality],
+                                 'image_index': idx},
+                                now)
+                except Exception as e:
+                    print(e)
+
 @app.errorhandler(404)
 def page_not_found(e):
     return 'Could not find the requested module', 404
@@ -94,6 +185,7 @@ def on_join(data):
     module = data['module'].strip('/')
     module_listeners[module] += 1
     join_room(module)
+    clients[request.sid] = Client(request.sid, module)
 
     while module not in module_frameworks:
         time.sleep(0.1)
@@ -101,9 +193,16 @@ def on_join(data):
     all_option_values = module_frameworks[module].get_option_values()
     for option_name, option_value in all_option_values.items():
         send_option(module, option_name, option_value)
-    images = module_frameworks[module].get_images()
-    for image_name, image in images.items():
-        send_image(module, image_name, image)
+    # the encoder loop sends the current images
+
+# choose which images of the module to stream and at what rate and quality:
+# {images: [names] or null for all, max_fps: number, quality: 1-100}
+@socketio.on('subscribe')
+def on_subscribe(data):
+    client = clients.get(request.sid)
+    if client is None:
+        return
+    client.subscribe(data.get('images'), data.get('max_fps'), data.get('quality'))
 
 @socketio.on('disconnect')
 def on_disconnect():
@@ -113,6 +212,7 @@ def on_disconnect():
     for room in rooms():
         if room in module_listeners:
             module_listeners[room] -= 1
+    clients.pop(request.sid, None)
 
 @socketio.on('option_update')
 def on_option_update(data):
@@ -128,37 +228,21 @@ def on_option_update(data):
     value_list[0] = new_value
     module_frameworks[module].write_option(option_name, value_list)
 
-def send_image(module_name, image_name, image):
-    try:
-        if module_name not in module_frameworks:
-            return
-        else:
-            idx = module_frameworks[module_name].ordered_image_names.index(image_name)
-
-        if app.debug:
-            print("Sending image {}(data-index={})".format(image_name, idx))
-        image = vision_common.resize_keep_ratio(image, MAX_IMAGE_DIMENSION)
-        _, jpeg = cv2.imencode('.jpg', image, (cv2.IMWRITE_JPEG_QUALITY, 60))
-        jpeg_bytes = jpeg.tobytes()
-        value_dict = {'image_name': image_name,
-                      'image': jpeg_bytes,
-                      'image_index': idx}
-        socketio.emit('image', value_dict, room=module_name)
-    except Exception as e:
-        print(e)
-
 def get_image_observer(module_name):
+    sequence = [0]
     def observe(name, value):
         if module_listeners[module_name] == 0:
             time.sleep(0)
             return
 
         image, acq_time = value
-
-        if time.time() - acq_time / 1000 > 0.5:
-            print('lag: {}'.format(time.time() - acq_time / 1000))
-
-        send_image(module_name, name, image)
+        # the accessor reuses its buffer for the next frame, so keep a
+        # (downscaled) copy for the encoder
+        small = vision_common.resize_keep_ratio(image, MAX_IMAGE_DIMENSION)
+        if small is image:
+            small = image.copy()
+        sequence[0] += 1
+        latest_images[(module_name, name)] = (small, acq_time, sequence[0])
 
         time.sleep(0)
     return observe
@@ -189,6 +273,14 @@ def get_option_observer(module_name):
         time.sleep(0)
     return observe
 
+# telemetry of running modules and all capture sources, as published into shm
+@app.route('/telemetry')
+def get_telemetry():
+    return jsonify({
+        'modules': {name: telemetry.module_summary(name) for name in get_active_modules()},
+        'capture_sources': {name: telemetry.capture_summary(name) for name in telemetry.capture_sources()},
+    })
+
 @app.route('/<module_name>/')
 @error_if_invalid_module()
 def module(module_name):
@@ -199,4 +291,5 @@ def module(module_name):
     return render_template('module.html', module_name=module_name, modules=get_active_modules())
 
 if __name__ == '__main__':
+    socketio.start_background_task(encoder_loop)
     socketio.run(app, host='0.0.0.0', port=5000, use_reloader=False)
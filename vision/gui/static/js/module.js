@@ -139,7 +139,7 @@ $(document).ready(function(){
     imagesContainer = $("ul#images");
     optionsContainer = $("ul#options");
 
-    socket.on('image', function(msg) {
+    socket.on('image', function(msg, ack) {
         var js_name = format_id(msg.image_name);
         if (imagesContainer.find("img#" + js_name).length === 0) {
             imagesContainer.append("<li class=\"list-group-item col-xs-6\" data-index=\"" + msg.image_index + "\"><img id=\"" + js_name + "\" src=\"\" class=\"posted\"><br>" +
@@ -149,6 +149,9 @@ $(document).ready(function(){
 
         im = String.fromCharCode.apply(null, new Uint8Array(msg.image));
         document.getElementById(js_name).src = 'data:image/jpeg;base64,' + btoa(im);
+        // lets the server send this image's next frame
+        if (ack)
+            ack();
     });
 
     socket.on('option', function(msg) {
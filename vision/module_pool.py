@@ -0,0 +1,167 @@
+import atexit
+import os
+import sys
+import time
+
+import shm
+
+import vision_common
+from auvlog.client import log as auvlog
+
+# A pool of pre-warmed processes that run vision modules.
+#
+# Forking a fresh process for every module start means each one imports its
+# module file (and OpenCV with it) and reloads it before it can process a
+# frame, which makes missions that switch modules on and off slow. The pool is
+# a single process that imports every module file once and keeps a few idle
+# forks of itself ready. It polls shm.vision_modules: when a module is
+# switched on it hands the module to an idle process, which starts running it
+# straight away, and then forks a replacement. A module that is switched off
+# stops as before, its process exiting after the current frame.
+#
+# Module files edited after the pool imported them are reloaded on start. A
+# module whose process fails is not restarted until it is switched off and on.
+
+dirname = os.path.dirname(os.path.realpath(__file__))
+module_dir = os.path.join(dirname, 'modules')
+# holds the pool's pid. it is left behind when the pool is killed, so
+# pool_pid() checks that the process is still alive
+status_file = os.path.join(dirname, 'status', 'module_pool')
+
+DEFAULT_SPARES = 2
+# seconds between checks of shm.vision_modules
+POLL_INTERVAL = 0.005
+
+logger = auvlog.vision.pool
+
+# pid of the running pool, or None if there is none
+def pool_pid():
+    try:
+        with open(status_file) as f:
+            pid = int(f.read())
+        os.kill(pid, 0)
+        return pid
+    except (OSError, ValueError):
+        return None
+
+# import every module file, returning the modification time of each imported
+def _prewarm():
+    sys.path.append(module_dir)
+    loaded = {}
+    for (module_name, _) in vision_common.all_vision_modules():
+        path = os.path.join(module_dir, module_name + '.py')
+        if not os.path.isfile(path):
+            continue
+        try:
+            __import__(module_name)
+            loaded[module_name] = os.path.getmtime(path)
+        except Exception as e:
+            logger.warn('could not preload {}: {}'.format(module_name, e))
+    return loaded
+
+# body of an idle process: wait for a module name on fd and run that module
+def _idle(fd, run_module, loaded):
+    # exit handlers inherited from the pool are not this process's to run
+    atexit._clear()
+    open('{}/pids/{}.pid'.format(dirname, os.getpid()), 'w').close()
+    status = 1
+    try:
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = os.read(fd, 256)
+            if not chunk:
+                # the pool is gone
+                return
+            data += chunk
+        module_name = data.decode('utf8').strip()
+        path = os.path.join(module_dir, module_name + '.py')
+        stale = module_name not in loaded or os.path.getmtime(path) != loaded[module_name]
+        run_module(module_name, reload_module=stale)
+        status = 0
+    except BaseException as e:
+        print(e)
+    finally:
+        vision_common.cleanup_pid()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # never return into the pool's loop this process was forked from
+        atexit._run_exitfuncs()
+        os._exit(status)
+
+# run the pool forever, keeping {spares} idle processes. this is intended to be
+# ran as a separate process. run_module(module_name, reload_module) runs a
+# module until it is switched off
+def run_pool(run_module, spares=DEFAULT_SPARES):
+    with open(status_file, 'w') as f:
+        f.write(str(os.getpid()))
+
+    loaded = _prewarm()
+    logger.log('preloaded {} modules'.format(len(loaded)))
+    module_names = [module_name for (module_name, _) in vision_common.all_vision_modules()]
+
+    idle = [] # (pid, fd of the pipe to it)
+    running = {} # module name -> pid of the process running it
+    failed = set() # modules whose process failed while switched on
+
+    def spawn():
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(w)
+            for (_, fd) in idle:
+                os.close(fd)
+            _idle(r, run_module, loaded)
+        os.close(r)
+        idle.append((pid, w))
+
+    def attach(module_name):
+        while True:
+            if not idle:
+                spawn()
+            pid, fd = idle.pop(0)
+            try:
+                os.write(fd, (module_name + '\n').encode('utf8'))
+            except OSError:
+                # it died before it could be reaped
+                continue
+            finally:
+                os.close(fd)
+            running[module_name] = pid
+            logger.log('attached {} to {}'.format(module_name, pid))
+            return
+
+    def reap(pid, status):
+        for (p, fd) in idle:
+            if p == pid:
+                os.close(fd)
+        idle[:] = [(p, fd) for (p, fd) in idle if p != pid]
+        for (module_name, p) in list(running.items()):
+            if p == pid:
+                del running[module_name]
+                logger.log('detached {} from {}'.format(module_name, pid))
+                if status != 0:
+                    failed.add(module_name)
+
+    # the module flags are polled rather than waited on with a shm watcher, so
+    # that stopping the pool never leaves a dead process waiting on a watcher
+    while True:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            reap(pid, status)
+
+        flags = shm.vision_modules.get()
+        for module_name in module_names:
+            if not getattr(flags, module_name):
+                failed.discard(module_name)
+            elif module_name not in running and module_name not in failed:
+                attach(module_name)
+
+        while len(idle) < spares:
+            spawn()
+
+        time.sleep(POLL_INTERVAL)
@@ -13,6 +13,9 @@ class _PsuedoOptionsDict:
 class ModuleBase:
     def __init__(self, options=None, order_post_by_time=True):
         self.acq_time = -1
+        # derived images requested through the module's 'derived' list (see
+        # vision/preprocess.py), by channel name
+        self.derived = {}
         self.order_post_by_time = order_post_by_time
         self.posted_images = []
 
@@ -3,6 +3,7 @@ from vision.modules import ModuleBase, buoy_common
 from vision import options
 
 capture_source = 'forward'
+derived = ['RGB2LAB', 'RGB2HLS']
 options = [options.IntOption('hls_h_min', 105, 0, 255),
            options.IntOption('hls_h_max', 143, 0, 255),
            options.IntOption('lab_a_min', 127, 0, 255),
@@ -14,7 +15,7 @@ options = [options.IntOption('hls_h_min', 105, 0, 255),
            options.IntOption('min_heuristic_score', 0, 0, 1000),
            options.DoubleOption('min_circularity', 0.5, 0, 1),
            options.BoolOption('verbose', False)
-          ]
+          ] + buoy_common.pipeline_options()
 
 class RedBuoy(ModuleBase.ModuleBase):
     def __init__(self, logger):
@@ -1,38 +1,133 @@
 import math
 import cv2
+import numpy as np
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 
+from vision import options
+
 CONTOUR_CIRCULARITY_HEURISTIC_LIMIT = 10
 CONTOUR_SCALED_HEURISTIC_LIMIT = 2
 ContourAreaData = namedtuple('ContourAreaData', ['contour', 'area'])
 ContourScoreData = namedtuple('ContourScoreData', ['contour', 'area', 'circularity', 'score', 'center', 'radius'])
 
-def process(self, mat, results):
-    self.post('orig', mat)
-    lab_image = cv2.cvtColor(mat, cv2.COLOR_RGB2LAB)
+# Thresholding can be limited to parts of the frame and spread across a thread
+# pool (OpenCV releases the GIL while it works):
+#   threads: with more than 1, the frame is cut into that many horizontal bands
+#   roi_scale: with more than 1, the frame is first thresholded at 1/roi_scale
+#       resolution, and only the regions around what passed are thresholded at
+#       full resolution. A blob that no coarse pixel lands on is missed, so
+#       keep roi_scale well below the size of the smallest buoy in pixels
+# Each part is thresholded with a margin of the median blur radius around it,
+# so the blurred mask matches the one of the whole frame.
+def pipeline_options():
+    return [options.IntOption('roi_scale', 1, 1, 16),
+            options.IntOption('threads', 1, 1, 16)]
+
+_executor = None
+_executor_threads = 0
+
+def _map(threads, f, items):
+    global _executor, _executor_threads
+    if threads <= 1 or len(items) <= 1:
+        return list(map(f, items))
+    if threads != _executor_threads:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ThreadPoolExecutor(max_workers=threads)
+        _executor_threads = threads
+    return list(_executor.map(f, items))
+
+def _threshold(self, lab_image, hls_image):
     lab_split = cv2.split(lab_image)
     lab_athreshed = cv2.inRange(lab_split[1], self.options['lab_a_min'],
                                               self.options['lab_a_max'])
-    if self.options['verbose']:
-        self.post('lab a threshed', lab_athreshed)
     lab_bthreshed = cv2.inRange(lab_split[2], self.options['lab_b_min'],
                                               self.options['lab_b_max'])
-    if self.options['verbose']:
-        self.post('lab b threshed', lab_bthreshed)
-
-    hls_image = cv2.cvtColor(mat, cv2.COLOR_RGB2HLS)
     hls_split = cv2.split(hls_image)
     hls_hthreshed = cv2.inRange(hls_split[0], self.options['hls_h_min'],
                                               self.options['hls_h_max'])
-    if self.options['verbose']:
-        self.post('hls h Threshed', hls_hthreshed)
+    return lab_athreshed, lab_bthreshed, hls_hthreshed
+
+# regions (y0, y1, x0, x1) that can hold a thresholded pixel, found at 1/scale
+# resolution and grown by margin pixels
+def _coarse_regions(self, lab_image, hls_image, scale, margin):
+    lab_small = np.ascontiguousarray(lab_image[::scale, ::scale])
+    hls_small = np.ascontiguousarray(hls_image[::scale, ::scale])
+    lab_athreshed, lab_bthreshed, hls_hthreshed = _threshold(self, lab_small, hls_small)
+    coarse = lab_athreshed & lab_bthreshed & hls_hthreshed
+    # pixels between samples are up to scale - 1 away from one
+    grow = int(math.ceil((margin + scale) / scale))
+    coarse = cv2.dilate(coarse, np.ones((2 * grow + 1, 2 * grow + 1), np.uint8))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(coarse)
+    height, width = lab_image.shape[:2]
+    regions = []
+    for (x, y, w, h, _) in stats[1:count]:
+        regions.append((y * scale, min((y + h) * scale, height),
+                        x * scale, min((x + w) * scale, width)))
+    return regions
 
-    finalThreshed = hls_hthreshed & lab_athreshed & lab_bthreshed
+def _bands(height, width, count):
+    bounds = np.linspace(0, height, count + 1).astype(int)
+    return [(bounds[i], bounds[i + 1], 0, width) for i in range(count)
+            if bounds[i] < bounds[i + 1]]
+
+# threshold and blur the given regions of the frame, returning full frame masks
+# (lab a, lab b, hls h, final, blurred). all but blurred are None unless verbose
+def _threshold_regions(self, lab_image, hls_image, regions, radius, threads):
+    height, width = lab_image.shape[:2]
+    ksize = self.options['blur_size'] * 2 - 1
+    verbose = self.options['verbose']
+
+    def work(region):
+        y0, y1, x0, x1 = region
+        ey0, ey1 = max(y0 - radius, 0), min(y1 + radius, height)
+        ex0, ex1 = max(x0 - radius, 0), min(x1 + radius, width)
+        masks = _threshold(self, lab_image[ey0:ey1, ex0:ex1], hls_image[ey0:ey1, ex0:ex1])
+        final = masks[0] & masks[1] & masks[2]
+        blurred = cv2.medianBlur(final, ksize)
+        inner = (slice(y0 - ey0, y1 - ey0), slice(x0 - ex0, x1 - ex0))
+        parts = (masks + (final,) if verbose else ()) + (blurred,)
+        return [part[inner] for part in parts]
+
+    if regions == [(0, height, 0, width)]:
+        parts = work(regions[0])
+        return tuple(parts) if verbose else (None,) * 4 + (parts[0],)
+
+    full = [np.zeros((height, width), np.uint8) for _ in range(5 if verbose else 1)]
+    for (region, parts) in zip(regions, _map(threads, work, regions)):
+        y0, y1, x0, x1 = region
+        for (mask, part) in zip(full, parts):
+            mask[y0:y1, x0:x1] = part
+    return tuple(full) if verbose else (None,) * 4 + (full[0],)
+
+def process(self, mat, results):
+    self.post('orig', mat)
+    # computed once per frame for all buoy modules by the preprocessing stage
+    lab_image = self.derived.get('RGB2LAB')
+    if lab_image is None:
+        lab_image = cv2.cvtColor(mat, cv2.COLOR_RGB2LAB)
+    hls_image = self.derived.get('RGB2HLS')
+    if hls_image is None:
+        hls_image = cv2.cvtColor(mat, cv2.COLOR_RGB2HLS)
+
+    height, width = lab_image.shape[:2]
+    blur_radius = self.options['blur_size'] - 1
+    scale = self.options['roi_scale']
+    threads = self.options['threads']
+    if scale > 1:
+        regions = _coarse_regions(self, lab_image, hls_image, scale, blur_radius)
+    else:
+        regions = _bands(height, width, threads)
+
+    lab_athreshed, lab_bthreshed, hls_hthreshed, finalThreshed, blurred = \
+        _threshold_regions(self, lab_image, hls_image, regions, blur_radius, threads)
     if self.options['verbose']:
+        self.post('lab a threshed', lab_athreshed)
+        self.post('lab b threshed', lab_bthreshed)
+        self.post('hls h Threshed', hls_hthreshed)
         self.post('finalThreshed', finalThreshed)
-
-    blurred = cv2.medianBlur(finalThreshed, self.options['blur_size'] * 2 - 1)
     self.post('blurred', blurred)
 
     _, contours, hierarchy = cv2.findContours(blurred.copy(), cv2.RETR_EXTERNAL,
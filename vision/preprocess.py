@@ -0,0 +1,222 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+import shm
+
+from auvlog.client import log as auvlog
+from vision import camera_message_framework
+from vision.telemetry import CaptureTelemetry
+
+# Shared preprocessing of capture source frames.
+#
+# Modules declare the derived images they need with a module level list, e.g.
+#     derived = ['RGB2LAB', 'RGB2HLS']
+# and find them in self.derived when process() is called. For every capture
+# source, visiond runs one preprocessing process that computes each channel
+# requested by a running module once per frame and publishes it through the
+# message framework as '<direction>.<channel>', with the acquisition time of
+# the frame it was computed from.
+#
+# A channel is either one of CHANNELS below or the name of an OpenCV color
+# conversion without its COLOR_ prefix (e.g. 'BGR2GRAY').
+
+CHANNELS = {
+    'half': lambda image: cv2.resize(image, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA),
+    'quarter': lambda image: cv2.resize(image, None, fx=0.25, fy=0.25, interpolation=cv2.INTER_AREA),
+    'blur5': lambda image: cv2.GaussianBlur(image, (5, 5), 0),
+}
+
+# running modules leave a file <direction>.<module> here listing their channels
+REQUEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'derived')
+
+# seconds between checks for new requests
+REQUEST_POLL_INTERVAL = 1.0
+
+# seconds a module waits for the first derived channel of a capture source to
+# be published. Capture sources not started by visiond have no preprocessing
+# stage, so modules read them without derived images after this
+DERIVED_TIMEOUT = 5.0
+
+# consecutive derived frames without a matching source frame after which a
+# module computes its channels itself rather than wait for the stage to catch up
+MAX_MISMATCHES = 3
+
+logger = auvlog.vision.preprocess
+
+def channel_name(direction, channel):
+    return '{}.{}'.format(direction, channel)
+
+def compute(channel, image):
+    if channel in CHANNELS:
+        return CHANNELS[channel](image)
+    return cv2.cvtColor(image, getattr(cv2, 'COLOR_' + channel))
+
+def validate(channel):
+    if channel not in CHANNELS and not hasattr(cv2, 'COLOR_' + channel):
+        raise ValueError('{} is not a known derived image channel'.format(channel))
+
+def _request_file(direction, module_name):
+    return os.path.join(REQUEST_DIR, '{}.{}'.format(direction, module_name))
+
+def request_channels(module_name, direction, channels):
+    for channel in channels:
+        validate(channel)
+    with open(_request_file(direction, module_name), 'w') as f:
+        f.write('\n'.join(channels))
+
+def withdraw_channels(module_name, direction):
+    try:
+        os.remove(_request_file(direction, module_name))
+    except OSError:
+        pass
+
+# the channels of direction requested by modules that are currently running
+def requested_channels(direction):
+    channels = set()
+    prefix = direction + '.'
+    for filename in os.listdir(REQUEST_DIR):
+        if not filename.startswith(prefix):
+            continue
+        module_name = filename[len(prefix):]
+        module_shm = getattr(shm.vision_modules, module_name, None)
+        if module_shm is None or not module_shm.get():
+            continue
+        with open(os.path.join(REQUEST_DIR, filename)) as f:
+            channels.update(line.strip() for line in f if line.strip())
+    return sorted(channels)
+
+# run the preprocessing stage of a capture source forever. this is intended to
+# be ran as a separate process
+def run_preprocess(direction):
+    source = camera_message_framework.Accessor(direction)
+    writers = {}
+    channels = []
+    last_poll = 0
+    telemetry = CaptureTelemetry(direction)
+
+    while True:
+        image, acq_time = source.get_next_frame()
+        telemetry.update(source.frame_count())
+
+        if time.time() - last_poll > REQUEST_POLL_INTERVAL:
+            channels = requested_channels(direction)
+            last_poll = time.time()
+
+        # compute every channel before posting any, so that modules waiting on
+        # several channels of the same frame get them close together
+        derived = [(channel, np.ascontiguousarray(compute(channel, image)))
+                   for channel in channels]
+        for (channel, result) in derived:
+            if channel not in writers:
+                writers[channel] = camera_message_framework.Creator(
+                    channel_name(direction, channel), result.nbytes, source.slots)
+            writers[channel].write_frame(result, acq_time)
+
+# Follows a framework frame by frame so the frame with a given acquisition time
+# can be picked out of it
+class _Follower:
+    def __init__(self, name):
+        self.accessor = camera_message_framework.Accessor(name, camera_message_framework.EVERY_FRAME)
+        self.current = None
+
+    # returns the image acquired at acq_time, or None if it is no longer
+    # available (the reader fell a whole ring behind)
+    def frame_at(self, acq_time):
+        while self.current is None or self.current[1] < acq_time:
+            self.current = self.accessor.get_next_frame()
+        image, current_time = self.current
+        return image if current_time == acq_time else None
+
+# Opens the framework of a derived channel once a running preprocessing stage
+# writes to it, or returns None if none does within timeout seconds. Framework
+# files outlive the processes that wrote them, so one left behind by an earlier
+# visiond run only counts once a live preprocessing stage has taken it over.
+# Stale frameworks are not kept mapped while waiting, so that a new stage can
+# recreate them with a different size
+def _open_published(name, timeout):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            accessor = camera_message_framework.Accessor(
+                name, timeout=max(deadline - time.time(), 0))
+        except camera_message_framework.ExistentialError:
+            return None
+        if accessor.writer_alive():
+            return accessor
+        accessor.cleanup()
+        if time.time() >= deadline:
+            return None
+        time.sleep(0.1)
+
+# Reads frames of a capture source together with the derived channels a module
+# requested, all from the same acquisition. If the channels are not published
+# within timeout seconds, frames are read without them and derived is empty.
+# If the preprocessing stage falls so far behind that MAX_MISMATCHES derived
+# frames in a row are no longer in the source ring, the channels are computed
+# from the latest source frame instead
+class DerivedReader:
+    def __init__(self, direction, channels, timeout=DERIVED_TIMEOUT):
+        self.direction = direction
+        self.channels = list(channels)
+        self._lagging = False
+        if self.channels:
+            self._latest = _open_published(channel_name(direction, self.channels[0]), timeout)
+            if self._latest is None:
+                logger.warn('no preprocessing stage for {} after {} s, reading it without {}'.format(
+                    direction, timeout, ', '.join(self.channels)))
+                self.channels = []
+        if self.channels:
+            self._followers = [(channel, _Follower(channel_name(direction, channel)))
+                               for channel in self.channels[1:]]
+            self._source = _Follower(direction)
+            self.buffer_size = self._source.accessor.buffer_size
+        else:
+            self._source = camera_message_framework.Accessor(direction)
+            self.buffer_size = self._source.buffer_size
+
+    # number of frames the capture source has written so far
+    def frames_written(self):
+        if self.channels:
+            return self._source.accessor.frame_count()
+        return self._source.frame_count()
+
+    # returns (image, acq_time, derived), derived mapping channel to image
+    def get_next_frame(self):
+        if not self.channels:
+            image, acq_time = self._source.get_next_frame()
+            return image, acq_time, {}
+
+        # once behind, try to match each derived frame only once, so the module
+        # keeps the rate of the stage until it catches up
+        for _ in range(1 if self._lagging else MAX_MISMATCHES):
+            first, acq_time = self._latest.get_next_frame()
+            derived = {self.channels[0]: first}
+            for (channel, follower) in self._followers:
+                derived[channel] = follower.frame_at(acq_time)
+            image = self._source.frame_at(acq_time)
+            if image is not None and all(d is not None for d in derived.values()):
+                if self._lagging:
+                    logger.info('preprocessing stage for {} caught up'.format(self.direction))
+                    self._lagging = False
+                return image, acq_time, derived
+
+        if not self._lagging:
+            logger.warn('preprocessing stage for {} is more than a ring behind, computing {} here'.format(
+                self.direction, ', '.join(self.channels)))
+            self._lagging = True
+        # the source follower has read at least up to the last derived frame,
+        # so its current frame is the newest source frame seen
+        image, acq_time = self._source.current
+        return image, acq_time, {channel: compute(channel, image) for channel in self.channels}
+
+    def cleanup(self):
+        if self.channels:
+            self._latest.cleanup()
+            for (_, follower) in self._followers:
+                follower.accessor.cleanup()
+            self._source.accessor.cleanup()
+        else:
+            self._source.cleanup()
@@ -0,0 +1,137 @@
+import time
+
+import numpy as np
+
+import shm
+
+# Telemetry for vision modules and capture sources.
+#
+# visiond times every call to a module's process() and publishes a summary for
+# each module about once a second into the vision_module_* shm groups, which
+# have one variable per module (like vision_modules). The preprocessing stage
+# of each capture source publishes its write rate into vision_capture_*.
+
+PUBLISH_INTERVAL = 1.0
+
+# shm group -> summary key, for modules
+MODULE_GROUPS = [
+    (shm.vision_module_fps, 'fps'),
+    (shm.vision_module_frame_age, 'frame_age'),
+    (shm.vision_module_process_time, 'process_time'),
+    (shm.vision_module_process_time_p90, 'process_time_p90'),
+    (shm.vision_module_process_time_p99, 'process_time_p99'),
+    (shm.vision_module_process_time_max, 'process_time_max'),
+    (shm.vision_module_frames, 'frames'),
+    (shm.vision_module_dropped, 'dropped'),
+]
+
+CAPTURE_GROUPS = [
+    (shm.vision_capture_fps, 'fps'),
+    (shm.vision_capture_frames, 'frames'),
+]
+
+def _publish(groups, name, summary):
+    for (group, key) in groups:
+        var = getattr(group, name, None)
+        if var is not None:
+            var.set(summary[key])
+
+def _read(groups, name):
+    return {key: getattr(group, name).get() for (group, key) in groups
+            if hasattr(group, name)}
+
+# the latest published summary of a module, as a dictionary
+def module_summary(module_name):
+    return _read(MODULE_GROUPS, module_name)
+
+# the latest published summary of a capture source, as a dictionary
+def capture_summary(direction):
+    return _read(CAPTURE_GROUPS, direction)
+
+def capture_sources():
+    return [name for (name, _) in shm.vision_capture_fps._fields]
+
+# Collects timings of one module's frames and publishes a summary of them
+# every PUBLISH_INTERVAL seconds
+class ModuleTelemetry:
+    def __init__(self, module_name):
+        self.module_name = module_name
+        self.frames = 0
+        self.dropped = 0
+        self._last_written = None
+        self._window_start = time.time()
+        self._window_frames = 0
+        self._process_times = []
+        self._frame_ages = []
+        self._started = None
+
+    # call just before process(). acq_times are the acquisition times (ms) of
+    # the frames about to be processed; written is the number of frames each
+    # capture source has written so far, so that skipped frames can be counted
+    # from the gap since the last frame of each source
+    def frame_started(self, acq_times, written):
+        self._started = time.time()
+        self._frame_ages.append(self._started * 1000 - np.mean(acq_times))
+
+        if self._last_written is not None:
+            self.dropped += sum(max(w - last - 1, 0)
+                                for (w, last) in zip(written, self._last_written))
+        self._last_written = list(written)
+        self.frames += 1
+        self._window_frames += 1
+
+    # call just after process(); returns the summary if one was published. the
+    # first frame is published straight away, to show the module is running
+    def frame_finished(self):
+        now = time.time()
+        self._process_times.append((now - self._started) * 1000)
+        if self.frames == 1 or now - self._window_start >= PUBLISH_INTERVAL:
+            return self.publish(now)
+
+    # call when the module stops; publishes a last summary with an fps of 0
+    def stopped(self):
+        summary = self.summary()
+        summary['fps'] = 0.0
+        _publish(MODULE_GROUPS, self.module_name, summary)
+
+    def summary(self, now=None):
+        now = time.time() if now is None else now
+        times = np.array(self._process_times) if self._process_times else np.zeros(1)
+        p50, p90, p99 = np.percentile(times, [50, 90, 99])
+        return {
+            'fps': self._window_frames / max(now - self._window_start, 1e-9),
+            'frame_age': float(np.mean(self._frame_ages)) if self._frame_ages else 0.0,
+            'process_time': float(p50),
+            'process_time_p90': float(p90),
+            'process_time_p99': float(p99),
+            'process_time_max': float(times.max()),
+            'frames': self.frames,
+            'dropped': self.dropped,
+        }
+
+    def publish(self, now=None):
+        now = time.time() if now is None else now
+        summary = self.summary(now)
+        _publish(MODULE_GROUPS, self.module_name, summary)
+        self._window_start = now
+        self._window_frames = 0
+        self._process_times = []
+        self._frame_ages = []
+        return summary
+
+# Publishes the write rate of a capture source given its frame counter
+class CaptureTelemetry:
+    def __init__(self, direction):
+        self.direction = direction
+        self._last = None
+
+    def update(self, written):
+        now = time.time()
+        if self._last is None:
+            self._last = (now, written)
+            return
+        last_time, last_written = self._last
+        if now - last_time >= PUBLISH_INTERVAL:
+            _publish(CAPTURE_GROUPS, self.direction,
+                     {'fps': (written - last_written) / (now - last_time), 'frames': written})
+            self._last = (now, written)
@@ -0,0 +1,150 @@
+#include <gtest/gtest.h>
+
+#include <signal.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/prctl.h>
+#include <sys/wait.h>
+#include <time.h>
+#include <unistd.h>
+
+#include <string>
+
+#include "vision/c/camera_message_framework.hpp"
+
+// Readers and writers of a framework run in different processes, so each test
+// forks readers that block in read_frame and checks when they wake up.
+
+static const size_t IMAGE_SIZE = 64;
+
+static double now() {
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+// Forks a reader of direction that blocks until a new frame is written and writes the
+// time it woke up, and the first byte of the image, to the returned pipe.
+static pid_t fork_reader(const std::string& direction, int* read_fd) {
+  int fds[2];
+  if (pipe(fds) == -1) {
+    return -1;
+  }
+
+  pid_t pid = fork();
+  if (pid == 0) {
+    // don't outlive a test that fails while the reader is still waiting
+    prctl(PR_SET_PDEATHSIG, SIGKILL);
+    close(fds[0]);
+    message_framework_p framework = access_message_framework(direction);
+    struct frame f;
+    memset(&f, 0, sizeof(f));
+    if (framework == NULL) {
+      _exit(1);
+    }
+    f.last_frame = get_frame_count(framework);
+    if (!read_frame(&f, framework)) {
+      _exit(1);
+    }
+    double woke = now();
+    if (write(fds[1], &woke, sizeof(woke)) != sizeof(woke) ||
+        write(fds[1], f.data, 1) != 1) {
+      _exit(1);
+    }
+    _exit(0);
+  }
+
+  close(fds[1]);
+  *read_fd = fds[0];
+  return pid;
+}
+
+class CameraMessageFrameworkTest : public testing::Test {
+  protected:
+    CameraMessageFrameworkTest()
+        : direction("test-" + std::to_string(getpid())) {}
+
+    void SetUp() override {
+      framework = create_message_framework(direction, IMAGE_SIZE);
+      ASSERT_NE(nullptr, framework);
+      memset(image, 0, sizeof(image));
+    }
+
+    void TearDown() override {
+      cleanup_message_framework(framework);
+      unlink(("/dev/shm/auv_visiond-" + direction).c_str());
+    }
+
+    bool write(unsigned char value) {
+      image[0] = value;
+      return write_frame(framework, image, 0, IMAGE_SIZE, 1, 1);
+    }
+
+    // Waits for the reader on fd to report, and returns how long after since
+    // it woke up
+    double woken_after(pid_t pid, int fd, double since, unsigned char expected) {
+      double woke = 0;
+      unsigned char value = 0;
+      EXPECT_EQ((ssize_t) sizeof(woke), read(fd, &woke, sizeof(woke)));
+      EXPECT_EQ(1, read(fd, &value, 1));
+      EXPECT_EQ(expected, value);
+      close(fd);
+
+      int status;
+      EXPECT_EQ(pid, waitpid(pid, &status, 0));
+      EXPECT_TRUE(WIFEXITED(status) && WEXITSTATUS(status) == 0);
+      return woke - since;
+    }
+
+    std::string direction;
+    message_framework_p framework;
+    unsigned char image[IMAGE_SIZE];
+};
+
+// Readers in other processes are woken by a write, well before the 100 ms
+// timeout of each wait would wake them anyway
+TEST_F(CameraMessageFrameworkTest, WakesReadersInOtherProcesses) {
+  int fds[3];
+  pid_t pids[3];
+  for (int i = 0; i < 3; i++) {
+    pids[i] = fork_reader(direction, &fds[i]);
+    ASSERT_GT(pids[i], 0);
+  }
+
+  // let the readers start waiting, part way into a timeout
+  usleep(150 * 1000);
+  double written = now();
+  ASSERT_TRUE(write(7));
+
+  for (int i = 0; i < 3; i++) {
+    EXPECT_LT(woken_after(pids[i], fds[i], written, 7), 0.05);
+  }
+}
+
+// A reader killed while waiting on the framework leaves it usable, for the
+// writer and for the readers after it. A process shared condition variable
+// would hang the writer on the second write after the kill, waiting for the
+// dead reader to leave its group of waiters, so a hang is turned into a
+// failure with an alarm
+TEST_F(CameraMessageFrameworkTest, SurvivesReaderKilledWhileWaiting) {
+  alarm(10);
+
+  int fd;
+  pid_t pid = fork_reader(direction, &fd);
+  ASSERT_GT(pid, 0);
+  usleep(50 * 1000);
+  kill(pid, SIGKILL);
+  waitpid(pid, NULL, 0);
+  close(fd);
+
+  for (unsigned char value = 1; value <= 3; value++) {
+    pid = fork_reader(direction, &fd);
+    ASSERT_GT(pid, 0);
+    usleep(150 * 1000);
+    double written = now();
+    ASSERT_TRUE(write(value));
+    EXPECT_LT(woken_after(pid, fd, written, value), 0.05);
+  }
+
+  alarm(0);
+}
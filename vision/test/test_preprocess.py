@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from vision import camera_message_framework, preprocess
+
+IMAGE = np.arange(4 * 6 * 3, dtype=np.uint8).reshape((4, 6, 3))
+
+# A capture source that no preprocessing stage reads, as for capture sources
+# started outside of visiond
+class DerivedReaderWithoutPreprocessTest(unittest.TestCase):
+    def setUp(self):
+        self.direction = 'test-preprocess-{}'.format(os.getpid())
+        self.source = camera_message_framework.Creator(self.direction, IMAGE.nbytes)
+        self.source.write_frame(IMAGE, 1234)
+
+    def tearDown(self):
+        self.source.cleanup()
+        os.remove('/dev/shm/auv_visiond-' + self.direction)
+
+    def test_falls_back_to_capture_source(self):
+        with mock.patch.object(preprocess, 'logger') as logger:
+            start = time.time()
+            reader = preprocess.DerivedReader(self.direction, ['RGB2LAB', 'RGB2HLS'], timeout=0.3)
+            waited = time.time() - start
+
+        self.assertGreaterEqual(waited, 0.3)
+        self.assertLess(waited, 2)
+        self.assertEqual(logger.warn.call_count, 1)
+        self.assertEqual(reader.channels, [])
+        self.assertEqual(reader.buffer_size, IMAGE.nbytes)
+
+        image, acq_time, derived = reader.get_next_frame()
+        np.testing.assert_array_equal(image, IMAGE)
+        self.assertEqual(acq_time, 1234)
+        self.assertEqual(derived, {})
+        self.assertEqual(reader.frames_written(), 1)
+        reader.cleanup()
+
+# A derived channel left behind in /dev/shm by a preprocessing stage that
+# exited, as after an earlier visiond run
+class DerivedReaderWithStaleChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.direction = 'test-preprocess-stale-{}'.format(os.getpid())
+        self.source = camera_message_framework.Creator(self.direction, IMAGE.nbytes)
+        self.source.write_frame(IMAGE, 1234)
+
+        pid = os.fork()
+        if pid == 0:
+            stage = camera_message_framework.Creator(
+                preprocess.channel_name(self.direction, 'RGB2LAB'), IMAGE.nbytes)
+            stage.write_frame(IMAGE, 1000)
+            stage.cleanup()
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+    def tearDown(self):
+        self.source.cleanup()
+        os.remove('/dev/shm/auv_visiond-' + self.direction)
+        os.remove('/dev/shm/auv_visiond-' + preprocess.channel_name(self.direction, 'RGB2LAB'))
+
+    def test_ignores_channel_without_writer(self):
+        with mock.patch.object(preprocess, 'logger') as logger:
+            reader = preprocess.DerivedReader(self.direction, ['RGB2LAB'], timeout=0.3)
+
+        self.assertEqual(logger.warn.call_count, 1)
+        self.assertEqual(reader.channels, [])
+
+        image, acq_time, derived = reader.get_next_frame()
+        np.testing.assert_array_equal(image, IMAGE)
+        self.assertEqual(acq_time, 1234)
+        self.assertEqual(derived, {})
+        reader.cleanup()
+
+# A preprocessing stage that publishes its channels several frames after the
+# capture source, so the matching source frames have left the ring
+class DerivedReaderWithLaggingStageTest(unittest.TestCase):
+    LAG = 4
+
+    def setUp(self):
+        self.direction = 'test-preprocess-lag-{}'.format(os.getpid())
+        self.source = camera_message_framework.Creator(self.direction, IMAGE.nbytes)
+        self.stage = camera_message_framework.Creator(
+            preprocess.channel_name(self.direction, 'RGB2LAB'), IMAGE.nbytes)
+        self.stopped = threading.Event()
+        self.writer = threading.Thread(target=self.write_frames)
+
+    def tearDown(self):
+        self.stopped.set()
+        self.writer.join()
+        self.source.cleanup()
+        self.stage.cleanup()
+        os.remove('/dev/shm/auv_visiond-' + self.direction)
+        os.remove('/dev/shm/auv_visiond-' + preprocess.channel_name(self.direction, 'RGB2LAB'))
+
+    def write_frames(self):
+        acq_time = 1
+        while not self.stopped.is_set():
+            self.source.write_frame(IMAGE + acq_time % 100, acq_time)
+            if acq_time > self.LAG:
+                lagged = acq_time - self.LAG
+                self.stage.write_frame(preprocess.compute('RGB2LAB', IMAGE + lagged % 100), lagged)
+            acq_time += 1
+            time.sleep(0.01)
+
+    def test_computes_channels_from_latest_frame(self):
+        with mock.patch.object(preprocess, 'logger') as logger:
+            reader = preprocess.DerivedReader(self.direction, ['RGB2LAB'], timeout=0.3)
+            self.writer.start()
+            for _ in range(5):
+                image, acq_time, derived = reader.get_next_frame()
+                np.testing.assert_array_equal(image, IMAGE + acq_time % 100)
+                np.testing.assert_array_equal(derived['RGB2LAB'],
+                                              preprocess.compute('RGB2LAB', image))
+
+        self.assertEqual(logger.warn.call_count, 1)
+        reader.cleanup()
+
+if __name__ == '__main__':
+    unittest.main()
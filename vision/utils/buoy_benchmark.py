@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+# Benchmark for the thresholding modes of the buoy modules (see
+# vision/modules/buoy_common.py) on recorded footage. Runs a buoy module over
+# the frames of a video once per mode, given as roi_scale:threads, and reports
+# the time spent in process() and how many frames gave different results than
+# the first mode.
+
+import argparse
+import os
+import re
+import sys
+import time
+
+import cv2
+import numpy as np
+
+vision_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(os.path.join(vision_dir, 'modules'))
+
+import shm
+
+from vision import preprocess
+
+RESULT_FIELDS = ['center_x', 'center_y', 'area', 'heuristic_score']
+
+def run(module_name, video, frames, scale, threads):
+    module_file = __import__(module_name)
+    module = getattr(module_file, module_name)(None)
+    module.options_dict['roi_scale'].update(scale)
+    module.options_dict['threads'].update(threads)
+    results_group = getattr(shm, re.sub('(?<!^)([A-Z])', r'_\1', module_name).lower() + '_results')
+
+    capture = cv2.VideoCapture(video)
+    times = []
+    results = []
+    while len(times) < frames:
+        ok, mat = capture.read()
+        if not ok:
+            break
+        module.derived = {channel: preprocess.compute(channel, mat)
+                          for channel in getattr(module_file, 'derived', [])}
+        module.posted_images = []
+        start = time.perf_counter()
+        module.process(mat)
+        times.append(time.perf_counter() - start)
+        group = results_group.get()
+        results.append(tuple(getattr(group, f) for f in RESULT_FIELDS))
+    return np.array(times), results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark buoy module thresholding modes.')
+    parser.add_argument('video', type=str, help='recorded footage')
+    parser.add_argument('--module', type=str, default='RedBuoy')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--modes', type=str, nargs='+', default=['1:1', '1:4', '4:1', '4:4'],
+                        help='roi_scale:threads pairs; the first is the reference')
+    args = parser.parse_args()
+
+    print('{:>6} {:>8} {:>12} {:>12} {:>10} {:>10}'.format(
+        'scale', 'threads', 'process ms', 'p90 ms', 'speedup', 'differ'))
+    reference = None
+    for mode in args.modes:
+        scale, threads = map(int, mode.split(':'))
+        times, results = run(args.module, args.video, args.frames, scale, threads)
+        if reference is None:
+            reference = (times, results)
+        differ = sum(1 for (a, b) in zip(results, reference[1]) if a != b)
+        print('{:>6} {:>8} {:>12.2f} {:>12.2f} {:>10.2f} {:>10}'.format(
+            scale, threads, np.median(times) * 1e3, np.percentile(times, 90) * 1e3,
+            np.median(reference[0]) / np.median(times), differ))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# Benchmark for reading frames out of the camera message framework: a writer
+# process posts 1080p frames while one or more reader processes (standing in
+# for vision modules) read them, either copying each frame out of shared
+# memory (Accessor.get_next_frame) or borrowing it (Accessor.borrow_next_frame).
+# Reports how long after being written each frame reached the readers, the
+# readers' CPU time per frame and how many bytes per second they copied.
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from vision import camera_message_framework
+
+# where the framework keeps its shared memory (see camera_message_framework.cpp)
+FILE_ADDRESS_BASE = '/dev/shm/auv_visiond-'
+
+def writer(name, shape, fps, frames, slots, ready):
+    size = shape[0] * shape[1] * shape[2]
+    framework = camera_message_framework.Creator(name, size, slots)
+    image = np.zeros(shape, dtype=np.uint8)
+    ready.wait()
+    time.sleep(0.5) # let every reader block on its first read
+    for i in range(frames):
+        image[::64, ::64] = i % 256
+        # acquisition time in microseconds, so readers can measure latency
+        framework.write_frame(image, int(time.time() * 1e6))
+        if fps > 0:
+            time.sleep(1. / fps)
+    # an acquisition time of 0 tells the readers to stop
+    framework.write_frame(image, 0)
+    time.sleep(0.5)
+    framework.cleanup()
+
+def reader(name, mode, ready, results):
+    accessor = camera_message_framework.Accessor(name)
+    ready.wait()
+    latencies = []
+    copied = 0
+    expired = 0
+    start = None
+    cpu = time.process_time()
+    while True:
+        try:
+            if mode == 'copy':
+                image, acq_time = accessor.get_next_frame()
+                copied += image.nbytes
+            else:
+                borrowed = accessor.borrow_next_frame()
+                image, acq_time = borrowed.image, borrowed.acq_time
+            end = time.time()
+        except camera_message_framework.StateError:
+            break
+        if acq_time == 0:
+            break
+        # touch the image like a module would
+        image[::64, ::64].sum()
+        if mode == 'borrow' and not borrowed.valid():
+            expired += 1
+        if start is None:
+            start = end
+        latencies.append(end - acq_time / 1e6)
+    elapsed = time.time() - start if start is not None else 0
+    cpu = (time.process_time() - cpu) / max(len(latencies), 1)
+    results.put((np.array(latencies), cpu, copied, elapsed, accessor.dropped, expired))
+
+def run(mode, modules, args):
+    # a fresh framework for every run, so readers never see an earlier run's frames
+    name = 'framework-benchmark-{}-{}-{}'.format(os.getpid(), mode, modules)
+    shape = (args.height, args.width, 3)
+    ctx = multiprocessing.get_context('fork')
+    # the writer and every reader wait on this before starting
+    ready = ctx.Barrier(modules + 1)
+    results = ctx.Queue()
+    w = ctx.Process(target=writer, args=(name, shape, args.fps, args.frames, args.slots, ready))
+    w.start()
+    time.sleep(0.2)
+    readers = [ctx.Process(target=reader, args=(name, mode, ready, results))
+               for _ in range(modules)]
+    for r in readers:
+        r.start()
+
+    stats = [results.get() for _ in readers]
+    for p in readers + [w]:
+        p.join()
+    os.remove(FILE_ADDRESS_BASE + name)
+
+    latencies = np.concatenate([s[0] for s in stats])
+    cpu = np.mean([s[1] for s in stats])
+    copied = sum(s[2] for s in stats)
+    elapsed = max(s[3] for s in stats)
+    dropped = sum(s[4] for s in stats)
+    expired = sum(s[5] for s in stats)
+    print('{:>6} {:>7} {:>12.3f} {:>12.3f} {:>12.3f} {:>10.2f} {:>8} {:>8}'.format(
+        mode, modules,
+        np.median(latencies) * 1e3, np.percentile(latencies, 99) * 1e3,
+        cpu * 1e3,
+        copied / elapsed / 1e9 if elapsed > 0 else 0,
+        dropped, expired))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark camera message framework reads.')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=float, default=30, help='write rate; 0 writes as fast as possible')
+    parser.add_argument('--frames', type=int, default=150)
+    parser.add_argument('--slots', type=int, default=camera_message_framework.DEFAULT_SLOTS)
+    parser.add_argument('--modules', type=int, nargs='+', default=[1, 4], help='reader counts to test')
+    args = parser.parse_args()
+
+    print('{}x{} frames, {} slots, {} fps'.format(args.width, args.height, args.slots, args.fps))
+    print('{:>6} {:>7} {:>12} {:>12} {:>12} {:>10} {:>8} {:>8}'.format(
+        'mode', 'modules', 'latency ms', 'p99 ms', 'cpu ms', 'copy GB/s', 'dropped', 'expired'))
+    for modules in args.modules:
+        for mode in ('copy', 'borrow'):
+            run(mode, modules, args)
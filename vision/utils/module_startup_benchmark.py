@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Benchmark for switching a vision module on and off, either by forking a new
+# process for it (as visiond does without the module pool) or through the
+# module pool. A stand-in capture source posts frames for the module's
+# directions. Reports how long after a module is switched on it finishes its
+# first frame, and how long after it is switched off it stops.
+#
+# The vision daemon must not be running, as the stand-in capture sources take
+# its place.
+
+import argparse
+import os
+import signal
+import sys
+import time
+
+import numpy as np
+
+vision_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, vision_dir)
+sys.path.append(os.path.join(vision_dir, 'modules'))
+
+import shm
+
+import visiond
+import vision_common
+import module_pool
+from vision import camera_message_framework
+
+TIMEOUT = 30
+
+# post frames to the module's capture sources until terminated. this is intended to be ran as a
+# separate process
+def capture_source(module_name, shape, fps):
+    module_file = __import__(module_name)
+    directions = getattr(module_file, 'capture_sources', None) or [module_file.capture_source]
+    size = shape[0] * shape[1] * shape[2]
+    frameworks = [camera_message_framework.Creator(d, size) for d in directions]
+    image = np.zeros(shape, dtype=np.uint8)
+
+    def terminate(*args):
+        for framework in frameworks:
+            framework.cleanup()
+        os._exit(0)
+    signal.signal(signal.SIGTERM, terminate)
+
+    while True:
+        for framework in frameworks:
+            framework.write_frame(image, int(time.time() * 1000))
+        time.sleep(1. / fps)
+
+# fork target(*args) as visiond does
+def fork(target, *args):
+    try:
+        vision_common.fork(target, args=args)
+    except SystemExit:
+        # the forked process has finished; do not run the benchmark's cleanup
+        os._exit(0)
+
+# wait until var satisfies condition, returning how long that took
+def wait_for(var, condition, start):
+    while not condition(var.get()):
+        if time.time() - start > TIMEOUT:
+            raise RuntimeError('timed out')
+        time.sleep(0.0005)
+    return time.time() - start
+
+def toggle(module_name, module_shm, start_module):
+    frames = getattr(shm.vision_module_frames, module_name)
+    fps = getattr(shm.vision_module_fps, module_name)
+
+    frames.set(0)
+    start = time.time()
+    module_shm.set(True)
+    start_module()
+    on = wait_for(frames, lambda v: v > 0, start)
+
+    # a stopping module publishes an fps of 0 and then its frame count
+    fps.set(-1)
+    frames.set(-1)
+    start = time.time()
+    module_shm.set(False)
+    off = wait_for(fps, lambda v: v == 0, start)
+    wait_for(frames, lambda v: v >= 0, start)
+    return on, off
+
+def report(mode, times):
+    on, off = np.array(times).T * 1e3
+    print('{:>5} {:>12.1f} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+        mode, np.median(on), on.max(), np.median(off), off.max()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark switching vision modules on and off.')
+    parser.add_argument('--module', type=str, default='Forward')
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--fps', type=float, default=30, help='stand-in capture source rate')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=960)
+    parser.add_argument('--spares', type=int, default=module_pool.DEFAULT_SPARES,
+                        help='idle processes kept by the module pool')
+    args = parser.parse_args()
+
+    module_name, module_shm = vision_common.module_by_name(args.module)
+    for (_, other) in vision_common.all_vision_modules():
+        other.set(False)
+
+    source = os.fork()
+    if source == 0:
+        capture_source(module_name, (args.height, args.width, 3), args.fps)
+    time.sleep(0.5)
+
+    try:
+        print('{}, {} trials'.format(module_name, args.trials))
+        print('{:>5} {:>12} {:>12} {:>12} {:>12}'.format(
+            'mode', 'on ms', 'on max ms', 'off ms', 'off max ms'))
+
+        times = [toggle(module_name, module_shm,
+                        lambda: fork(visiond.run_module, module_name))
+                 for _ in range(args.trials)]
+        report('fork', times)
+
+        fork(module_pool.run_pool, visiond.run_module, args.spares)
+        try:
+            # the first start waits for the pool to preload the module files
+            toggle(module_name, module_shm, lambda: None)
+            times = [toggle(module_name, module_shm, lambda: None)
+                     for _ in range(args.trials)]
+            report('pool', times)
+        finally:
+            pid = module_pool.pool_pid()
+            if pid is not None:
+                os.kill(pid, signal.SIGTERM)
+    finally:
+        module_shm.set(False)
+        os.kill(source, signal.SIGTERM)
+        os.waitpid(source, 0)
@@ -24,6 +24,9 @@ from auvlog.client import log as auvlog
 
 import vision_common
 from vision import camera_message_framework
+from vision import preprocess
+import module_pool
+from vision.telemetry import ModuleTelemetry
 from capture_sources import CaptureSource
 
 
@@ -35,6 +38,7 @@ logger = auvlog.vision
 def run_capture_source(capture_source_direction, capture_source_parameters):
     source_type = capture_source_parameters['type']
     del capture_source_parameters['type']
+    slots = capture_source_parameters.pop('slots', camera_message_framework.DEFAULT_SLOTS)
     capture_source_class = getattr(__import__(source_type), source_type)
 
     status_file = os.path.join(dirname, 'status', capture_source_direction)
@@ -44,6 +48,7 @@ def run_capture_source(capture_source_direction, capture_source_parameters):
     try:
         source = capture_source_class(capture_source_direction.lower(),
                                       **capture_source_parameters)
+        source.slots = slots
 
         def signal_handler(*args, **kwargs):
             os.remove(status_file)
@@ -57,14 +62,17 @@ def run_capture_source(capture_source_direction, capture_source_parameters):
         sys.stdout.flush()
         sys.stderr.flush()
 
-# run a module forever. this is intended to be ran as a separate process
-def run_module(module_name):
+# run a module until it is switched off. this is intended to be ran as a
+# separate process. the module file is reloaded unless reload_module is False
+def run_module(module_name, reload_module=True):
     print("Running: " + str(module_name))
     m_logger = getattr(logger.module, module_name)
     sys.path.append('{}/modules'.format(dirname))
 
     # find the module file and the module class within it
-    module_file = imp.reload(__import__(module_name))
+    module_file = __import__(module_name)
+    if reload_module:
+        module_file = imp.reload(module_file)
     module_class = getattr(module_file, module_name)
 
     m_logger.log('running module')
@@ -84,9 +92,15 @@ def run_module(module_name):
         sys.exit(0)
     m_logger.log('connecting {} to {}'.format(module_name, directions))
 
+    # ask the preprocessing stages for the derived images the module uses
+    channels = getattr(module_file, 'derived', [])
+    if channels:
+        for d in directions:
+            preprocess.request_channels(module_name, d, channels)
+            atexit.register(preprocess.withdraw_channels, module_name, d)
 
-    # create the accessor for the capture source framework
-    capture_source_frameworks = [camera_message_framework.Accessor(d) for d in directions]
+    # create the readers for the capture source frameworks
+    capture_source_frameworks = [preprocess.DerivedReader(d, channels) for d in directions]
     buffer_size = [f.buffer_size for f in capture_source_frameworks]
 
     # create the module framework
@@ -115,30 +129,34 @@ def run_module(module_name):
 
     posted_images = set()
     module_shm = getattr(shm.vision_modules, module_name)
+    telemetry = ModuleTelemetry(module_name)
 
     while module_shm.get():
         module.posted_images = []
 
-        next_images, acq_times = zip(*map(lambda f : f.get_next_frame(),
-                                          capture_source_frameworks))
+        next_images, acq_times, derived = zip(*map(lambda f : f.get_next_frame(),
+                                                   capture_source_frameworks))
 
         with option_lock:
             try:
                 original_options = {option_name: module.options_dict[option_name].value for option_name in module.options_dict}
-                curr_time = time.time()*1000
-                avg_latency = sum(map(lambda t: curr_time - t, acq_times)) / len(acq_times)
-                m_logger.log('{} image latency to {}: {}ms'.format(directions, module_name, avg_latency))
+                telemetry.frame_started(acq_times, [f.frames_written() for f in capture_source_frameworks])
 
                 if requested_single_capture_source:
                     module.acq_time = acq_times[0]
+                    module.derived = derived[0]
                     module.process(next_images[0])
                 else:
                     module.acq_time = acq_times
+                    module.derived = derived
                     module.process(next_images)
 
             except Exception as e:
                 sys.stderr.write('{}\n'.format(e))
                 traceback.print_exc(file=sys.stderr)
+            summary = telemetry.frame_finished()
+            if summary is not None:
+                m_logger.telemetry(summary)
             # if the option value has changed, notify the watchers
             for option_name in original_options:
                 option = module.options_dict[option_name]
@@ -155,6 +173,8 @@ def run_module(module_name):
                 posted_images.add(tag)
             module_framework.write_image(tag, image, min(acq_times))
 
+    telemetry.stopped()
+
 # start the vision daemon from a specified config file
 def start_daemon(config_file_name):
     with open(config_file_name) as config_file:
@@ -171,9 +191,21 @@ def start_daemon(config_file_name):
         vision_common.fork(run_capture_source,
                            args=(capture_source_name,
                                  config['capture_sources'][capture_source_name]))
+        vision_common.fork(preprocess.run_preprocess,
+                           args=(capture_source_name.lower(),))
 
     logger.log('started all capture sources')
 
+    # modules are run by a pool of pre-warmed processes unless module_pool is 0
+    spares = config.get('module_pool', module_pool.DEFAULT_SPARES)
+    if spares:
+        logger.log('starting module pool')
+        vision_common.fork(module_pool.run_pool, args=(run_module, spares))
+        # so that run_modules hands the initial modules to it instead of forking
+        start_time = time.time()
+        while module_pool.pool_pid() is None and time.time() - start_time < 5:
+            time.sleep(0.01)
+
     modules_to_start = []
 
     if 'modules' in config:
@@ -188,8 +220,10 @@ def start_daemon(config_file_name):
     logger.log('Starting vision processing')
     return modules_to_start
 
-# fork all of the specified modules
+# start all of the specified modules, through the module pool if it is running
+# and otherwise by forking
 def run_modules(modules, kill_old_modules=True):
+    pooled = module_pool.pool_pid() is not None
     for i, module in enumerate(modules):
         try:
             module_name, module_shm = vision_common.module_by_name(module)
@@ -202,7 +236,8 @@ def run_modules(modules, kill_old_modules=True):
             time.sleep(0.5)
 
         module_shm.set(True)
-        vision_common.fork(run_module, args=(module_name,))
+        if not pooled:
+            vision_common.fork(run_module, args=(module_name,))
 
 
 def stop_modules(modules):
@@ -230,12 +265,16 @@ def status():
         #print capture sources
         print('Capture Sources:')
         for filename in os.listdir(os.path.join(dirname, 'status')):
-            if filename == '.gitignore':
+            if filename in ('.gitignore', os.path.basename(module_pool.status_file)):
                 continue
             with open(os.path.join(dirname, 'status', filename)) as f:
                 print('{}: {}'.format(filename, f.read()))
         #print modules
         print()
+        pid = module_pool.pool_pid()
+        if pid is not None:
+            print('Module pool: {}'.format(pid))
+            print()
         print('Modules:')
         for module_name in (x[0] for x in shm.vision_modules._fields):
             if getattr(shm.vision_modules, module_name).get():